@@ -6,8 +6,12 @@ from os.path import join, dirname, abspath
 PROJECT_DIR = dirname(dirname(abspath(__file__)))
 RSC_PATH = join(PROJECT_DIR, 'resources')
 DATA_PATH = join(RSC_PATH, 'dataset')
+STREAMS_PATH = join(DATA_PATH, 'streams')
 PRED_PATH = join(RSC_PATH, 'predictions')
 CHECKPOINT_PATH = join(RSC_PATH, 'checkpoints')
+VALIDATION_PATH = join(RSC_PATH, 'validation')
+SWEEPS_PATH = join(RSC_PATH, 'sweeps')
+COMPILE_CACHE_PATH = join(RSC_PATH, 'cache')
 LOGS_PATH = join(PROJECT_DIR, 'resources', 'logs')
 DATASET_NAME = 'FAIRS_dataset.csv'
 
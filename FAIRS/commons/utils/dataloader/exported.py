@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+
+from FAIRS.commons.utils.learning.lookup import LookupFAIRSnet
+from FAIRS.commons.constants import CONFIG, CHECKPOINT_PATH
+from FAIRS.commons.logger import logger
+
+
+###############################################################################
+def checkpoint_selection_menu(models_list):
+
+    index_list = [idx + 1 for idx, item in enumerate(models_list)]
+    print('Currently available pretrained models:')
+    for i, directory in enumerate(models_list):
+        print(f'{i + 1} - {directory}')
+    while True:
+        try:
+            selection_index = int(input('\nSelect the pretrained model: '))
+            print()
+        except ValueError:
+            logger.error('Invalid choice for the pretrained model, asking again')
+            continue
+        if selection_index in index_list:
+            break
+        else:
+            logger.warning('Model does not exist, please select a valid index')
+
+    return selection_index
+
+
+# [EXPORTED MODEL SERIALIZATION]
+###############################################################################
+# Exported models are self-contained numpy artifacts saved within the checkpoint
+# folder, that can be loaded and used without importing keras or torch
+###############################################################################
+class ExportedModelSerializer:
+
+    def __init__(self):
+        self.export_folder = 'exported'
+
+    #--------------------------------------------------------------------------
+    def save_exported_model(self, model : LookupFAIRSnet, checkpoint_path, metadata=None):
+        export_path = os.path.join(checkpoint_path, self.export_folder)
+        model.save(export_path, metadata)
+        logger.info(f'Exported model has been saved in {export_path}')
+
+    #--------------------------------------------------------------------------
+    def load_exported_model(self, checkpoint_path):
+        export_path = os.path.join(checkpoint_path, self.export_folder)
+        model = LookupFAIRSnet.load(export_path)
+        config_path = os.path.join(checkpoint_path, 'configurations', 'configurations.json')
+        with open(config_path, 'r') as file:
+            configuration = json.load(file)
+
+        return model, configuration
+
+    #--------------------------------------------------------------------------
+    def scan_exported_checkpoints(self):
+        model_folders = []
+        for entry in os.scandir(CHECKPOINT_PATH):
+            manifest_path = os.path.join(entry.path, self.export_folder, 'manifest.json')
+            if entry.is_dir() and os.path.isfile(manifest_path):
+                model_folders.append(entry.name)
+
+        return model_folders
+
+    #--------------------------------------------------------------------------
+    def select_and_load_exported_model(self):
+        model_folders = self.scan_exported_checkpoints()
+        if len(model_folders) == 0:
+            logger.error('No exported models in resources, export a checkpoint first')
+            sys.exit()
+
+        if len(model_folders) > 1:
+            selection_index = checkpoint_selection_menu(model_folders)
+            checkpoint_path = os.path.join(CHECKPOINT_PATH, model_folders[selection_index-1])
+        else:
+            checkpoint_path = os.path.join(CHECKPOINT_PATH, model_folders[0])
+            logger.info(f'Since only exported model {os.path.basename(checkpoint_path)} is available, it will be loaded directly')
+
+        model, configuration = self.load_exported_model(checkpoint_path)
+
+        return model, configuration, checkpoint_path
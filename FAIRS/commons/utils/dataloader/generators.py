@@ -1,9 +1,22 @@
 import numpy as np
+import pandas as pd
 
-from FAIRS.commons.utils.dataloader.serializer import get_extraction_dataset
 from FAIRS.commons.utils.process.mapping import RouletteMapper
 from FAIRS.commons.constants import CONFIG
 from FAIRS.commons.logger import logger
+
+
+# get FAIRS data for training
+###############################################################################
+def get_extraction_dataset(path, sample_size=None):     
+
+    if sample_size is None:
+        sample_size = CONFIG["dataset"]["SAMPLE_SIZE"]    
+    dataset = pd.read_csv(path, encoding='utf-8', sep=';')
+    num_samples = int(dataset.shape[0] * sample_size)
+    dataset = dataset[(dataset.shape[0] - num_samples):]
+
+    return dataset
     
 
 # [CUSTOM DATA GENERATOR FOR TRAINING]
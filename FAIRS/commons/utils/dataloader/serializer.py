@@ -5,48 +5,16 @@ import numpy as np
 import pandas as pd
 from datetime import datetime
 import keras
+import torch
 
+from FAIRS.commons.utils.dataloader.exported import checkpoint_selection_menu
+from FAIRS.commons.utils.learning.quantization import FAIRSnetQuantizer
+from FAIRS.commons.utils.learning.models import FAIRSnet
 from FAIRS.commons.constants import CONFIG, DATA_PATH, DATASET_NAME, CHECKPOINT_PATH
 from FAIRS.commons.logger import logger
 
 
 
-###############################################################################
-def checkpoint_selection_menu(models_list):
-
-    index_list = [idx + 1 for idx, item in enumerate(models_list)]     
-    print('Currently available pretrained models:')             
-    for i, directory in enumerate(models_list):
-        print(f'{i + 1} - {directory}')                         
-    while True:
-        try:
-            selection_index = int(input('\nSelect the pretrained model: '))
-            print()
-        except ValueError:
-            logger.error('Invalid choice for the pretrained model, asking again')
-            continue
-        if selection_index in index_list:
-            break
-        else:
-            logger.warning('Model does not exist, please select a valid index')
-
-    return selection_index
-
-
-# get FAIRS data for training
-###############################################################################
-def get_extraction_dataset(path, sample_size=None):     
-
-    if sample_size is None:
-        sample_size = CONFIG["dataset"]["SAMPLE_SIZE"]    
-    dataset = pd.read_csv(path, encoding='utf-8', sep=';')
-    num_samples = int(dataset.shape[0] * sample_size)
-    dataset = dataset[(dataset.shape[0] - num_samples):]
-
-    return dataset
-
-   
-
 # [DATA SERIALIZATION]
 ###############################################################################
 class DataSerializer:
@@ -62,25 +30,104 @@ class DataSerializer:
 
     #--------------------------------------------------------------------------
     def load_preprocessed_data(self, path):
+        data_path = os.path.join(path, 'data', 'train_data.npy')
+        data = np.load(data_path)
 
-        # load preprocessed train and validation data
-        train_file_path = os.path.join(path, 'XREPORT_train.csv') 
-        val_file_path = os.path.join(path, 'XREPORT_validation.csv')
-        train_data = pd.read_csv(train_file_path, encoding='utf-8', sep=';', low_memory=False)
-        validation_data = pd.read_csv(val_file_path, encoding='utf-8', sep=';', low_memory=False)
-
-        # transform text strings into array of words
-        train_data['tokens'] = train_data['tokens'].apply(lambda x : [int(f) for f in x.split()])
-        validation_data['tokens'] = validation_data['tokens'].apply(lambda x : [int(f) for f in x.split()])
-        # load preprocessing metadata
-        metadata_path = os.path.join(path, 'preprocessing_metadata.json')
-        with open(metadata_path, 'r') as file:
-            metadata = json.load(file)
-        
-        return train_data, validation_data, metadata   
+        return data 
         
            
 
+
+# [RAW WEIGHTS SERIALIZATION]
+###############################################################################
+# Weights-only format made of a single flat binary file. The file starts with
+# a magic string and the length of a JSON header holding name, shape, dtype and
+# offset of each weight, followed by the raw weight buffers aligned to 64 bytes.
+# Weights are matched to the model by order, as keras layer names depend on how
+# many models were built in the same session. The file is memory-mapped when
+# loading, so that the weights of CPU models point to the mapped pages without
+# being copied, while a private copy is made only for pages written to
+###############################################################################
+class RawWeightsSerializer:
+
+    def __init__(self):
+        self.file_name = 'saved_model.weights.bin'
+        self.magic = b'FAIRSWTS'
+        self.alignment = 64
+
+    #--------------------------------------------------------------------------
+    def _align(self, offset):
+        return -(-offset // self.alignment) * self.alignment
+
+    # the file is written under a temporary name and then renamed, so that models
+    # currently mapping the previous file are not affected
+    #--------------------------------------------------------------------------
+    def save_weights(self, model : keras.Model, path):
+        arrays = [np.ascontiguousarray(keras.ops.convert_to_numpy(w)) for w in model.weights]
+        tensors, offset = [], 0
+        for weight, array in zip(model.weights, arrays):
+            tensors.append({'name' : weight.path, 'shape' : list(array.shape),
+                            'dtype' : str(array.dtype), 'offset' : offset, 'nbytes' : array.nbytes})
+            offset = self._align(offset + array.nbytes)
+        header = json.dumps({'format_version' : 1, 'alignment' : self.alignment,
+                             'tensors' : tensors}).encode('utf-8')
+        data_start = self._align(len(self.magic) + 8 + len(header))
+
+        file_path = os.path.join(path, self.file_name)
+        with open(f'{file_path}.tmp', 'wb') as file:
+            file.write(self.magic + np.uint64(len(header)).tobytes() + header)
+            for tensor, array in zip(tensors, arrays):
+                file.seek(data_start + tensor['offset'])
+                file.write(array.tobytes())
+            file.truncate(data_start + offset)
+        os.replace(f'{file_path}.tmp', file_path)
+
+    #--------------------------------------------------------------------------
+    def read_header(self, file_path):
+        with open(file_path, 'rb') as file:
+            if file.read(len(self.magic)) != self.magic:
+                raise ValueError(f'{file_path} is not a raw weights file')
+            header_size = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+            header = json.loads(file.read(header_size))
+
+        return header, self._align(len(self.magic) + 8 + header_size)
+
+    # the file is mapped copy-on-write, hence training a loaded model never
+    # modifies the saved weights
+    #--------------------------------------------------------------------------
+    def load_weights(self, model : keras.Model, path):
+        file_path = os.path.join(path, self.file_name)
+        header, data_start = self.read_header(file_path)
+        tensors = header['tensors']
+        if len(tensors) != len(model.weights):
+            raise ValueError(f'Raw weights file holds {len(tensors)} weights, '
+                             f'while the model has {len(model.weights)}')
+
+        buffer = np.memmap(file_path, dtype=np.uint8, mode='c')
+        with torch.no_grad():
+            for weight, tensor in zip(model.weights, tensors):
+                if list(weight.shape) != tensor['shape']:
+                    raise ValueError(f'Shape mismatch for {tensor["name"]}: '
+                                     f'{tensor["shape"]} vs {list(weight.shape)}')
+                start = data_start + tensor['offset']
+                array = buffer[start:start + tensor['nbytes']].view(tensor['dtype']).reshape(tensor['shape'])
+                # CPU weights are swapped with views of the mapped file, while
+                # weights on other devices require a copy
+                if weight.value.device.type == 'cpu' and str(weight.value.dtype) == f'torch.{tensor["dtype"]}':
+                    weight.value.data = torch.from_numpy(array)
+                else:
+                    weight.assign(array)
+
+        return model
+
+    # the model is built from the configuration saved with the checkpoint and
+    # then bound to the mapped weights, skipping the keras archive altogether
+    #--------------------------------------------------------------------------
+    def load_model(self, path, configuration):
+        model = FAIRSnet(configuration).get_model(model_summary=False)
+
+        return self.load_weights(model, path)
+
     
 # [MODEL SERIALIZATION]
 ###############################################################################
@@ -88,6 +135,7 @@ class ModelSerializer:
 
     def __init__(self):
         self.model_name = 'FAIRS'
+        self.raw_weights = RawWeightsSerializer()
 
     # function to create a folder where to save model checkpoints
     #--------------------------------------------------------------------------
@@ -105,8 +153,28 @@ class ModelSerializer:
     def save_pretrained_model(self, model : keras.Model, path):
         model_files_path = os.path.join(path, 'saved_model.keras')
         model.save(model_files_path)
+        # raw weights are saved alongside the keras model for fast loading
+        self.raw_weights.save_weights(model, path)
         logger.info(f'Training session is over. Model has been saved in folder {path}')
 
+    # the target model weights are saved alongside the Q model, so that resumed
+    # sessions do not restart with a target model equal to the Q model
+    #--------------------------------------------------------------------------
+    def save_target_model(self, target_model : keras.Model, path):
+        weights_path = os.path.join(path, 'target_model.weights.h5')
+        target_model.save_weights(weights_path)
+
+    #--------------------------------------------------------------------------
+    def load_target_model(self, path):
+        target_model = self.load_checkpoint(path)
+        weights_path = os.path.join(path, 'target_model.weights.h5')
+        if os.path.exists(weights_path):
+            target_model.load_weights(weights_path)
+        else:
+            logger.warning('No saved target model weights found, the Q model weights will be used')
+
+        return target_model
+
     #--------------------------------------------------------------------------
     def save_session_configuration(self, path, history : dict, configurations : dict):
 
@@ -178,17 +246,35 @@ class ModelSerializer:
                     show_layer_names=True, show_layer_activations=True, 
                     expand_nested=True, rankdir='TB', dpi=400)
             
+    # raw weights are memory-mapped into a model built from the checkpoint
+    # configuration if selected and available, which does not restore the
+    # optimizer state and is therefore meant for inference and evaluation
     #--------------------------------------------------------------------------
-    def load_checkpoint(self, checkpoint_name):           
+    def load_checkpoint(self, checkpoint_name, quantized=False, raw_weights=False):           
 
         checkpoint_path = os.path.join(CHECKPOINT_PATH, checkpoint_name)
+        # load the int8 variant saved alongside the keras model if requested
+        if quantized:
+            configuration, _ = self.load_session_configuration(checkpoint_path)
+            quantizer = FAIRSnetQuantizer(configuration)
+            model = quantizer.load_quantized_model(checkpoint_path)
+            logger.info('Dynamically quantized int8 model has been loaded')
+
+            return model
+
+        if raw_weights:
+            if os.path.exists(os.path.join(checkpoint_path, self.raw_weights.file_name)):
+                configuration, _ = self.load_session_configuration(checkpoint_path)
+                return self.raw_weights.load_model(checkpoint_path, configuration)
+            logger.warning('No raw weights found in checkpoint, the keras model will be loaded')
+
         model_path = os.path.join(checkpoint_path, 'saved_model.keras') 
         model = keras.models.load_model(model_path) 
         
         return model
             
     #-------------------------------------------------------------------------- 
-    def select_and_load_checkpoint(self): 
+    def select_and_load_checkpoint(self, quantized=False, raw_weights=False): 
 
         # look into checkpoint folder to get pretrained model names      
         model_folders = self.scan_checkpoints_folder()
@@ -210,7 +296,7 @@ class ModelSerializer:
                           
         # effectively load the model using keras builtin method
         # load configuration data from .json file in checkpoint folder
-        model = self.load_checkpoint(checkpoint_path)       
+        model = self.load_checkpoint(checkpoint_path, quantized, raw_weights)       
         configuration, history = self.load_session_configuration(checkpoint_path)           
             
         return model, configuration, history, checkpoint_path
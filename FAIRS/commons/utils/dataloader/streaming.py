@@ -0,0 +1,379 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+import numpy as np
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from FAIRS.commons.utils.process.mapping import RouletteMapper
+from FAIRS.commons.constants import CONFIG, STREAMS_PATH, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# [SPIN ENCODER]
+###############################################################################
+# Spins are received as lines holding either a plain number, as in the dataset
+# files, or a JSON object {"table": <table id>, "number": <0-36>}. Lines without
+# a table are assigned to the table of their source. Valid spins are encoded
+# in bulk with the encoding table of the roulette mapper, producing the same
+# columns of the preprocessed dataset (timeseries, position, encoded color)
+###############################################################################
+class SpinEncoder:
+
+    def __init__(self):
+        self.mapper = RouletteMapper()
+        self.encoding_table = self.mapper.get_encoding_table()
+        self.rejected = 0
+
+    #--------------------------------------------------------------------------
+    def parse_line(self, line : bytes, default_table):
+        try:
+            if line.startswith(b'{'):
+                payload = json.loads(line)
+                table, number = str(payload.get('table', default_table)), payload['number']
+            else:
+                table, number = default_table, int(line)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.rejected += 1
+            return None
+
+        if isinstance(number, bool) or not isinstance(number, int) or not 0 <= number < NUMBERS:
+            self.rejected += 1
+            return None
+
+        return table, number
+
+    # batches hold the table of each spin, the encoded spins and the time at
+    # which each spin has been received, together with the rejected lines
+    #--------------------------------------------------------------------------
+    def encode(self, spins):
+        tables, numbers, received = zip(*spins)
+        numbers = np.fromiter(numbers, dtype=np.int32, count=len(spins))
+        batch = {'tables' : list(tables),
+                 'spins' : self.encoding_table[numbers],
+                 'received' : np.fromiter(received, dtype=np.float64, count=len(spins)),
+                 'rejected' : self.rejected}
+        self.rejected = 0
+
+        return batch
+
+
+# [STREAMING SPIN INGESTION]
+###############################################################################
+# Follows append-only spin files (tail -f style) and line-delimited JSON sent
+# over a local TCP or Unix socket. Received spins are buffered and delivered in
+# batches, once either MAX_BATCH_SIZE spins are pending or the deadline since
+# the first pending spin has expired. Sinks are called with each batch on a
+# dedicated thread, so that sources keep being read while a batch is handled,
+# and spins received in the meantime are delivered with the next batch
+###############################################################################
+class SpinIngestion:
+
+    def __init__(self):
+        self.files = CONFIG['streaming']['FILES']
+        self.host = CONFIG['streaming']['HOST']
+        self.port = CONFIG['streaming']['PORT']
+        self.unix_socket = CONFIG['streaming']['UNIX_SOCKET']
+        self.poll_interval = CONFIG['streaming']['POLL_INTERVAL_MS']/1000
+        self.batch_deadline = CONFIG['streaming']['BATCH_DEADLINE_MS']/1000
+        self.max_batch_size = CONFIG['streaming']['MAX_BATCH_SIZE']
+
+        self.encoder = SpinEncoder()
+        self.metrics = SpinMetricsSink(CONFIG['streaming']['STATS_INTERVAL_S'])
+        self.sinks = []
+        self.pending = []
+        self.pending_since = 0.0
+        self.spins_available = None
+        self.batch_full = None
+        self.stop_event = None
+        self.connections = {}
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    # sinks are callables receiving each batch, in the order they are added
+    #--------------------------------------------------------------------------
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    # complete lines are submitted, while the trailing partial line is returned
+    # to be completed by the next chunk of data
+    #--------------------------------------------------------------------------
+    def submit_chunk(self, buffer : bytes, chunk : bytes, default_table):
+        lines = (buffer + chunk).split(b'\n')
+        received = time.perf_counter()
+        for line in lines[:-1]:
+            line = line.strip()
+            if line:
+                self.submit_line(line, default_table, received)
+
+        return lines[-1]
+
+    #--------------------------------------------------------------------------
+    def submit_line(self, line : bytes, default_table, received):
+        spin = self.encoder.parse_line(line, default_table)
+        if spin is None:
+            return
+        if not self.pending:
+            self.pending_since = received
+            self.spins_available.set()
+        self.pending.append((*spin, received))
+        if len(self.pending) >= self.max_batch_size:
+            self.batch_full.set()
+
+    # content of files existing at startup is skipped, as the history of the
+    # extractions is loaded separately. Once no new data is available, the
+    # file is checked for rotation (a new file at the same path), which is read
+    # from the start after draining the old one, and for truncation
+    #--------------------------------------------------------------------------
+    async def tail_file(self, path):
+        table = os.path.splitext(os.path.basename(path))[0]
+        file, buffer, first_open = None, b'', True
+        try:
+            while True:
+                if file is None:
+                    try:
+                        file = open(path, 'rb')
+                    except FileNotFoundError:
+                        first_open = False
+                        await asyncio.sleep(self.poll_interval)
+                        continue
+                    if first_open:
+                        file.seek(0, os.SEEK_END)
+                        first_open = False
+                    logger.debug(f'Following spins of {path}')
+
+                chunk = file.read()
+                if chunk:
+                    buffer = self.submit_chunk(buffer, chunk, table)
+                    await asyncio.sleep(0)
+                    continue
+
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None
+                if stat is None or stat.st_ino != os.fstat(file.fileno()).st_ino:
+                    # lines written right before the rotation are read, and a
+                    # last line without newline is considered complete
+                    buffer = self.submit_chunk(buffer, file.read() + b'\n', table)
+                    file.close()
+                    file, buffer = None, b''
+                    continue
+                if stat.st_size < file.tell():
+                    logger.debug(f'{path} has been truncated, reading from the start')
+                    file.seek(0)
+                    buffer = b''
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            if file is not None:
+                file.close()
+
+    # data is read in chunks rather than line by line, as many spins are often
+    # available at once. Spins without a table are assigned to table "socket"
+    #--------------------------------------------------------------------------
+    async def handle_connection(self, reader, writer):
+        default_table, buffer = 'socket', b''
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer = self.submit_chunk(buffer, chunk, default_table)
+            if buffer.strip():
+                self.submit_chunk(buffer, b'\n', default_table)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    #--------------------------------------------------------------------------
+    def deliver(self, batch):
+        for sink in self.sinks:
+            try:
+                sink(batch)
+            except Exception as e:
+                logger.error(f'Streaming sink {getattr(sink, "__qualname__", sink)} has failed: {e}')
+        self.metrics.update(batch)
+
+    # the loop waits for the first pending spin, then either for the batch to be
+    # filled or for the deadline to expire, without polling in between
+    #--------------------------------------------------------------------------
+    async def delivery_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.spins_available.wait()
+            remaining = self.pending_since + self.batch_deadline - time.perf_counter()
+            if len(self.pending) < self.max_batch_size and remaining > 0:
+                try:
+                    await asyncio.wait_for(self.batch_full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            pending, self.pending = self.pending, []
+            self.spins_available.clear()
+            self.batch_full.clear()
+            await loop.run_in_executor(self.executor, self.deliver, self.encoder.encode(pending))
+
+    #--------------------------------------------------------------------------
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.spins_available = asyncio.Event()
+        self.batch_full = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        tasks = [asyncio.create_task(self.tail_file(path)) for path in self.files]
+        servers = []
+        if self.port is not None:
+            servers.append(await asyncio.start_server(self.handle_connection, self.host, self.port))
+            logger.info(f'Receiving spins on tcp://{self.host}:{self.port}')
+        if self.unix_socket is not None:
+            if os.path.exists(self.unix_socket):
+                os.remove(self.unix_socket)
+            servers.append(await asyncio.start_unix_server(self.handle_connection, self.unix_socket))
+            logger.info(f'Receiving spins on unix://{self.unix_socket}')
+        if self.files:
+            logger.info(f'Following spins appended to {len(self.files)} files')
+        delivery_task = asyncio.create_task(self.delivery_loop())
+        self.ready.set()
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # open connections are closed and their handlers left to return
+            handlers = list(self.connections.values())
+            for writer in list(self.connections):
+                writer.transport.abort()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+            delivery_task.cancel()
+            # spins still pending are delivered before returning
+            if self.pending:
+                pending, self.pending = self.pending, []
+                await self.loop.run_in_executor(self.executor, self.deliver, self.encoder.encode(pending))
+
+    # runs in the calling thread until interrupted
+    #--------------------------------------------------------------------------
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=True)
+            logger.info(f'Spin ingestion has been stopped: {self.metrics.get_stats()}')
+
+    # runs in a background thread, for instance to feed an application that
+    # keeps control of the main thread
+    #--------------------------------------------------------------------------
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.thread.join()
+        self.thread = None
+
+
+# [DATASET APPENDER]
+###############################################################################
+# Appends the streamed extractions of each table to its own file, with the same
+# format of the roulette dataset, so that these can be used for training
+###############################################################################
+class SpinDatasetAppender:
+
+    def __init__(self, path=STREAMS_PATH):
+        self.path = path
+        self.files = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    #--------------------------------------------------------------------------
+    def get_file(self, table):
+        file = self.files.get(table)
+        if file is None:
+            filename = re.sub(r'[^\w\-]', '_', table)
+            file_path = os.path.join(self.path, f'{filename}.csv')
+            is_new = not os.path.exists(file_path)
+            file = open(file_path, 'a', encoding='utf-8')
+            if is_new:
+                file.write('timeseries\n')
+            self.files[table] = file
+
+        return file
+
+    #--------------------------------------------------------------------------
+    def append_spins(self, batch):
+        extractions = defaultdict(list)
+        for table, number in zip(batch['tables'], batch['spins'][:, 0].tolist()):
+            extractions[table].append(str(number))
+        for table, numbers in extractions.items():
+            file = self.get_file(table)
+            file.write('\n'.join(numbers) + '\n')
+            file.flush()
+
+    #--------------------------------------------------------------------------
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+
+# [STREAMING METRICS]
+###############################################################################
+# Collects throughput, delivery latency (from the reception of each spin to the
+# end of the batch handling) and frequencies of the streamed numbers. Metrics
+# are updated after all sinks, and logged every STATS_INTERVAL_S seconds
+###############################################################################
+class SpinMetricsSink:
+
+    def __init__(self, stats_interval):
+        self.stats_interval = stats_interval
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.table_spins = defaultdict(int)
+        self.number_counts = np.zeros(NUMBERS, dtype=np.int64)
+        self.total_spins = 0
+        self.rejected = 0
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+    #--------------------------------------------------------------------------
+    def update(self, batch):
+        finish_time = time.perf_counter()
+        self.latencies.extend(((finish_time - batch['received']) * 1000).tolist())
+        self.batch_sizes.append(len(batch['tables']))
+        for table in batch['tables']:
+            self.table_spins[table] += 1
+        self.number_counts += np.bincount(batch['spins'][:, 0], minlength=NUMBERS)
+        self.total_spins += len(batch['tables'])
+        self.rejected += batch['rejected']
+        if finish_time - self.last_report >= self.stats_interval:
+            logger.info(f'Streaming stats: {self.get_stats()}')
+            self.last_report = finish_time
+
+    #--------------------------------------------------------------------------
+    def get_stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        elapsed_time = time.perf_counter() - self.start_time
+
+        return {'tables' : len(self.table_spins),
+                'spins' : self.total_spins,
+                'rejected' : self.rejected,
+                'spins_per_s' : self.total_spins/elapsed_time,
+                'mean_batch_size' : float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+                'latency_ms' : {'p50' : float(p50), 'p95' : float(p95), 'p99' : float(p99)}}
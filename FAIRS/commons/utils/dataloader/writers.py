@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import zipfile
+import numpy as np
+
+from FAIRS.commons.constants import CONFIG, PRED_PATH
+from FAIRS.commons.logger import logger
+
+
+# [PREDICTIONS WRITER]
+###############################################################################
+# Predictions are written to disk in batches as soon as they are produced, so
+# that memory does not depend on the number of predicted spins. Rows hold the
+# extraction, its wheel position, its encoded color and the action suggested
+# after it, all stored as int8 (the action is -1 where no prediction is made).
+# Rows are buffered up to buffer_size and then appended to the selected file:
+#   csv: plain text with a header row
+#   npz: one array per column, assembled into the archive when closing
+#   parquet, feather: columnar files written with pyarrow, one row group or
+#   record batch per flushed buffer
+# Descriptions of the actions are saved once in a separate JSON dictionary
+###############################################################################
+class PredictionsWriter:
+
+    def __init__(self, name, action_descriptions : dict, path=PRED_PATH, file_format=None,
+                 buffer_size=65536):
+        self.file_format = CONFIG['inference']['OUTPUT_FORMAT'] if file_format is None else file_format
+        if self.file_format not in ['csv', 'npz', 'parquet', 'feather']:
+            raise ValueError(f'Unknown predictions format {self.file_format}, '
+                             'available: csv, npz, parquet, feather')
+        self.columns = ['extraction', 'position', 'color', 'expected_action']
+        self.dtype = np.int8
+        self.buffer = np.empty((buffer_size, len(self.columns)), dtype=self.dtype)
+        self.buffered = 0
+        self.num_rows = 0
+
+        self.file_path = os.path.join(path, f'{name}_predictions.{self.file_format}')
+        descriptions = {-1 : 'no prediction', **action_descriptions}
+        descriptions_path = os.path.join(path, f'{name}_actions.json')
+        with open(descriptions_path, 'w') as file:
+            json.dump({str(k) : v for k, v in descriptions.items()}, file, indent=4)
+        self.open()
+
+    #--------------------------------------------------------------------------
+    def open(self):
+        if self.file_format == 'csv':
+            self.file = open(self.file_path, 'w', newline='')
+            self.file.write(','.join(self.columns) + '\n')
+        elif self.file_format == 'npz':
+            self.column_files = [open(f'{self.file_path}.{column}.tmp', 'wb') for column in self.columns]
+        else:
+            # pyarrow is only required by the columnar formats
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = pa.schema([(column, pa.int8()) for column in self.columns])
+            if self.file_format == 'parquet':
+                self.file = pq.ParquetWriter(self.file_path, self.schema)
+            else:
+                self.file = pa.ipc.new_file(self.file_path, self.schema)
+
+    # data holds rows of (extraction, position, color) and actions the action
+    # suggested after each of them, either as an array or a single value
+    #--------------------------------------------------------------------------
+    def write(self, data : np.array, actions):
+        data = np.asarray(data)
+        actions = np.broadcast_to(np.asarray(actions), data.shape[:1])
+        written = 0
+        while written < data.shape[0]:
+            rows = min(data.shape[0] - written, self.buffer.shape[0] - self.buffered)
+            block = self.buffer[self.buffered:self.buffered + rows]
+            block[:, :3] = data[written:written + rows, :3]
+            block[:, 3] = actions[written:written + rows]
+            self.buffered += rows
+            written += rows
+            if self.buffered == self.buffer.shape[0]:
+                self.flush()
+
+    #--------------------------------------------------------------------------
+    def flush(self):
+        if self.buffered == 0:
+            return
+        rows = self.buffer[:self.buffered]
+        if self.file_format == 'csv':
+            np.savetxt(self.file, rows, fmt='%d', delimiter=',')
+        elif self.file_format == 'npz':
+            for i, column_file in enumerate(self.column_files):
+                np.ascontiguousarray(rows[:, i]).tofile(column_file)
+        else:
+            import pyarrow as pa
+            batch = pa.record_batch([pa.array(rows[:, i]) for i in range(len(self.columns))],
+                                    schema=self.schema)
+            if self.file_format == 'parquet':
+                self.file.write_batch(batch)
+            else:
+                self.file.write(batch)
+
+        self.num_rows += self.buffered
+        self.buffered = 0
+
+    # the arrays of the npz archive are streamed from the column files into the
+    # archive entries, preceded by the .npy header holding the final length
+    #--------------------------------------------------------------------------
+    def write_npz_archive(self):
+        header = {'descr' : np.lib.format.dtype_to_descr(np.dtype(self.dtype)),
+                  'fortran_order' : False, 'shape' : (self.num_rows,)}
+        with zipfile.ZipFile(self.file_path, 'w', allowZip64=True) as archive:
+            for column, column_file in zip(self.columns, self.column_files):
+                column_file.close()
+                with open(column_file.name, 'rb') as source, \
+                     archive.open(f'{column}.npy', 'w', force_zip64=True) as entry:
+                    np.lib.format.write_array_header_1_0(entry, header)
+                    shutil.copyfileobj(source, entry, 1 << 20)
+                os.remove(column_file.name)
+
+    #--------------------------------------------------------------------------
+    def close(self):
+        self.flush()
+        if self.file_format == 'npz':
+            self.write_npz_archive()
+        else:
+            self.file.close()
+        logger.info(f'{self.num_rows} predictions have been saved in {self.file_path}')
+
+        return self.file_path
+
+    #--------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    #--------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
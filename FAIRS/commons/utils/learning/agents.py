@@ -1,9 +1,10 @@
-import random
+import os
+import json
 import numpy as np
-from collections import deque
 import keras
 
 from FAIRS.commons.utils.learning.environment import RouletteEnvironment
+from FAIRS.commons.utils.learning.replay import build_replay_memory, ReplayPrefetcher
 from FAIRS.commons.constants import CONFIG, STATES
 from FAIRS.commons.logger import logger
 
@@ -12,7 +13,7 @@ from FAIRS.commons.logger import logger
 # [TOOLS FOR TRAINING MACHINE LEARNING MODELS]
 ###############################################################################
 class DQNAgent:
-    def __init__(self, configuration):
+    def __init__(self, configuration, timeseries : np.array):
         self.state_size = configuration["model"]["PERCEPTIVE_FIELD"]
         self.action_size = STATES        
         self.gamma = configuration['agent']['DISCOUNT_RATE'] 
@@ -21,16 +22,25 @@ class DQNAgent:
         self.epsilon_min = configuration['agent']['MINIMUM_ER'] 
         self.memory_size = configuration['agent']['MAX_MEMORY'] 
         self.replay_size = configuration['agent']['REPLAY_BUFFER']   
-        self.memory = deque(maxlen=self.memory_size)              
+        # transitions are stored either as perceptive fields or as indices of the
+        # timeseries, depending on the selected replay storage
+        self.memory = build_replay_memory(configuration, timeseries)              
+        self.generator = np.random.default_rng(configuration['SEED'])
+        self.steps = 0
+        self.learner = None
+        # minibatches are prepared in a background thread if prefetching is enabled
+        self.prefetcher = None
+        if configuration['training'].get('PREFETCH_BATCHES', 0) > 0:
+            self.prefetcher = ReplayPrefetcher(self.memory, configuration)
     
     #--------------------------------------------------------------------------
     def act(self, model : keras.Model, state):
         # generate a random number between 0 and 1 for exploration purposes.
         # if this number is equal or smaller to exploration rate, the agent will
         # pick a random roulette choice. It will do the same if the perceived field is empty
-        random_threshold = np.random.rand()
+        random_threshold = self.generator.random()
         if np.all(state == -1) or random_threshold <= self.epsilon:
-            random_action = np.int32(random.randrange(self.action_size))
+            random_action = np.int32(self.generator.integers(self.action_size))
             return random_action
         # if the random value is above the exploration rate, the action will
         # be predicted by the current model snapshot
@@ -40,8 +50,9 @@ class DQNAgent:
         return best_q 
 
     #--------------------------------------------------------------------------
-    def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+    def remember(self, state, action, reward, next_state, done, info):
+        self.memory.add(state, action, reward, next_state, done, info)
+        self.steps += 1
     
     # calculate the discounted future reward, using discount factor to determine 
     # how much future rewards are taken into account. Each Q-value represents the 
@@ -53,16 +64,17 @@ class DQNAgent:
 
         # this prevents an error if the batch size is larger than the replay buffer size
         batch_size = min(batch_size, self.replay_size)
-        minibatch = random.sample(self.memory, batch_size)
-
-        # minibatch is composed of multiple tuples, each containing state, action, reqard, next state and status
-        # arrays of shape (batch size, item shape) are created. Both state and next state have shape (1, perceptive field)
-        # therefor their single dimension must be squeezed out while creating the stacked array
-        states = np.array([np.squeeze(s) for s, a, r, ns, d in minibatch], dtype=np.int32)
-        actions = np.array([a for s, a, r, ns, d in minibatch], dtype=np.int32)
-        rewards = np.array([r for s, a, r, ns, d in minibatch], dtype=np.float32)
-        next_states = np.array([np.squeeze(ns) for s, a, r, ns, d in minibatch], dtype=np.int32)
-        dones = np.array([d for s, a, r, ns, d in minibatch], dtype=np.int32)
+        # minibatch arrays are gathered directly from the replay memory, where both
+        # state and next state have shape (batch size, perceptive field). Rewards
+        # are scaled and accumulated over N_STEPS transitions, with next states
+        # and done flags taken from the last accumulated transition
+        if self.prefetcher is not None:
+            if self.prefetcher.thread is None:
+                self.prefetcher.start(batch_size, environment.scale_rewards)
+            batch = self.prefetcher.get_batch()
+        else:
+            batch = self.memory.sample(batch_size, environment.scale_rewards)
+        states, actions, returns, next_states, dones, discounts = batch
 
         # Predict current Q-values
         targets = model.predict(states, verbose=0)
@@ -76,23 +88,76 @@ class DQNAgent:
         Q_futures_target = target_model.predict(next_states, verbose=0) # shape: (batch_size, action_size)
         Q_future_selected = Q_futures_target[np.arange(batch_size), best_next_actions]
 
-        # Scale rewards if your environment uses scaled rewards
-        scaled_rewards = environment.scale_rewards(rewards)
-
-        # Compute updated targets using Double DQN logic
-        updated_targets = scaled_rewards + (1 - dones) * self.gamma * Q_future_selected
+        # Compute updated targets using Double DQN logic, where the discount of
+        # the bootstrapped Q-values depends on the number of accumulated steps
+        updated_targets = returns + (1 - dones) * discounts * Q_future_selected
 
         # Update targets for the taken actions
         batch_indices = np.arange(batch_size, dtype=np.int32)
         targets[batch_indices, actions] = updated_targets
 
-        # Fit the model on the entire batch using train on batch method
-        logs = model.train_on_batch(states, targets, return_dict=True)         
+        # Fit the model on the entire batch using train on batch method, or using
+        # the data-parallel learner that averages gradients across processes
+        if self.learner is not None:
+            logs = self.learner.train_on_batch(model, states, targets)
+        else:
+            logs = model.train_on_batch(states, targets, return_dict=True)         
 
-        # Update epsilon
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
 
         return logs
 
+    # exploration rate decay is scheduled by the trainer based on environment
+    # steps, independently from the number of gradient steps
+    #--------------------------------------------------------------------------
+    def decay_exploration_rate(self):
+        if self.epsilon > self.epsilon_min:
+            self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
+
+    #--------------------------------------------------------------------------
+    def get_replay_stats(self):
+        if self.prefetcher is None:
+            return {}
+        
+        return self.prefetcher.get_stats()
+
+    #--------------------------------------------------------------------------
+    def stop_prefetching(self):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
 
+    # save the replay memory together with exploration rate, step counter and
+    # random generator state, so that resumed sessions start learning right away.
+    # The states of the episode and learner schedulers are saved as well if given
+    #--------------------------------------------------------------------------
+    def save_agent_state(self, path, episode_scheduler=None, learner_scheduler=None):
+        agent_path = os.path.join(path, 'agent')
+        self.memory.save(os.path.join(agent_path, 'replay'))
+        agent_state = {'epsilon' : float(self.epsilon),
+                       'steps' : int(self.steps),
+                       'generator_state' : self.generator.bit_generator.state}
+        if episode_scheduler is not None:
+            agent_state['episode_scheduler'] = episode_scheduler.get_state()
+        if learner_scheduler is not None:
+            agent_state['learner_scheduler'] = learner_scheduler.get_state()
+        with open(os.path.join(agent_path, 'agent_state.json'), 'w') as file:
+            json.dump(agent_state, file)
+        logger.debug(f'Agent state has been saved in {agent_path}')
+
+    #--------------------------------------------------------------------------
+    def load_agent_state(self, path, episode_scheduler=None, learner_scheduler=None):
+        agent_path = os.path.join(path, 'agent')
+        if not os.path.exists(os.path.join(agent_path, 'agent_state.json')):
+            logger.warning('No saved agent state found, the agent starts with an empty memory')
+            return
+
+        with open(os.path.join(agent_path, 'agent_state.json'), 'r') as file:
+            agent_state = json.load(file)
+        self.epsilon = agent_state['epsilon']
+        self.steps = agent_state['steps']
+        self.generator.bit_generator.state = agent_state['generator_state']
+        if episode_scheduler is not None and 'episode_scheduler' in agent_state:
+            episode_scheduler.set_state(agent_state['episode_scheduler'])
+        if learner_scheduler is not None and 'learner_scheduler' in agent_state:
+            learner_scheduler.set_state(agent_state['learner_scheduler'])
+        self.memory.load(os.path.join(agent_path, 'replay'))
+        logger.info(f'Agent state restored at step {self.steps} with exploration rate {self.epsilon:.4f}')
@@ -0,0 +1,311 @@
+import copy
+from abc import ABC, abstractmethod
+import numpy as np
+
+from FAIRS.commons.utils.process.mapping import RouletteMapper
+from FAIRS.commons.constants import CONFIG, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# [BASELINE POLICY]
+###############################################################################
+# Statistical policies used as baselines for FAIRSnet. Each policy holds fixed
+# size count arrays that are updated in constant time for each observed spin,
+# and selects an action in the same space of FAIRSnet (0-36 straight-up bets,
+# 37 red, 38 black). Ties are resolved in favour of the lowest action.
+# Whole series are played with array operations, giving the action selected
+# before each spin and after the last one, so that evaluation does not need
+# to loop over the spins. The policy is then left in the state reached at the
+# end of the series, from which it can keep being updated spin by spin
+###############################################################################
+class BaselinePolicy(ABC):
+
+    def __init__(self):
+        self.mapper = RouletteMapper()
+        self.red_action = NUMBERS
+        self.black_action = NUMBERS + 1
+        self.reset()
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def reset(self):
+        pass
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def update(self, number):
+        pass
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def act(self):
+        pass
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def play_series(self, series : np.array):
+        pass
+
+    # a policy in its initial state, for instance to follow another table
+    #--------------------------------------------------------------------------
+    def clone(self):
+        policy = copy.copy(self)
+        policy.reset()
+
+        return policy
+
+
+# [SLIDING WINDOW POLICIES]
+###############################################################################
+# Scores of all numbers are accumulated over the last WINDOW spins, where each
+# spin adds a fixed row of scores and the spin leaving the window removes it.
+# The number with the highest score is selected: hot numbers score their own
+# frequency, cold numbers its opposite, and wheel sectors score the frequency
+# of the numbers within SECTOR_NEIGHBOURS positions of each number on the wheel
+###############################################################################
+class SlidingWindowPolicy(BaselinePolicy):
+
+    def __init__(self, scores : np.array):
+        self.window = CONFIG['baselines']['WINDOW']
+        self.number_scores = scores.astype(np.float32)
+        super().__init__()
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self.buffer = np.zeros(self.window, dtype=np.int32)
+        self.position = 0
+        self.filled = 0
+        self.scores = np.zeros(NUMBERS, dtype=np.float32)
+
+    #--------------------------------------------------------------------------
+    def update(self, number):
+        if self.filled == self.window:
+            self.scores -= self.number_scores[self.buffer[self.position]]
+        else:
+            self.filled += 1
+        self.buffer[self.position] = number
+        self.scores += self.number_scores[number]
+        self.position = (self.position + 1) % self.window
+
+    #--------------------------------------------------------------------------
+    def act(self):
+        return int(np.argmax(self.scores))
+
+    # scores before each spin are the cumulative sum of the rows added by the
+    # previous spin and removed by the spin leaving the window, computed in
+    # chunks that fit in cache. Scores are integers, held exactly in float32
+    #--------------------------------------------------------------------------
+    def play_series(self, series : np.array, chunk_size=8192):
+        series = np.asarray(series, dtype=np.int64)
+        num_spins = series.shape[0]
+        actions = np.empty(num_spins + 1, dtype=np.int32)
+        carry = np.zeros(NUMBERS, dtype=np.float32)
+        # spins before the start of the series point to an additional row of zeros
+        number_scores = np.vstack([self.number_scores, np.zeros(NUMBERS, dtype=np.float32)])
+        padded = np.concatenate([np.full(self.window + 1, NUMBERS), series])
+        for start in range(0, num_spins + 1, chunk_size):
+            steps = np.arange(start, min(start + chunk_size, num_spins + 1)) + self.window + 1
+            deltas = number_scores[padded[steps - 1]] - number_scores[padded[steps - 1 - self.window]]
+            scores = np.cumsum(deltas, axis=0)
+            scores += carry
+            actions[steps - self.window - 1] = np.argmax(scores, axis=1)
+            carry = scores[-1]
+
+        # the ring buffer holds the spins of the last window in arrival order
+        self.reset()
+        tail = series[-self.window:] if num_spins else series
+        self.filled = tail.shape[0]
+        self.buffer[:self.filled] = tail
+        self.position = self.filled % self.window
+        self.scores = carry.copy()
+
+        return actions
+
+
+###############################################################################
+class HotNumbersPolicy(SlidingWindowPolicy):
+
+    def __init__(self):
+        super().__init__(np.eye(NUMBERS))
+
+
+###############################################################################
+class ColdNumbersPolicy(SlidingWindowPolicy):
+
+    def __init__(self):
+        super().__init__(-np.eye(NUMBERS))
+
+
+###############################################################################
+class WheelSectorPolicy(SlidingWindowPolicy):
+
+    def __init__(self):
+        neighbours = CONFIG['baselines']['SECTOR_NEIGHBOURS']
+        positions = np.array([RouletteMapper().position_map[n] for n in range(NUMBERS)])
+        # circular distance between the wheel positions of any two numbers
+        distance = np.abs(positions[:, None] - positions[None, :])
+        distance = np.minimum(distance, NUMBERS - distance)
+        super().__init__(distance <= neighbours)
+
+
+# [MARKOV POLICY]
+###############################################################################
+# First-order transition counts between consecutive spins. The number that has
+# most often followed the last spin is selected
+###############################################################################
+class MarkovPolicy(BaselinePolicy):
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self.transitions = np.zeros((NUMBERS, NUMBERS), dtype=np.int32)
+        self.last_number = -1
+
+    #--------------------------------------------------------------------------
+    def update(self, number):
+        if self.last_number >= 0:
+            self.transitions[self.last_number, number] += 1
+        self.last_number = number
+
+    #--------------------------------------------------------------------------
+    def act(self):
+        if self.last_number < 0:
+            return 0
+
+        return int(np.argmax(self.transitions[self.last_number]))
+
+    # the spin following each occurrence of a number is selected using the
+    # transitions observed after its previous occurrences, hence the counts of
+    # each number are an exclusive cumulative sum over its occurrences
+    #--------------------------------------------------------------------------
+    def play_series(self, series : np.array, chunk_size=8192):
+        series = np.asarray(series, dtype=np.int64)
+        num_spins = series.shape[0]
+        actions = np.zeros(num_spins + 1, dtype=np.int32)
+        for number in range(NUMBERS):
+            occurrences = np.flatnonzero(series == number)
+            if occurrences.shape[0] == 0:
+                continue
+            following = occurrences[occurrences < num_spins - 1] + 1
+            counts = np.zeros((occurrences.shape[0] + 1, NUMBERS), dtype=np.float32)
+            counts[np.arange(1, following.shape[0] + 1), series[following]] = 1
+            carry = np.zeros(NUMBERS, dtype=np.float32)
+            for start in range(0, occurrences.shape[0], chunk_size):
+                chunk = np.cumsum(counts[start:min(start + chunk_size, occurrences.shape[0])], axis=0)
+                chunk += carry
+                actions[occurrences[start:start + chunk_size] + 1] = np.argmax(chunk, axis=1)
+                carry = chunk[-1]
+
+        self.reset()
+        if num_spins > 1:
+            pairs = np.bincount(series[:-1] * NUMBERS + series[1:], minlength=NUMBERS * NUMBERS)
+            self.transitions = pairs.reshape(NUMBERS, NUMBERS).astype(np.int32)
+        if num_spins > 0:
+            self.last_number = int(series[-1])
+
+        return actions
+
+
+# [COLOR STREAK POLICY]
+###############################################################################
+# Counts how many streaks of each color have reached each length, up to
+# MAX_STREAK. Given the current streak, its color is bet on again if streaks of
+# the same color and length have continued at least half of the times, and the
+# opposite color is bet on otherwise. When no red or black streak is running,
+# the color that has started more streaks is selected
+###############################################################################
+class ColorStreakPolicy(BaselinePolicy):
+
+    def __init__(self):
+        self.max_streak = max(CONFIG['baselines']['MAX_STREAK'], 2)
+        super().__init__()
+        # encoded colors follow the mapper categories (green, black, red)
+        self.colors = self.mapper.get_encoding_table()[:, 2]
+        self.color_actions = {1 : self.black_action, 2 : self.red_action}
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self.streaks = np.zeros((3, self.max_streak + 1), dtype=np.int32)
+        self.color = 0
+        self.length = 0
+
+    #--------------------------------------------------------------------------
+    def update(self, number):
+        color = self.colors[number]
+        if color == self.color and self.length > 0:
+            self.length += 1
+        else:
+            self.color, self.length = color, 1
+        if self.length <= self.max_streak:
+            self.streaks[color, self.length] += 1
+
+    #--------------------------------------------------------------------------
+    def select_action(self, color, continued, reached, red_streaks, black_streaks):
+        continues = 2 * continued >= reached
+        actions = np.where((color == 2) == continues, self.red_action, self.black_action)
+        fallback = np.where(red_streaks >= black_streaks, self.red_action, self.black_action)
+
+        return np.where(color == 0, fallback, actions)
+
+    #--------------------------------------------------------------------------
+    def act(self):
+        length = min(self.length, self.max_streak - 1)
+        action = self.select_action(self.color if self.length > 0 else 0,
+                                    self.streaks[self.color, length + 1],
+                                    self.streaks[self.color, length],
+                                    self.streaks[2, 1], self.streaks[1, 1])
+
+        return int(action)
+
+    # the counts of a given color and length before each spin are obtained by
+    # searching sorted (color, length, spin) keys of the streak increments
+    #--------------------------------------------------------------------------
+    def play_series(self, series : np.array):
+        series = np.asarray(series, dtype=np.int64)
+        num_spins = series.shape[0]
+        colors = self.colors[series].astype(np.int64)
+        starts = np.r_[True, colors[1:] != colors[:-1]] if num_spins else np.zeros(0, dtype=bool)
+        lengths = np.arange(num_spins) - np.maximum.accumulate(np.where(starts, np.arange(num_spins), 0)) + 1
+
+        # keys of increments beyond the maximum streak are negative, hence never found
+        stride = num_spins + 1
+        keys = np.where(lengths <= self.max_streak, colors * (self.max_streak + 1) + lengths, -1)
+        sorted_keys = np.sort(keys * stride + np.arange(num_spins))
+
+        def count_before(color, length, steps):
+            key = color * (self.max_streak + 1) + length
+            return (np.searchsorted(sorted_keys, key * stride + steps) -
+                    np.searchsorted(sorted_keys, key * stride))
+
+        steps = np.arange(num_spins + 1)
+        last = np.maximum(steps - 1, 0)
+        color = np.where(steps > 0, colors[last] if num_spins else 0, 0)
+        length = np.minimum(np.where(steps > 0, lengths[last] if num_spins else 0, 0), self.max_streak - 1)
+        # streaks started by each color are counted with a cumulative sum instead
+        started = [np.r_[0, np.cumsum(keys == c * (self.max_streak + 1) + 1)] for c in [2, 1]]
+        actions = self.select_action(color, count_before(color, length + 1, steps),
+                                     count_before(color, length, steps), *started)
+
+        self.reset()
+        if num_spins > 0:
+            valid = keys >= 0
+            self.streaks = np.bincount(keys[valid], minlength=3 * (self.max_streak + 1)).reshape(
+                3, self.max_streak + 1).astype(np.int32)
+            self.color, self.length = int(colors[-1]), int(lengths[-1])
+
+        return actions.astype(np.int32)
+
+
+###############################################################################
+BASELINE_POLICIES = {'hot' : HotNumbersPolicy,
+                     'cold' : ColdNumbersPolicy,
+                     'sector' : WheelSectorPolicy,
+                     'markov' : MarkovPolicy,
+                     'streak' : ColorStreakPolicy}
+
+#------------------------------------------------------------------------------
+def get_baseline_policy(name):
+    if name not in BASELINE_POLICIES:
+        raise ValueError(f'Unknown baseline policy {name}, available: {list(BASELINE_POLICIES.keys())}')
+    logger.info(f'Using the {name} baseline policy')
+
+    return BASELINE_POLICIES[name]()
@@ -0,0 +1,215 @@
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+import keras
+from keras import layers
+
+from FAIRS.commons.utils.learning.embeddings import RouletteEmbedding
+from FAIRS.commons.utils.learning.logits import QScoreNet, AddNorm
+from FAIRS.commons.constants import COMPILE_CACHE_PATH, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# compiled graphs and kernels are cached on disk by inductor, so that later
+# sessions load them instead of compiling from scratch. The cache directory
+# is read when the first graph is compiled, hence this is called beforehand
+#------------------------------------------------------------------------------
+def enable_compile_cache(path=COMPILE_CACHE_PATH):
+    os.makedirs(path, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = path
+    os.environ['TORCHINDUCTOR_FX_GRAPH_CACHE'] = '1'
+    os.environ['TORCHINDUCTOR_AUTOGRAD_CACHE'] = '1'
+    torch._inductor.config.fx_graph_cache = True
+    torch._functorch.config.enable_autograd_cache = True
+
+
+# [COMPILED FAIRSNET]
+###############################################################################
+# Compiling the keras model itself results in many graph breaks, since keras
+# layers run python bookkeeping at each call. FAIRSnet is instead expressed as
+# a plain torch function of the tensors held by the keras variables, which is
+# compiled without graph breaks. Parameters are shared with the keras model,
+# hence the optimizer, target updates and serialization work as usual.
+# Inputs are padded to fixed batch buckets (1 and BATCH_SIZE), so that acting,
+# replay and inference never trigger recompilation
+###############################################################################
+class CompiledFAIRSnet:
+
+    def __init__(self, model : keras.Model, configuration, batch_size=None):
+        self.model = model
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.jit_backend = configuration["model"]["JIT_BACKEND"]
+        self.seed = configuration["SEED"]
+        batch_size = batch_size or configuration["training"]["BATCH_SIZE"]
+        self.buckets = sorted({1, batch_size})
+        self.bind_layers(model)
+
+        self.compiled_forward = torch.compile(self.forward, backend=self.jit_backend, dynamic=False)
+        self.compiled_loss = torch.compile(self.squared_error_loss, backend=self.jit_backend, dynamic=False)
+
+    # layers are collected in topological order, where each of the three blocks
+    # is made of two dense layers, an add-norm layer and dropout
+    #--------------------------------------------------------------------------
+    def bind_layers(self, model : keras.Model):
+        self.embedding = [l for l in model.layers if isinstance(l, RouletteEmbedding)][0]
+        self.dense_layers = [l for l in model.layers if isinstance(l, layers.Dense)]
+        self.addnorm_layers = [l for l in model.layers if isinstance(l, AddNorm)]
+        self.dropout_rates = [l.rate for l in model.layers if isinstance(l, layers.Dropout)]
+        self.QNet = [l for l in model.layers if isinstance(l, QScoreNet)][0]
+        self.embedding_scale = float(np.sqrt(self.embedding.embedding_dims))
+
+    #--------------------------------------------------------------------------
+    def _dense(self, layer : layers.Dense, x):
+        return torch.matmul(x, layer.kernel.value) + layer.bias.value
+
+    #--------------------------------------------------------------------------
+    def _addnorm(self, layer : AddNorm, x1, x2):
+        layernorm = layer.layernorm
+        return F.layer_norm(x1 + x2, (x1.shape[-1],), layernorm.gamma.value,
+                            layernorm.beta.value, layernorm.epsilon)
+
+    # batch normalization updates its moving statistics in place when training,
+    # with the same momentum and biased variance used by keras
+    #--------------------------------------------------------------------------
+    def _batch_norm(self, x, training):
+        batch_norm = self.QNet.batch_norm
+        moving_mean, moving_variance = batch_norm.moving_mean.value, batch_norm.moving_variance.value
+        if training:
+            mean = x.mean(dim=0)
+            variance = x.var(dim=0, unbiased=False)
+            with torch.no_grad():
+                moving_mean.mul_(batch_norm.momentum).add_(mean.detach() * (1 - batch_norm.momentum))
+                moving_variance.mul_(batch_norm.momentum).add_(variance.detach() * (1 - batch_norm.momentum))
+        else:
+            mean, variance = moving_mean, moving_variance
+        x = (x - mean) * torch.rsqrt(variance + batch_norm.epsilon)
+
+        return x * batch_norm.gamma.value + batch_norm.beta.value
+
+    # the padding value -1 is gathered as token 0 and then masked out
+    #--------------------------------------------------------------------------
+    def forward(self, x, training : bool = False):
+        table = self.embedding.numbers_embedding.embeddings.value
+        mask = (x != -1).unsqueeze(-1).to(table.dtype)
+        layer = table[torch.clamp(x, min=0)] * self.embedding_scale * mask
+        for block in range(3):
+            if block == 2:
+                layer = torch.flatten(layer, start_dim=1)
+            res = self._dense(self.dense_layers[2*block], layer)
+            layer = self._dense(self.dense_layers[2*block + 1], res)
+            layer = torch.relu(self._addnorm(self.addnorm_layers[block], res, layer))
+            layer = F.dropout(layer, p=self.dropout_rates[block], training=training)
+
+        layer = self._batch_norm(self._dense(self.QNet.Q1, layer), training)
+        with torch.autocast(device_type='cpu', enabled=False):
+            output = self._dense(self.QNet.Q2, layer.float())
+
+        return output
+
+    #--------------------------------------------------------------------------
+    def squared_error_loss(self, x, y):
+        return torch.mean(torch.square(y - self.forward(x, training=True)))
+
+    # inputs are padded with empty perceptive fields up to the nearest bucket,
+    # while larger inputs are split into chunks of the largest bucket
+    #--------------------------------------------------------------------------
+    @torch.no_grad()
+    def predict(self, inputs, verbose=0):
+        inputs = torch.as_tensor(np.reshape(inputs, (-1, self.perceptive_size)), dtype=torch.int32)
+        num_samples, max_bucket = inputs.shape[0], self.buckets[-1]
+        outputs = []
+        for i in range(0, num_samples, max_bucket):
+            chunk = inputs[i:i + max_bucket]
+            bucket = next(b for b in self.buckets if b >= chunk.shape[0])
+            if bucket > chunk.shape[0]:
+                padding = torch.full((bucket - chunk.shape[0], self.perceptive_size), -1, dtype=torch.int32)
+                chunk = torch.cat([chunk, padding])
+            outputs.append(self.compiled_forward(chunk)[:min(max_bucket, num_samples - i)])
+
+        return torch.cat(outputs).numpy()
+
+    # mirrors the keras train_on_batch signature. Batches outside the buckets
+    # would require a new graph, hence they are trained without compilation
+    #--------------------------------------------------------------------------
+    def train_on_batch(self, x, y, return_dict=True):
+        x = torch.as_tensor(np.asarray(x), dtype=torch.int32)
+        y = torch.as_tensor(np.asarray(y), dtype=torch.float32)
+        loss_function = self.compiled_loss if x.shape[0] in self.buckets else self.squared_error_loss
+        self.model.zero_grad()
+        loss = loss_function(x, y)
+        loss.backward()
+        trainable_weights = self.model.trainable_weights
+        with torch.no_grad():
+            self.model.optimizer.apply([w.value.grad for w in trainable_weights], trainable_weights)
+        loss = float(loss.detach())
+
+        return {'loss' : loss, 'root_mean_squared_error' : float(np.sqrt(loss))}
+
+    # attributes such as weights and optimizer are those of the keras model
+    #--------------------------------------------------------------------------
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    #--------------------------------------------------------------------------
+    def __call__(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def _time_function(self, function, num_runs):
+        start_time = time.perf_counter()
+        for _ in range(num_runs):
+            function()
+
+        return (time.perf_counter() - start_time)/num_runs * 1000
+
+    #--------------------------------------------------------------------------
+    def _eager_loss(self, x, y):
+        y_pred = self.model(x, training=True)
+        return self.model.compute_loss(x=x, y=y, y_pred=y_pred, training=True)
+
+    # graphs of all buckets are compiled before the first episode, and compile
+    # times are compared against steady-state timings of compiled and keras
+    # calls. Model weights are restored afterwards, as the warm-up training
+    # passes update the batch normalization statistics
+    #--------------------------------------------------------------------------
+    def warmup(self, train=True, num_runs=20):
+        snapshot = [w.value.detach().clone() for w in self.model.weights]
+        generator = np.random.default_rng(self.seed)
+        report = {'backend' : self.jit_backend, 'buckets' : self.buckets}
+        for bucket in self.buckets:
+            x = generator.integers(-1, NUMBERS, size=(bucket, self.perceptive_size), dtype=np.int32)
+            start_time = time.perf_counter()
+            self.predict(x)
+            compile_time = time.perf_counter() - start_time
+            compiled_ms = self._time_function(lambda: self.predict(x), num_runs)
+            eager_ms = self._time_function(lambda: self.model.predict(x, verbose=0), num_runs)
+            report[f'predict_{bucket}'] = {'compile_s' : compile_time, 'compiled_ms' : compiled_ms,
+                                           'keras_ms' : eager_ms, 'speedup' : eager_ms/compiled_ms}
+            logger.info(f'Forward pass (batch {bucket}) compiled in {compile_time:.1f} s: '
+                        f'{compiled_ms:.2f} ms vs {eager_ms:.2f} ms ({eager_ms/compiled_ms:.1f}x)')
+
+        if train:
+            bucket = self.buckets[-1]
+            x = torch.as_tensor(generator.integers(-1, NUMBERS, size=(bucket, self.perceptive_size)),
+                                dtype=torch.int32)
+            y = torch.as_tensor(generator.normal(size=(bucket, self.QNet.output_size)), dtype=torch.float32)
+            compiled_step = lambda: self.compiled_loss(x, y).backward()
+            eager_step = lambda: self._eager_loss(x, y).backward()
+            start_time = time.perf_counter()
+            compiled_step()
+            compile_time = time.perf_counter() - start_time
+            compiled_ms = self._time_function(compiled_step, num_runs)
+            eager_ms = self._time_function(eager_step, num_runs)
+            report[f'train_step_{bucket}'] = {'compile_s' : compile_time, 'compiled_ms' : compiled_ms,
+                                              'keras_ms' : eager_ms, 'speedup' : eager_ms/compiled_ms}
+            logger.info(f'Training step (batch {bucket}) compiled in {compile_time:.1f} s: '
+                        f'{compiled_ms:.2f} ms vs {eager_ms:.2f} ms ({eager_ms/compiled_ms:.1f}x)')
+            self.model.zero_grad()
+
+        with torch.no_grad():
+            for weight, value in zip(self.model.weights, snapshot):
+                weight.value.copy_(value)
+
+        return report
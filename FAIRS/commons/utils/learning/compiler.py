@@ -0,0 +1,116 @@
+import numpy as np
+import keras
+from keras import layers
+
+from FAIRS.commons.utils.learning.lookup import LookupFAIRSnet
+from FAIRS.commons.utils.learning.logits import QScoreNet, AddNorm
+from FAIRS.commons.constants import CONFIG, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# [INFERENCE COMPILER]
+###############################################################################
+class FAIRSnetCompiler:
+
+    def __init__(self, configuration):
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.seed = configuration["SEED"]
+        # padding value -1 followed by all roulette numbers
+        self.tokens = np.arange(-1, NUMBERS, dtype=np.int32)
+
+    #--------------------------------------------------------------------------
+    def _to_numpy(self, variable):
+        return keras.ops.convert_to_numpy(variable).astype(np.float32)
+
+    # collect layers following the flatten layer, which is the boundary between
+    # the per-position stack and the dense head of FAIRSnet
+    #--------------------------------------------------------------------------
+    def split_model_layers(self, model : keras.Model):
+        flatten_index = [i for i, layer in enumerate(model.layers)
+                         if isinstance(layer, layers.Flatten)][0]
+        head_layers = model.layers[flatten_index + 1:]
+        dense_layers = [layer for layer in head_layers if isinstance(layer, layers.Dense)]
+        addnorm = [layer for layer in head_layers if isinstance(layer, AddNorm)][0]
+        QNet = [layer for layer in head_layers if isinstance(layer, QScoreNet)][0]
+
+        return model.layers[flatten_index], dense_layers, addnorm, QNet
+
+    # evaluate the per-position stack once for each token, by feeding a batch of
+    # perceptive fields each filled with a single token value
+    #--------------------------------------------------------------------------
+    def build_token_table(self, model : keras.Model, flatten : layers.Flatten):
+        prefix_model = keras.Model(inputs=model.inputs, outputs=flatten.input)
+        token_fields = np.repeat(self.tokens[:, None], self.perceptive_size, axis=1)
+        token_embeddings = prefix_model.predict(token_fields, verbose=0)
+        # positions are processed independently, hence all positions of the same
+        # token must hold the same vector
+        position_error = np.abs(token_embeddings - token_embeddings[:, :1, :]).max()
+        if position_error > 1e-5:
+            logger.warning(f'Per-position outputs are not position invariant (max error: {position_error})')
+
+        return token_embeddings[:, 0, :]
+
+    # fold inference-time batch normalization into the preceding dense layer
+    #--------------------------------------------------------------------------
+    def fold_batch_normalization(self, QNet : QScoreNet):
+        batch_norm = QNet.batch_norm
+        scale = self._to_numpy(batch_norm.gamma)/np.sqrt(
+            self._to_numpy(batch_norm.moving_variance) + batch_norm.epsilon)
+        shift = self._to_numpy(batch_norm.beta) - self._to_numpy(batch_norm.moving_mean) * scale
+        kernel = self._to_numpy(QNet.Q1.kernel) * scale
+        bias = self._to_numpy(QNet.Q1.bias) * scale + shift
+
+        return kernel, bias
+
+    #--------------------------------------------------------------------------
+    def compile(self, model : keras.Model, verify=True, tolerance=1e-4):
+        flatten, dense_layers, addnorm, QNet = self.split_model_layers(model)
+        first_dense, head_dense = dense_layers[0], dense_layers[1]
+        token_table = self.build_token_table(model, flatten)
+
+        # split the kernel of the first post-flatten dense layer by position and
+        # project each token vector, obtaining a (positions, tokens, units) table
+        kernel = self._to_numpy(first_dense.kernel)
+        kernel = kernel.reshape(self.perceptive_size, token_table.shape[-1], -1)
+        position_table = np.einsum('td,pdu->ptu', token_table, kernel).astype(np.float32)
+        Q1_kernel, Q1_bias = self.fold_batch_normalization(QNet)
+
+        weights = {'token_table' : np.ascontiguousarray(position_table),
+                   'dense_bias' : self._to_numpy(first_dense.bias),
+                   'head_kernel' : self._to_numpy(head_dense.kernel),
+                   'head_bias' : self._to_numpy(head_dense.bias),
+                   'norm_gamma' : self._to_numpy(addnorm.layernorm.gamma),
+                   'norm_beta' : self._to_numpy(addnorm.layernorm.beta),
+                   'norm_epsilon' : np.float32(addnorm.layernorm.epsilon),
+                   'Q1_kernel' : Q1_kernel,
+                   'Q1_bias' : Q1_bias,
+                   'Q2_kernel' : self._to_numpy(QNet.Q2.kernel),
+                   'Q2_bias' : self._to_numpy(QNet.Q2.bias)}
+
+        lookup_model = LookupFAIRSnet(weights)
+        logger.info(f'FAIRSnet compiled into lookup tables of shape {position_table.shape}')
+        if verify:
+            self.verify_equivalence(model, lookup_model, tolerance)
+
+        return lookup_model
+
+    # compare the lookup model against the original model using random perceptive
+    # fields, including partially padded ones as found at the start of episodes
+    #--------------------------------------------------------------------------
+    def verify_equivalence(self, model : keras.Model, lookup_model : LookupFAIRSnet,
+                           tolerance=1e-4, num_samples=512):
+        generator = np.random.default_rng(self.seed)
+        inputs = generator.integers(0, NUMBERS, size=(num_samples, self.perceptive_size), dtype=np.int32)
+        padding = generator.integers(0, self.perceptive_size + 1, size=num_samples)
+        inputs[np.arange(self.perceptive_size)[None, :] < padding[:, None]] = -1
+
+        expected = model.predict(inputs, verbose=0)
+        predicted = lookup_model.predict(inputs)
+        max_error = np.abs(expected - predicted).max()
+        scale = max(np.abs(expected).max(), 1.0)
+        action_agreement = np.mean(np.argmax(expected, axis=1) == np.argmax(predicted, axis=1))
+        if max_error > tolerance * scale:
+            raise ValueError(f'Lookup model does not match FAIRSnet (max error: {max_error:.3e})')
+        logger.info(f'Lookup model verified: max error {max_error:.3e}, action agreement {action_agreement:.2%}')
+
+        return max_error
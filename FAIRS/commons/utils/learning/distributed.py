@@ -0,0 +1,98 @@
+import socket
+import numpy as np
+import torch
+import torch.distributed as dist
+import keras
+
+from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.logger import logger
+
+
+#------------------------------------------------------------------------------
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# [DATA PARALLEL LEARNER]
+###############################################################################
+# Training step of the Q model for data-parallel training on CPU. Each process
+# runs an identical copy of the environment and agent, samples its own shard
+# of the minibatch with a rank-specific generator and computes the gradients
+# of its shard. Gradients are averaged across processes with a single gloo
+# all-reduce before the optimizer step, hence the weights of the Q model and
+# target model stay identical on all processes without being broadcast
+###############################################################################
+class DistributedLearner:
+
+    def __init__(self, rank, world_size, configuration):
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = configuration['SEED']
+        self.trainable_weights = None
+        self.non_trainable_weights = None
+
+    #--------------------------------------------------------------------------
+    def init_process_group(self, port):
+        dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}',
+                                rank=self.rank, world_size=self.world_size)
+
+    #--------------------------------------------------------------------------
+    def destroy_process_group(self):
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+    # each rank samples different transitions from identical replay memories
+    #--------------------------------------------------------------------------
+    def bind_agent(self, agent):
+        agent.memory.generator = np.random.default_rng([self.seed, self.rank])
+        agent.learner = self
+
+    #--------------------------------------------------------------------------
+    def bind_model(self, model : keras.Model):
+        if not model.optimizer.built:
+            model.optimizer.build(model.trainable_variables)
+        self.trainable_weights = model.trainable_weights[:]
+        self.non_trainable_weights = [w for w in model.non_trainable_weights
+                                      if 'float' in str(w.dtype)]
+
+    # tensors are flattened into a single buffer so that all of them are
+    # averaged with one all-reduce call
+    #--------------------------------------------------------------------------
+    def all_reduce_mean(self, tensors):
+        buffer = torch.cat([t.reshape(-1) for t in tensors])
+        dist.all_reduce(buffer, op=dist.ReduceOp.SUM)
+        buffer /= self.world_size
+
+        return torch.split(buffer, [t.numel() for t in tensors])
+
+    #--------------------------------------------------------------------------
+    def train_on_batch(self, model : keras.Model, x, y):
+        if self.trainable_weights is None:
+            self.bind_model(model)
+
+        x = torch.as_tensor(x)
+        y = torch.as_tensor(y, dtype=torch.float32)
+        y_pred = model(x, training=True)
+        model.zero_grad()
+        loss = model.compute_loss(x=x, y=y, y_pred=y_pred, training=True)
+        loss.backward()
+
+        # the local loss is reduced together with the gradients
+        gradients = [w.value.grad for w in self.trainable_weights]
+        reduced = self.all_reduce_mean(gradients + [loss.detach().reshape(1)])
+        gradients = [r.view_as(g) for r, g in zip(reduced[:-1], gradients)]
+        with torch.no_grad():
+            model.optimizer.apply(gradients, self.trainable_weights)
+
+            # batch normalization statistics are updated with the local shard,
+            # hence they are averaged to keep the models identical across ranks
+            if self.non_trainable_weights:
+                values = [w.value for w in self.non_trainable_weights]
+                for value, reduced_value in zip(values, self.all_reduce_mean(values)):
+                    value.copy_(reduced_value.view_as(value))
+
+        mean_loss = float(reduced[-1])
+
+        return {'loss' : mean_loss, 'root_mean_squared_error' : float(np.sqrt(mean_loss))}
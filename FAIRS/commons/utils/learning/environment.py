@@ -7,9 +7,75 @@ matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 
 from FAIRS.commons.utils.process.mapping import RouletteMapper
+from FAIRS.commons.utils.learning.rewards import RoulettePayouts
 from FAIRS.commons.constants import CONFIG, STATES, NUMBERS
 from FAIRS.commons.logger import logger
 
+
+# [EPISODE START SCHEDULER]
+###############################################################################
+# Selects the index of the series each episode starts from. The fixed mode
+# always starts from the first extraction, the random mode draws uniform start
+# offsets, while strided and shuffled modes split the series into consecutive
+# segments of MAX_STEPS extractions that are visited in order or in a new random
+# permutation at each epoch, so that the whole series is covered without repeats
+###############################################################################
+class EpisodeScheduler:
+
+    def __init__(self, series_length, configuration):
+        self.mode = configuration["environment"].get("EPISODE_START", "fixed")
+        max_steps = configuration["environment"]["MAX_STEPS"]
+        self.generator = np.random.default_rng(configuration["SEED"])
+
+        # the last valid start still allows episodes of MAX_STEPS extractions
+        self.last_start = max(series_length - max_steps, 0)
+        self.strided_starts = np.unique(np.minimum(np.arange(0, series_length, max_steps), self.last_start))
+        self.schedule = self.strided_starts
+        self.cursor = len(self.schedule)
+        self.epoch = 0
+
+    #--------------------------------------------------------------------------
+    def next_start(self):
+        if self.mode == 'random':
+            return int(self.generator.integers(0, self.last_start + 1))
+
+        if self.mode in ('strided', 'shuffled'):
+            if self.cursor >= len(self.schedule):
+                self.schedule = (self.generator.permutation(self.strided_starts)
+                                 if self.mode == 'shuffled' else self.strided_starts)
+                self.cursor = 0
+                self.epoch += 1
+            start = int(self.schedule[self.cursor])
+            self.cursor += 1
+            return start
+
+        return 0
+
+    # the schedule is saved with the agent state, so that resumed sessions keep
+    # visiting the segments of the current epoch instead of starting a new one
+    #--------------------------------------------------------------------------
+    def get_state(self):
+        return {'mode' : self.mode,
+                'generator_state' : self.generator.bit_generator.state,
+                'schedule' : [int(x) for x in self.schedule],
+                'cursor' : int(self.cursor),
+                'epoch' : int(self.epoch)}
+
+    # a saved schedule is only restored if it was built for the same segments,
+    # otherwise the next episode starts a new epoch over the current segments
+    #--------------------------------------------------------------------------
+    def set_state(self, state):
+        self.generator.bit_generator.state = state['generator_state']
+        self.epoch = state['epoch']
+        schedule = np.asarray(state['schedule'], dtype=self.strided_starts.dtype)
+        if state['mode'] == self.mode and np.array_equal(np.sort(schedule), self.strided_starts):
+            self.schedule = schedule
+            self.cursor = state['cursor']
+        else:
+            logger.warning('Saved episode schedule does not match the current series, a new epoch is started')
+            self.schedule = self.strided_starts
+            self.cursor = len(self.schedule)
+
     
 # [ROULETTE RL ENVIRONMENT]
 ###############################################################################
@@ -32,6 +98,8 @@ class RouletteEnvironment(gym.Env):
         self.numbers = list(range(NUMBERS)) 
         self.red_numbers = mapper.color_map['red']
         self.black_numbers = mapper.color_map['black'] 
+        self.payouts = RoulettePayouts(configuration)
+        self.scheduler = EpisodeScheduler(self.timeseries.shape[0], configuration)
                 
         # Actions: 0 (Red), 1 (Black), 2-37 for betting on a specific number
         self.action_space = spaces.Discrete(STATES)
@@ -40,6 +108,7 @@ class RouletteEnvironment(gym.Env):
         
         # Initialize state, capital, steps, and reward  
         self.extraction_index = 0 
+        self.episode_start = 0
         self.state = np.full(shape=self.perceptive_size, fill_value=-1)                       
         self.capital = self.initial_capital
         self.steps = 0
@@ -49,59 +118,36 @@ class RouletteEnvironment(gym.Env):
         if self.render_environment:
             self._build_rendering_canvas()            
         
-    # Reset the state of the environment to an initial state
+    # Reset the state of the environment to an initial state, starting from the
+    # index selected by the scheduler. The perceptive field is filled with the
+    # preceding extractions, using -1 padding only before the series start
     #--------------------------------------------------------------------------
     def reset(self):        
-        self.extraction_index = 0
-        self.state = np.full(shape=self.perceptive_size, fill_value=-1, dtype=np.int32)                  
+        self.extraction_index = self.scheduler.next_start()
+        self.episode_start = max(self.extraction_index - self.perceptive_size, 0)
+        preceding = self.timeseries[self.episode_start:self.extraction_index]
+        self.state = np.full(shape=self.perceptive_size, fill_value=-1, dtype=np.int32)
+        if preceding.shape[0] > 0:
+            self.state[-preceding.shape[0]:] = preceding                  
         self.capital = self.initial_capital
         self.steps = 0
         self.done = False
 
         return self.state
     
-    # Reset the state of the environment to an initial state
+    # Scale negative rewards to [-1, 0] and scale positive rewards to [0, 1]
     #--------------------------------------------------------------------------
     def scale_rewards(self, rewards): 
-        # Scale negative rewards to [-1, 0] and scale positive rewards to [0, 1]
-        negative_scaled = ((rewards - (-self.bet_amount)) / (0 - (-self.bet_amount))) * (0 - (-1)) + (-1)        
-        positive_scaled = ((rewards - 0) / (self.bet_amount * 35)) * (1 - 0) + 0        
-        scaled_rewards = np.where(rewards < 0, negative_scaled, positive_scaled)
-
-        return scaled_rewards
+        return self.payouts.scale_rewards(rewards)
 
-    # Perform the action (0: Bet on Red, 1: Bet on Black, 2: Bet on Specific Number)
+    # Perform the action (0-36: Bet on Specific Number, 37: Bet on Red, 38: Bet on
+    # Black, 39: stop playing) using the precomputed payout matrix
     #--------------------------------------------------------------------------
     def get_rewards(self, action, next_extraction):         
-
-        if 0 <= action <= 36:  # Bet on Specific Number            
-            if action == next_extraction:
-                self.reward = 35 * self.bet_amount 
-                self.capital += 35 * self.bet_amount
-            else:
-                self.reward = -self.bet_amount  
-                self.capital -= self.bet_amount 
-
-        elif action == 37:  # Bet on Red
-            if next_extraction in self.red_numbers:
-                self.reward = self.bet_amount  
-                self.capital += self.bet_amount
-            else:
-                self.reward = -self.bet_amount  
-                self.capital -= self.bet_amount 
-
-        elif action == 38:  # Bet on Black
-            if next_extraction in self.black_numbers:
-                self.reward = self.bet_amount 
-                self.capital += self.bet_amount
-            else:
-                self.reward = -self.bet_amount  
-                self.capital -= self.bet_amount
-
-        elif action == 39: # pass the turn and stop playing 
-                self.reward = 0  
-                self.capital -= 0 
-                self.done = True    
+        self.reward = self.payouts.get_rewards(action, next_extraction)
+        self.capital += self.reward
+        if action == self.payouts.stop_action:
+            self.done = True    
    
     #--------------------------------------------------------------------------
     def step(self, action):
@@ -109,6 +155,10 @@ class RouletteEnvironment(gym.Env):
         if self.extraction_index >= self.timeseries.shape[0]:
             self.state = self.reset()
         
+        # the index of the revealed extraction and of the episode start are
+        # returned as info, so that both states can be rebuilt from the series
+        info = {"extraction_index": self.extraction_index,
+                "episode_start": self.episode_start}
         next_extraction = np.int32(self.timeseries[self.extraction_index])        
         self.state = np.delete(self.state, 0)
         self.state = np.append(self.state, next_extraction)
@@ -123,7 +173,9 @@ class RouletteEnvironment(gym.Env):
         else:
             self.done = False
 
-        return self.state, self.reward, self.done, {"capital": self.capital}, next_extraction    
+        info["capital"] = self.capital
+
+        return self.state, self.reward, self.done, info, next_extraction    
 
     #--------------------------------------------------------------------------
     def _build_rendering_canvas(self):
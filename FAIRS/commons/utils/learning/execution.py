@@ -0,0 +1,205 @@
+import os
+import time
+import contextlib
+import numpy as np
+import torch
+from threadpoolctl import threadpool_limits
+
+from FAIRS.commons.logger import logger
+
+
+# [CPU EXECUTION POLICY]
+###############################################################################
+# Thread pools of torch and of the OpenMP/BLAS libraries are sized from the
+# configuration instead of using all cores. Acting runs single-sample forward
+# passes where few threads give the lowest latency, while learning runs larger
+# batches that benefit from more threads, hence each has its own profile. The
+# process can optionally be pinned to NUM_PROCESSORS of the available cores,
+# where processes running side by side (data-parallel ranks or sweep trials)
+# are given different core_slot values so that each is pinned to its own cores.
+# Each profile can also run under bfloat16 autocast, where weights and optimizer
+# states are kept in float32 and only the operations are run in reduced precision
+###############################################################################
+class CPUExecutionPolicy:
+
+    def __init__(self, configuration, core_slot=0):
+        self.num_processors = configuration["device"]["NUM_PROCESSORS"]
+        self.available_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+                               else list(range(os.cpu_count()))
+        self.num_processors = max(1, min(self.num_processors, len(self.available_cores)))
+        self.acting_threads = configuration["device"].get("ACTING_THREADS", 1)
+        self.learning_threads = configuration["device"].get("LEARNING_THREADS") or self.num_processors
+        self.interop_threads = configuration["device"].get("INTEROP_THREADS", 1)
+        self.pin_cores = configuration["device"].get("PIN_CORES", False)
+        self.profiles = {'acting' : min(self.acting_threads, self.num_processors),
+                         'learning' : min(self.learning_threads, self.num_processors)}
+        self.bfloat16 = {'acting' : configuration["device"].get("BF16_ACTING", False),
+                         'learning' : configuration["device"].get("BF16_LEARNING", False)}
+        self.core_slot = core_slot
+        self.blas_limits = None
+        self.active_profile = None
+
+    # cores of each slot follow those of the previous slot, wrapping around the
+    # available cores when there are more slots than cores
+    #--------------------------------------------------------------------------
+    def get_slot_cores(self):
+        start = self.core_slot * self.num_processors
+        return [self.available_cores[(start + i) % len(self.available_cores)]
+                for i in range(self.num_processors)]
+
+    # BLAS libraries read their environment variables only when loaded, which
+    # has already happened through numpy and torch, hence their thread pools are
+    # resized with threadpoolctl. The variables are still set so that spawned
+    # processes inherit the same limits, while torch pools are resized directly
+    #--------------------------------------------------------------------------
+    def apply(self, profile='learning'):
+        for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+            os.environ[variable] = str(self.profiles['learning'])
+        self.blas_limits = threadpool_limits(limits=self.profiles['learning'], user_api='blas')
+        # inter-op threads can only be set before any parallel work has started
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError:
+            logger.debug('Inter-op threads cannot be changed after parallel work has started')
+
+        if self.pin_cores and hasattr(os, 'sched_setaffinity'):
+            cores = self.get_slot_cores()
+            os.sched_setaffinity(0, cores)
+            logger.info(f'Process pinned to cores {cores}')
+
+        self.set_profile(profile)
+        logger.info(f'CPU threads: {self.profiles["acting"]} for acting, '
+                    f'{self.profiles["learning"]} for learning, {self.interop_threads} inter-op')
+        if any(self.bfloat16.values()):
+            check_bfloat16_support()
+            logger.info(f'bfloat16 autocast is active for acting: {self.bfloat16["acting"]}, '
+                        f'learning: {self.bfloat16["learning"]}')
+
+    # with the OpenMP backend of torch the number of threads is set for the
+    # calling thread, hence threads acting and learning concurrently each set
+    # their own profile
+    #--------------------------------------------------------------------------
+    def set_profile(self, profile):
+        if profile != self.active_profile:
+            torch.set_num_threads(self.profiles[profile])
+            self.active_profile = profile
+
+    #--------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def profile(self, profile):
+        self.set_profile(profile)
+        with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=self.bfloat16[profile]):
+            yield
+
+
+# bfloat16 operations are emulated on CPUs without native support (AVX512-BF16
+# or AMX), where they are slower than float32
+#------------------------------------------------------------------------------
+def check_bfloat16_support():
+    supported = torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    if not supported:
+        logger.warning('This CPU has no native bfloat16 support, reduced precision will be slower')
+
+    return supported
+
+
+# [BFLOAT16 INFERENCE]
+###############################################################################
+# Runs predictions of any keras-like model under CPU bfloat16 autocast. Autocast
+# is enabled within predict, as it only applies to the calling thread
+###############################################################################
+class BFloat16Model:
+
+    def __init__(self, model):
+        self.model = model
+        check_bfloat16_support()
+
+    #--------------------------------------------------------------------------
+    def predict(self, inputs, verbose=0):
+        with torch.autocast(device_type='cpu', dtype=torch.bfloat16):
+            return self.model.predict(inputs, verbose=verbose)
+
+    #--------------------------------------------------------------------------
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+# [CPU CALIBRATION]
+###############################################################################
+# Measures the latency of single-sample forward passes and of training steps
+# for increasing thread counts, recommending the fastest setting of each profile
+###############################################################################
+class CPUCalibrator:
+
+    def __init__(self, configuration):
+        self.state_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.batch_size = configuration["training"]["BATCH_SIZE"]
+        self.num_runs = 50
+        max_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.thread_counts = sorted({1, max_threads} | {2**i for i in range(1, 8) if 2**i < max_threads})
+        self.generator = np.random.default_rng(configuration["SEED"])
+
+    #--------------------------------------------------------------------------
+    def _time_function(self, function):
+        function()
+        timings = []
+        for _ in range(self.num_runs):
+            start_time = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start_time)
+
+        return float(np.median(timings) * 1000)
+
+    #--------------------------------------------------------------------------
+    def calibrate(self, model):
+        state = self.generator.integers(-1, 37, size=(1, self.state_size), dtype=np.int32)
+        states = self.generator.integers(-1, 37, size=(self.batch_size, self.state_size), dtype=np.int32)
+        targets = model.predict(states, verbose=0)
+
+        results = []
+        for threads in self.thread_counts:
+            torch.set_num_threads(threads)
+            forward_ms = self._time_function(lambda: model.predict(state, verbose=0))
+            train_ms = self._time_function(lambda: model.train_on_batch(states, targets))
+            logger.info(f'{threads} threads: forward {forward_ms:.2f} ms, train step {train_ms:.2f} ms')
+            results.append({'threads' : threads, 'forward_ms' : forward_ms, 'train_step_ms' : train_ms})
+
+        recommended = {'ACTING_THREADS' : min(results, key=lambda x: x['forward_ms'])['threads'],
+                       'LEARNING_THREADS' : min(results, key=lambda x: x['train_step_ms'])['threads']}
+        logger.info(f'Recommended settings for this host: {recommended}')
+
+        return {'results' : results, 'recommended' : recommended}
+
+    # throughput of predictions and training steps is compared between float32
+    # and bfloat16 autocast, together with the share of states for which both
+    # precisions select the same action. Weights are restored after the training
+    # steps, so that both precisions are measured on the same model
+    #--------------------------------------------------------------------------
+    def benchmark_precision(self, model, num_states=4096):
+        snapshot = [w.value.detach().clone() for w in model.weights]
+        states = self.generator.integers(-1, 37, size=(num_states, self.state_size), dtype=np.int32)
+        batch = states[:self.batch_size]
+        targets = model.predict(batch, verbose=0)
+
+        results, actions = {}, {}
+        for precision in ['float32', 'bfloat16']:
+            with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=precision == 'bfloat16'):
+                actions[precision] = np.argmax(model.predict(states, verbose=0), axis=1)
+                single_ms = self._time_function(lambda: model.predict(states[:1], verbose=0))
+                batch_ms = self._time_function(lambda: model.predict(batch, verbose=0))
+                train_ms = self._time_function(lambda: model.train_on_batch(batch, targets))
+            results[precision] = {'acting_per_s' : 1000/single_ms,
+                                  'batch_samples_per_s' : self.batch_size * 1000/batch_ms,
+                                  'train_samples_per_s' : self.batch_size * 1000/train_ms}
+            with torch.no_grad():
+                for weight, value in zip(model.weights, snapshot):
+                    weight.value.copy_(value)
+
+        speedup = {k : results['bfloat16'][k]/results['float32'][k] for k in results['float32']}
+        agreement = float(np.mean(actions['float32'] == actions['bfloat16']))
+        logger.info(f'bfloat16 speedup: acting {speedup["acting_per_s"]:.2f}x, batch predictions '
+                    f'{speedup["batch_samples_per_s"]:.2f}x, training {speedup["train_samples_per_s"]:.2f}x')
+        logger.info(f'Action agreement between float32 and bfloat16: {agreement:.2%}')
+
+        return {'results' : results, 'speedup' : speedup, 'action_agreement' : agreement,
+                'native_support' : bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())}
@@ -1,35 +1,34 @@
-import os
-import pandas as pd
 import numpy as np
-import keras
 
 from FAIRS.commons.utils.process.mapping import RouletteMapper
-from FAIRS.commons.constants import CONFIG, PRED_PATH
+from FAIRS.commons.utils.learning.server import TablesState
+from FAIRS.commons.utils.learning.baselines import BaselinePolicy
+from FAIRS.commons.constants import CONFIG
 from FAIRS.commons.logger import logger
 
 
-###############################################################################
-def save_predictions_to_csv(predictions : np.array, model_name):
-
-    columns = ['extraction', 'position', 'color', 'expected_action', 'action_description']
-    predictions_path = os.path.join(PRED_PATH, f'{model_name}_predictions.csv')
-    predictions = pd.DataFrame(predictions, columns=columns)   
-    predictions.to_csv(predictions_path, index=False)
-
-
-
 ###############################################################################
 class RoulettePlayer:
 
-    def __init__(self, model : keras.Model, configuration):        
+    # model can be any object exposing a keras-like predict method, such as the
+    # keras model itself or its lookup tables and quantized counterparts, or a
+    # baseline policy that is updated with each spin. If an online learner is
+    # provided, real-time predictions are served by the learner and each observed
+    # spin is used to keep training the model
+    #--------------------------------------------------------------------------
+    def __init__(self, model, configuration, online_learner=None):        
 
-        keras.utils.set_random_seed(configuration["SEED"])  
+        np.random.seed(configuration["SEED"])  
         self.mapper = RouletteMapper()   
 
         self.model = model 
+        self.baseline = isinstance(model, BaselinePolicy)
+        self.online_learner = online_learner
         self.configuration = configuration        
         self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"] 
         self.data_fraction = CONFIG['inference']['DATA_FRACTION']
+        self.batch_size = CONFIG['inference']['BATCH_SIZE']
+        self.encoding_table = self.mapper.get_encoding_table()
 
         self.action_descriptions = {i: f"Bet on number {i}" for i in range(37)}
         self.action_descriptions[37] = "Bet on red"
@@ -37,97 +36,171 @@ class RoulettePlayer:
         self.action_descriptions[39] = "stop playing"
 
         self.last_states = None
-
+        self.tables = TablesState(self.perceptive_size)
+        self.table_actions = {}
+        self.table_policies = {}
+        self.writer = None
+
+    # perceptive field i holds the extractions preceding row i, padded with -1,
+    # with an additional field following the last row. Fields are views of the
+    # padded series, of which only the desired fraction from the tail is kept
     #--------------------------------------------------------------------------    
     def get_perceptive_fields(self, data : np.array, fraction=1.0):
 
-        perceptive_field = np.full(shape=self.perceptive_size, fill_value=-1, dtype=np.int32)
-        perceptive_fields = [perceptive_field]
+        padded = np.concatenate([np.full(self.perceptive_size, -1, dtype=np.int32),
+                                 data[:, 0].astype(np.int32)])
+        perceptive_fields = np.lib.stride_tricks.sliding_window_view(padded, self.perceptive_size)
+        self.last_states = perceptive_fields[-1].copy()
+        tail_length = int(fraction * perceptive_fields.shape[0])
 
-        if data.shape[0] > 0:            
-            extractions = data[:, 0] 
-            # Generate rolling windows over the entire dataset
-            for r in range(data.shape[0]):
-                current_extraction = extractions[r]
-                perceptive_field = np.delete(perceptive_field, 0)
-                perceptive_field = np.append(perceptive_field, current_extraction)
-                perceptive_fields.append(perceptive_field)            
-
-            # Slice the collection to get only the desired fraction from the tail
-            total_windows = len(perceptive_fields)
-            tail_length = int(fraction * total_windows)
-            perceptive_fields_collection = perceptive_fields[-tail_length:] 
-
-            self.last_states = perceptive_fields[-1]       
-        
-        return perceptive_fields_collection   
+        return perceptive_fields[perceptive_fields.shape[0] - tail_length:]
         
+    # the action suggested after each row is predicted from the perceptive field
+    # following it, for the rows within the tail fraction. Predictions are made
+    # in batches and streamed to the writer, with -1 as the action of the rows
+    # preceding the tail
     #--------------------------------------------------------------------------    
-    def play_past_roulette_games(self, data : np.array):
-
-        perceptive_fields = self.get_perceptive_fields(data, self.data_fraction)
-        predicted_actions, action_descriptions = [], []        
-
-        for pf in perceptive_fields:
-            pf = np.reshape(pf, newshape=(1, self.perceptive_size))
-            action_logits = self.model.predict(pf, verbose=1)
-            next_action = np.argmax(action_logits, axis=1)[0]
-            action_description = self.action_descriptions[next_action] 
-            predicted_actions.append(next_action) 
-            action_descriptions.append(action_description)       
-
-        # count expected missing value as 0 if no series is provided, or as the 
-        # the total length minus the perceptive field size otherwise
-        missing_count = data.shape[0] - len(perceptive_fields) if data.shape[0] > 0 else 0       
-
-        # Create arrays with placeholders for all rows and add np.nan for numeric predictions 
-        # and empty strings for action descriptions
-        predicted_extractions_full = np.full((data.shape[0], 1), np.nan, dtype=float)
-        action_descriptions_full = np.full((data.shape[0], 1), '', dtype=object)
-
-        # Fill in the tail rows with actual predictions
-        predicted_extractions_full[missing_count:] = np.array(predicted_actions).reshape(-1, 1)
-        action_descriptions_full[missing_count:] = np.array(action_descriptions).reshape(-1, 1)
-        
-        data = np.hstack((data, predicted_extractions_full, action_descriptions_full))
-
-        return data 
-
+    def play_past_roulette_games(self, data : np.array, writer):
+
+        perceptive_fields = self.get_perceptive_fields(data, 1.0)
+        num_rows = data.shape[0]
+        first_row = num_rows - min(int(self.data_fraction * (num_rows + 1)), num_rows)
+        for i in range(0, first_row, self.batch_size):
+            writer.write(data[i:min(i + self.batch_size, first_row)], -1)
+
+        # baseline policies play the whole series at once, giving the action
+        # selected after each row with the same alignment of the model
+        if self.baseline:
+            baseline_actions = self.model.play_series(data[:, 0])
+        for i in range(first_row, num_rows, self.batch_size):
+            j = min(i + self.batch_size, num_rows)
+            if self.baseline:
+                actions = baseline_actions[i + 1:j + 1]
+            else:
+                action_logits = self.model.predict(perceptive_fields[i + 1:j + 1], verbose=0)
+                actions = np.argmax(action_logits, axis=1)
+            writer.write(data[i:j], actions)
+
+        logger.info(f'Actions have been predicted for {num_rows - first_row} past extractions')
+
+    # each entered number is written together with the action suggested after it
     #--------------------------------------------------------------------------    
-    def play_real_time_roulette(self):
+    def play_real_time_roulette(self, writer=None):
 
         # Initialize the state if no predictions have been run till now        
         if self.last_states is None:
             self.last_states = np.full(shape=self.perceptive_size, fill_value=-1, dtype=np.int32)
 
-        while True:
-            current_state = np.reshape(self.last_states, newshape=(1, self.perceptive_size))           
-            action_logits = self.model.predict(current_state, verbose=1)
-            next_action = np.argmax(action_logits, axis=1)[0]
-            action_description = self.action_descriptions[next_action]
+        model = self.model
+        if self.online_learner is not None:
+            self.online_learner.start()
+            model = self.online_learner
+
+        real_number = None
+        # the learner is stopped on any exit from the loop, including end of input
+        # and keyboard interrupts, so that the adapted model is always saved
+        try:
+            while True:
+                current_state = np.reshape(self.last_states, newshape=(1, self.perceptive_size))           
+                if self.baseline:
+                    next_action = self.model.act()
+                else:
+                    action_logits = model.predict(current_state, verbose=1)
+                    next_action = np.argmax(action_logits, axis=1)[0]
+                if writer is not None and real_number is not None:
+                    writer.write(self.encoding_table[[real_number]], next_action)
+                    real_number = None
+                action_description = self.action_descriptions[next_action]
             
-            logger.info(f'FAIRSnet suggests to {action_description} (state: {next_action}) ')
+                logger.info(f'FAIRSnet suggests to {action_description} (state: {next_action}) ')
 
-            # Ask the user for the real roulette outcome
-            user_input = input('Please enter the actual number (0-36) or type "exit" to interrupt: ').strip().lower()
+                # Ask the user for the real roulette outcome
+                user_input = input('Please enter the actual number (0-36) or type "exit" to interrupt: ').strip().lower()
             
-            if user_input == 'exit':
-                print("Exiting real-time play.")
-                break
-
-            # Validate that the input is a number
-            if not user_input.isdigit():
-                print('Please enter a number between 0 and 36.')
-                continue
-
-            real_number = int(user_input)
-            if real_number < 0 or real_number > 36:
-                print('Please enter a number between 0 and 36.')
-                continue
-
-            # Update the state array by removing the oldest number and appending the new one
-            self.last_states = np.delete(self.last_states, 0)
-            self.last_states = np.append(self.last_states, real_number)
+                if user_input == 'exit':
+                    print("Exiting real-time play.")
+                    break
+
+                # Validate that the input is a number
+                if not user_input.isdigit():
+                    print('Please enter a number between 0 and 36.')
+                    continue
+
+                # the number is kept for writing only once it is validated
+                entered_number = int(user_input)
+                if entered_number < 0 or entered_number > 36:
+                    print('Please enter a number between 0 and 36.')
+                    continue
+                real_number = entered_number
+
+                # the observed spin is queued as a transition for the online learner
+                if self.online_learner is not None:
+                    self.online_learner.observe(current_state, next_action, real_number)
+                if self.baseline:
+                    self.model.update(real_number)
+
+                # Update the state array by removing the oldest number and appending the new one
+                self.last_states = np.delete(self.last_states, 0)
+                self.last_states = np.append(self.last_states, real_number)
+        finally:
+            if self.online_learner is not None:
+                self.online_learner.stop()
+
+    # spins of a streamed batch are applied in arrival order, and the actions of
+    # all tables with new spins are predicted with a single forward pass. A spin
+    # is observed by the online learner only if an action has been suggested for
+    # the state of its table preceding the spin, hence only the first spin of each
+    # table within a batch is observed. Baseline policies follow each table separately
+    #--------------------------------------------------------------------------
+    def consume_spins(self, batch):
+        model = self.model if self.online_learner is None else self.online_learner
+        rows, last_spins = {}, {}
+        for i, (table, number) in enumerate(zip(batch['tables'], batch['spins'][:, 0].tolist())):
+            row = self.tables.get_row(table)
+            last_spins[row] = i
+            # the suggestion only holds for the current state of the table
+            suggested_action = self.table_actions.pop(row, None)
+            if self.online_learner is not None and suggested_action is not None:
+                self.online_learner.observe(self.tables.states[row].copy(), 
+                                            suggested_action, number)
+            if self.baseline:
+                self.table_policies.setdefault(row, self.model.clone()).update(number)
+            self.tables.update(table, number)
+            rows[row] = table
+
+        if self.baseline:
+            actions = np.array([self.table_policies[row].act() for row in rows])
+        else:
+            states = self.tables.states[list(rows.keys())]
+            actions = np.argmax(model.predict(states, verbose=0), axis=1)
+        suggestions = {}
+        spin_actions = np.full(len(batch['tables']), -1, dtype=np.int32)
+        for (row, table), action in zip(rows.items(), actions.tolist()):
+            self.table_actions[row] = action
+            suggestions[table] = action
+            spin_actions[last_spins[row]] = action
+            logger.info(f'Table {table}: FAIRSnet suggests to {self.action_descriptions[action]}')
+        # the action suggested after each spin is saved with the spin, which is
+        # only known for the last spin of each table within the batch
+        if self.writer is not None:
+            self.writer.write(batch['spins'], spin_actions)
+
+        return suggestions
+
+    # spins are received from the streaming sources instead of the prompt, until
+    # the ingestion is interrupted. Streamed spins and suggestions are written
+    # to the predictions writer if provided
+    #--------------------------------------------------------------------------
+    def play_streamed_roulette(self, ingestion, writer=None):
+        self.writer = writer
+        ingestion.add_sink(self.consume_spins)
+        if self.online_learner is not None:
+            self.online_learner.start()
+        try:
+            ingestion.run()
+        finally:
+            if self.online_learner is not None:
+                self.online_learner.stop()
 
            
                 
@@ -68,7 +68,9 @@ class QScoreNet(keras.layers.Layer):
     def call(self, inputs, training=None):
         x = self.Q1(inputs)
         x = self.batch_norm(x, training=training)       
-        output = self.Q2(x)                         
+        # Q scores are always computed in float32, even within CPU autocast
+        with torch.autocast(device_type='cpu', enabled=False):
+            output = self.Q2(keras.ops.cast(x, 'float32'))                         
 
         return output
     
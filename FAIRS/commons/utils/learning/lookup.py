@@ -0,0 +1,86 @@
+import os
+import json
+import numpy as np
+
+from FAIRS.commons.logger import logger
+
+
+# [LOOKUP TABLES INFERENCE MODEL]
+###############################################################################
+# FAIRSnet processes each position of the perceptive field independently until
+# the flatten layer, and the inputs can only take 38 distinct values (-1 for the
+# padding and 0-36 for the roulette numbers). Therefore, the whole per-position
+# stack and the first dense layer after flattening can be replaced by a gather
+# and sum over a precomputed table of shape (perceptive field, tokens, units).
+# The remaining dense head is evaluated with plain numpy operations
+###############################################################################
+class LookupFAIRSnet:
+
+    def __init__(self, weights : dict):
+        self.weights = weights
+        self.perceptive_size, self.num_tokens, self.units = weights['token_table'].shape
+        # flatten the token table so that inputs are gathered with a single take
+        self.flat_table = weights['token_table'].reshape(-1, self.units)
+        self.position_offsets = np.arange(self.perceptive_size, dtype=np.int64) * self.num_tokens
+        self.epsilon = float(weights['norm_epsilon'])
+
+    # inputs are shifted by one so that the padding value -1 maps to row 0
+    #--------------------------------------------------------------------------
+    def gather_tokens(self, inputs):
+        indices = np.asarray(inputs, dtype=np.int64) + 1 + self.position_offsets
+
+        return np.take(self.flat_table, indices, axis=0).sum(axis=1)
+
+    #--------------------------------------------------------------------------
+    def layer_normalization(self, x):
+        mean = x.mean(axis=-1, keepdims=True)
+        variance = x.var(axis=-1, keepdims=True)
+        x = (x - mean)/np.sqrt(variance + self.epsilon)
+
+        return x * self.weights['norm_gamma'] + self.weights['norm_beta']
+
+    # mirrors the keras predict signature, so that the lookup model can be used
+    # in place of the original model during inference
+    #--------------------------------------------------------------------------
+    def predict(self, inputs, verbose=0):
+        inputs = np.reshape(inputs, (-1, self.perceptive_size))
+        res = self.gather_tokens(inputs) + self.weights['dense_bias']
+        layer = res @ self.weights['head_kernel'] + self.weights['head_bias']
+        layer = self.layer_normalization(res + layer)
+        layer = np.maximum(layer, 0)
+        # batch normalization is already folded into the first Q layer
+        layer = layer @ self.weights['Q1_kernel'] + self.weights['Q1_bias']
+        output = layer @ self.weights['Q2_kernel'] + self.weights['Q2_bias']
+
+        return output.astype(np.float32, copy=False)
+
+    # each weight array is saved as a separate .npy file, and a manifest holding
+    # names, shapes and data types is written alongside them
+    #--------------------------------------------------------------------------
+    def save(self, path, metadata=None):
+        os.makedirs(path, exist_ok=True)
+        arrays = {}
+        for name, array in self.weights.items():
+            array = np.ascontiguousarray(array, dtype=np.float32)
+            np.save(os.path.join(path, f'{name}.npy'), array)
+            arrays[name] = {'file' : f'{name}.npy',
+                            'shape' : list(array.shape),
+                            'dtype' : str(array.dtype)}
+
+        manifest = {'model' : 'LookupFAIRSnet',
+                    'arrays' : arrays,
+                    'metadata' : metadata if metadata is not None else {}}
+        with open(os.path.join(path, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=4)
+
+    # arrays are memory-mapped rather than read, so that the model is ready as
+    # soon as the manifest has been parsed
+    #--------------------------------------------------------------------------
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'manifest.json'), 'r') as file:
+            manifest = json.load(file)
+        weights = {name : np.load(os.path.join(path, item['file']), mmap_mode=mmap_mode)
+                   for name, item in manifest['arrays'].items()}
+
+        return cls(weights)
@@ -63,15 +63,19 @@ class RouletteAccuracy(keras.metrics.Metric):
             accuracy = keras.ops.multiply(accuracy, sample_weight)
             
         
+        # count the evaluated samples, weighted as the correct predictions
+        count = keras.ops.sum(sample_weight) if sample_weight is not None else keras.ops.shape(y_true)[0]
+
         # Update the state variables
-        self.total.assign_add(keras.ops.sum(accuracy))
+        self.total.assign_add(keras.ops.sum(keras.ops.cast(accuracy, dtype=torch.float32)))
+        self.count.assign_add(keras.ops.cast(count, dtype=torch.float32))
      
     #--------------------------------------------------------------------------
     def result(self):
         return self.total / (self.count + keras.backend.epsilon())
     
     #--------------------------------------------------------------------------
-    def reset_NUMBERS(self):
+    def reset_state(self):
         self.total.assign(0)
         self.count.assign(0)
 
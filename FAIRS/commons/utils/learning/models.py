@@ -16,8 +16,6 @@ class FAIRSnet:
         self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"] 
         self.embedding_dims = configuration["model"]["EMBEDDING_DIMS"] 
         self.neurons = configuration["model"]["UNITS"]                   
-        self.jit_compile = configuration["model"]["JIT_COMPILE"]
-        self.jit_backend = configuration["model"]["JIT_BACKEND"]
         self.learning_rate = configuration["training"]["LEARNING_RATE"]       
         self.seed = configuration["SEED"]
        
@@ -67,9 +65,6 @@ class FAIRSnet:
         opt = keras.optimizers.AdamW(learning_rate=self.learning_rate)          
         model.compile(loss=loss, optimizer=opt, metrics=metric, jit_compile=False)
 
-        if self.jit_compile:
-            model = torch.compile(model, backend=self.jit_backend, mode='default')
-
         if model_summary:
             model.summary(expand_nested=True)
 
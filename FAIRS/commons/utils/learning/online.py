@@ -0,0 +1,173 @@
+import os
+import copy
+import shutil
+import queue
+import threading
+import numpy as np
+import keras
+import torch
+
+from FAIRS.commons.utils.learning.agents import DQNAgent
+from FAIRS.commons.utils.learning.rewards import RoulettePayouts
+from FAIRS.commons.utils.learning.execution import CPUExecutionPolicy
+from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+from FAIRS.commons.constants import CONFIG, CHECKPOINT_PATH
+from FAIRS.commons.logger import logger
+
+
+# [ONLINE CONTINUAL LEARNING]
+###############################################################################
+# Each spin observed during real-time play becomes a transition, rewarded with
+# the payout of the action that was suggested for it. Transitions are queued by
+# the prediction path and consumed by a background learner thread, which owns
+# a bounded replay memory and performs a few double DQN updates for each spin.
+# Predictions are served by two acting copies of the model: refreshed weights
+# are copied into the idle copy, which then becomes the active one with a single
+# reference swap, hence the prompt never waits for the learner. The adapted
+# model is saved periodically as a new checkpoint next to the original one
+###############################################################################
+class OnlineLearner:
+
+    def __init__(self, model : keras.Model, configuration, checkpoint_path):
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.batch_size = CONFIG['online_learning']['BATCH_SIZE']
+        self.min_transitions = CONFIG['online_learning']['MIN_TRANSITIONS']
+        self.updates_per_spin = CONFIG['online_learning']['UPDATES_PER_SPIN']
+        self.swap_updates = CONFIG['online_learning']['SWAP_UPDATES']
+        self.checkpoint_updates = CONFIG['online_learning']['CHECKPOINT_UPDATES']
+
+        # the replay memory is a bounded ring buffer of perceptive fields, and
+        # minibatches are sampled directly by the learner thread
+        self.configuration = copy.deepcopy(configuration)
+        self.configuration['agent']['MAX_MEMORY'] = CONFIG['online_learning']['MEMORY_SIZE']
+        self.configuration['agent']['REPLAY_BUFFER'] = max(self.min_transitions, self.batch_size)
+        self.configuration['agent']['REPLAY_STORAGE'] = 'window'
+        self.configuration['training']['PREFETCH_BATCHES'] = 0
+        self.agent = DQNAgent(self.configuration, None)
+        self.payouts = RoulettePayouts(configuration)
+        # the prompt keeps the acting profile, while the learner thread uses the
+        # learning profile, as torch thread counts are set for the calling thread
+        self.cpu_policy = CPUExecutionPolicy(configuration)
+
+        self.model = model
+        self.target_model = self.clone_model(model)
+        self.acting_models = [self.clone_model(model), self.clone_model(model)]
+        self.model_locks = [threading.Lock(), threading.Lock()]
+        self.active = 0
+
+        self.serializer = ModelSerializer()
+        self.source_path = checkpoint_path
+        # adapting an already adapted checkpoint keeps updating the same folder
+        checkpoint_name = os.path.basename(checkpoint_path)
+        if not checkpoint_name.endswith('_online'):
+            checkpoint_name = f'{checkpoint_name}_online'
+        self.checkpoint_path = os.path.join(CHECKPOINT_PATH, checkpoint_name)
+        self.transitions = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.updates = 0
+        self.session = []
+        self.saved_entries = 0
+
+    #--------------------------------------------------------------------------
+    def clone_model(self, model : keras.Model):
+        clone = keras.models.clone_model(model)
+        clone.set_weights(model.get_weights())
+
+        return clone
+
+    #--------------------------------------------------------------------------
+    @torch.no_grad()
+    def copy_weights(self, source : keras.Model, destination : keras.Model):
+        torch._foreach_copy_([w.value for w in destination.weights], [w.value for w in source.weights])
+
+    # the active copy is read once, and its lock only guards against the learner
+    # refreshing the same copy while a prediction is still running on it
+    #--------------------------------------------------------------------------
+    def predict(self, inputs, verbose=0):
+        index = self.active
+        with self.model_locks[index]:
+            return self.acting_models[index].predict(inputs, verbose=0)
+
+    # called by the prediction path once the outcome of a spin is known
+    #--------------------------------------------------------------------------
+    def observe(self, state, action, extraction):
+        state = np.reshape(state, -1)
+        next_state = np.append(state[1:], extraction)
+        reward = self.payouts.get_rewards(action, extraction)
+        done = action == self.payouts.stop_action
+        self.transitions.put((state, action, reward, next_state, done, {}))
+
+    # weights are refreshed in the idle copy, which is then swapped in. The
+    # target model is synchronized at the same time (hard update)
+    #--------------------------------------------------------------------------
+    def publish_weights(self):
+        idle = 1 - self.active
+        with self.model_locks[idle]:
+            self.copy_weights(self.model, self.acting_models[idle])
+        self.active = idle
+        self.copy_weights(self.model, self.target_model)
+
+    # the training data of the original checkpoint is copied, so that the adapted
+    # checkpoint can also be used to resume training. Session history is merged
+    # on saving, hence only the entries added since the last save are passed
+    #--------------------------------------------------------------------------
+    def save_checkpoint(self):
+        data_path = os.path.join(self.checkpoint_path, 'data')
+        if not os.path.exists(data_path):
+            shutil.copytree(os.path.join(self.source_path, 'data'), data_path)
+        _, history = self.serializer.load_session_configuration(self.source_path)
+        history = {'history' : self.session[self.saved_entries:], 
+                   'total_epochs' : (history or {}).get('total_epochs', 0)}
+        self.saved_entries = len(self.session)
+        self.serializer.save_pretrained_model(self.model, self.checkpoint_path)
+        self.serializer.save_target_model(self.target_model, self.checkpoint_path)
+        self.agent.save_agent_state(self.checkpoint_path)
+        self.serializer.save_session_configuration(self.checkpoint_path, history, self.configuration)
+        logger.debug(f'Adapted model saved after {self.updates} online updates')
+
+    #--------------------------------------------------------------------------
+    def learning_loop(self):
+        self.cpu_policy.set_profile('learning')
+        while not self.stop_event.is_set():
+            try:
+                transition = self.transitions.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # all pending transitions are stored before updating the model
+            self.agent.remember(*transition)
+            while not self.transitions.empty():
+                self.agent.remember(*self.transitions.get_nowait())
+            if len(self.agent.memory) < self.configuration['agent']['REPLAY_BUFFER']:
+                continue
+
+            for _ in range(self.updates_per_spin):
+                scores = self.agent.replay(self.model, self.target_model, self.payouts, self.batch_size)
+                self.updates += 1
+                if self.updates % self.swap_updates == 0:
+                    self.publish_weights()
+                if self.updates % self.checkpoint_updates == 0:
+                    self.save_checkpoint()
+            self.session.append({'spins' : int(self.agent.steps),
+                                 'updates' : self.updates,
+                                 'loss' : float(scores['loss'])})
+
+    #--------------------------------------------------------------------------
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.learning_loop, daemon=True)
+        self.thread.start()
+        logger.info(f'Online learning started, adapted checkpoints are saved in {self.checkpoint_path}')
+
+    # the latest weights are published and saved when the session ends
+    #--------------------------------------------------------------------------
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        if self.updates > 0:
+            self.publish_weights()
+            self.save_checkpoint()
+            logger.info(f'Online learning performed {self.updates} updates over {self.agent.steps} spins')
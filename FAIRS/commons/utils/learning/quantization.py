@@ -0,0 +1,191 @@
+import os
+import io
+import time
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import quantize_dynamic
+import keras
+
+from FAIRS.commons.utils.learning.compiler import FAIRSnetCompiler
+from FAIRS.commons.utils.learning.embeddings import RouletteEmbedding
+from FAIRS.commons.utils.learning.logits import AddNorm
+from FAIRS.commons.constants import CONFIG, STATES
+from FAIRS.commons.logger import logger
+
+
+# [TORCH FAIRSNET]
+###############################################################################
+# Plain torch replica of FAIRSnet used for inference only. Dropout is omitted
+# and batch normalization of the Q head is folded into the Q1 layer, so that all
+# the dense layers of the model can be replaced with dynamically quantized ones
+###############################################################################
+class TorchFAIRSnet(nn.Module):
+
+    def __init__(self, configuration, epsilon=10e-5):
+        super(TorchFAIRSnet, self).__init__()
+        self.configuration = configuration
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.embedding_dims = configuration["model"]["EMBEDDING_DIMS"]
+        self.neurons = configuration["model"]["UNITS"]
+        self.embedding_scale = float(np.sqrt(self.embedding_dims))
+
+        self.embedding = nn.Embedding(STATES, self.embedding_dims)
+        self.dense_layers = nn.ModuleList([
+            nn.Linear(self.embedding_dims, self.neurons),
+            nn.Linear(self.neurons, self.neurons),
+            nn.Linear(self.neurons, self.neurons//2),
+            nn.Linear(self.neurons//2, self.neurons//2),
+            nn.Linear(self.perceptive_size * self.neurons//2, self.neurons*2),
+            nn.Linear(self.neurons*2, self.neurons*2)])
+        self.norm_layers = nn.ModuleList([
+            nn.LayerNorm(self.neurons, eps=epsilon),
+            nn.LayerNorm(self.neurons//2, eps=epsilon),
+            nn.LayerNorm(self.neurons*2, eps=epsilon)])
+        self.Q1 = nn.Linear(self.neurons*2, self.neurons)
+        self.Q2 = nn.Linear(self.neurons, STATES)
+
+    #--------------------------------------------------------------------------
+    def forward(self, inputs):
+        mask = (inputs != -1).unsqueeze(-1).to(torch.float32)
+        layer = self.embedding(inputs.clamp(min=0)) * self.embedding_scale * mask
+        for i, norm in enumerate(self.norm_layers):
+            if i == 2:
+                layer = torch.flatten(layer, start_dim=1)
+            res = self.dense_layers[2*i](layer)
+            layer = self.dense_layers[2*i + 1](res)
+            layer = torch.relu(norm(res + layer))
+
+        return self.Q2(self.Q1(layer))
+
+    # copy weights from the keras model, following the same layers order used
+    # when building FAIRSnet
+    #--------------------------------------------------------------------------
+    @torch.no_grad()
+    def load_keras_weights(self, model : keras.Model):
+        compiler = FAIRSnetCompiler(self.configuration)
+        to_tensor = lambda x : torch.from_numpy(np.asarray(keras.ops.convert_to_numpy(x), dtype=np.float32))
+        embedding = [layer for layer in model.layers if isinstance(layer, RouletteEmbedding)][0]
+        dense_layers = [layer for layer in model.layers if isinstance(layer, keras.layers.Dense)]
+        norm_layers = [layer for layer in model.layers if isinstance(layer, AddNorm)]
+        _, _, _, QNet = compiler.split_model_layers(model)
+
+        self.embedding.weight.copy_(to_tensor(embedding.numbers_embedding.embeddings))
+        for source, target in zip(dense_layers, self.dense_layers):
+            target.weight.copy_(to_tensor(source.kernel).T)
+            target.bias.copy_(to_tensor(source.bias))
+        for source, target in zip(norm_layers, self.norm_layers):
+            target.weight.copy_(to_tensor(source.layernorm.gamma))
+            target.bias.copy_(to_tensor(source.layernorm.beta))
+
+        Q1_kernel, Q1_bias = compiler.fold_batch_normalization(QNet)
+        self.Q1.weight.copy_(torch.from_numpy(Q1_kernel).T)
+        self.Q1.bias.copy_(torch.from_numpy(Q1_bias))
+        self.Q2.weight.copy_(to_tensor(QNet.Q2.kernel).T)
+        self.Q2.bias.copy_(to_tensor(QNet.Q2.bias))
+
+
+# [QUANTIZED INFERENCE MODEL]
+###############################################################################
+class QuantizedFAIRSnet:
+
+    def __init__(self, module : nn.Module):
+        self.module = module.eval()
+
+    # mirrors the keras predict signature, so that the quantized model can be used
+    # in place of the original model during inference
+    #--------------------------------------------------------------------------
+    @torch.inference_mode()
+    def predict(self, inputs, verbose=0):
+        inputs = torch.as_tensor(np.asarray(inputs), dtype=torch.long)
+        inputs = inputs.reshape(-1, self.module.perceptive_size)
+
+        return self.module(inputs).numpy()
+
+
+# [DYNAMIC INT8 QUANTIZATION]
+###############################################################################
+class FAIRSnetQuantizer:
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.model_name = 'saved_model_int8.pt'
+
+    #--------------------------------------------------------------------------
+    def build_quantized_module(self, module : nn.Module):
+        return quantize_dynamic(module.eval(), {nn.Linear}, dtype=torch.qint8)
+
+    # weights are quantized to int8 per output channel, while activations are
+    # quantized dynamically at each forward pass
+    #--------------------------------------------------------------------------
+    def quantize(self, model : keras.Model):
+        module = TorchFAIRSnet(self.configuration)
+        module.load_keras_weights(model)
+        quantized_module = self.build_quantized_module(module)
+
+        return QuantizedFAIRSnet(quantized_module)
+
+    #--------------------------------------------------------------------------
+    def save_quantized_model(self, model : QuantizedFAIRSnet, path):
+        model_path = os.path.join(path, self.model_name)
+        torch.save(model.module.state_dict(), model_path)
+        logger.info(f'Quantized model has been saved in {model_path}')
+
+    # the quantized structure is rebuilt from the session configuration, and the
+    # packed int8 weights are then loaded from the state dictionary
+    #--------------------------------------------------------------------------
+    def load_quantized_model(self, path):
+        model_path = os.path.join(path, self.model_name)
+        quantized_module = self.build_quantized_module(TorchFAIRSnet(self.configuration))
+        quantized_module.load_state_dict(torch.load(model_path))
+
+        return QuantizedFAIRSnet(quantized_module)
+
+    #--------------------------------------------------------------------------
+    def _state_dict_size(self, module : nn.Module):
+        buffer = io.BytesIO()
+        torch.save(module.state_dict(), buffer)
+
+        return buffer.getbuffer().nbytes
+
+    #--------------------------------------------------------------------------
+    def _single_state_latency(self, model, inputs, num_runs):
+        latencies = []
+        for i in range(num_runs):
+            state = inputs[i % inputs.shape[0]][None, :]
+            start = time.perf_counter()
+            model.predict(state, verbose=0)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        return np.percentile(latencies, [50, 95])
+
+    # compare the quantized model with the float model over a backtest, checking
+    # the agreement of the selected actions together with latency and memory
+    #--------------------------------------------------------------------------
+    def evaluate(self, model : keras.Model, quantized_model : QuantizedFAIRSnet,
+                 inputs : np.array, batch_size=512, num_runs=200):
+        float_actions, quantized_actions = [], []
+        for i in range(0, inputs.shape[0], batch_size):
+            batch = inputs[i:i + batch_size]
+            float_actions.append(np.argmax(model.predict(batch, verbose=0), axis=1))
+            quantized_actions.append(np.argmax(quantized_model.predict(batch), axis=1))
+        float_actions = np.concatenate(float_actions)
+        quantized_actions = np.concatenate(quantized_actions)
+
+        float_latency = self._single_state_latency(model, inputs, num_runs)
+        quantized_latency = self._single_state_latency(quantized_model, inputs, num_runs)
+        float_memory = sum(w.numpy().nbytes for w in model.weights)
+        quantized_memory = self._state_dict_size(quantized_model.module)
+
+        report = {'samples' : int(inputs.shape[0]),
+                  'action_agreement' : float(np.mean(float_actions == quantized_actions)),
+                  'float_latency_ms' : {'p50' : float_latency[0], 'p95' : float_latency[1]},
+                  'quantized_latency_ms' : {'p50' : quantized_latency[0], 'p95' : quantized_latency[1]},
+                  'float_memory_bytes' : int(float_memory),
+                  'quantized_memory_bytes' : int(quantized_memory)}
+
+        logger.info(f'Action agreement with float model: {report["action_agreement"]:.2%} over {inputs.shape[0]} states')
+        logger.info(f'Single state latency (p50): {float_latency[0]:.3f} ms (float) vs {quantized_latency[0]:.3f} ms (int8)')
+        logger.info(f'Weights memory: {float_memory/1e6:.2f} MB (float) vs {quantized_memory/1e6:.2f} MB (int8)')
+
+        return report
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+import torch
+
+from FAIRS.commons.logger import logger
+
+
+# [REPLAY MEMORY]
+###############################################################################
+# Transitions are stored in preallocated arrays used as a ring buffer, so that
+# the oldest transitions are overwritten once the memory is full and minibatches
+# are gathered with fancy indexing instead of stacking python tuples. Adding and
+# sampling are guarded by a lock, as minibatches can be prepared by a background
+# thread while the agent keeps adding transitions. Subclasses define how the
+# states of each transition are stored and gathered
+###############################################################################
+class ReplayMemory(ABC):
+
+    def __init__(self, configuration):
+        self.capacity = configuration['agent']['MAX_MEMORY']
+        self.state_size = configuration['model']['PERCEPTIVE_FIELD']
+        self.gamma = configuration['agent']['DISCOUNT_RATE']
+        self.n_steps = configuration['agent'].get('N_STEPS', 1)
+        self.generator = np.random.default_rng(configuration['SEED'])
+        self.actions = np.zeros(self.capacity, dtype=np.uint8)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=bool)
+        self.buffers = ['actions', 'rewards', 'dones']
+        self.position = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def __len__(self):
+        return self.size
+
+    # the slot is fully written before the head and size are advanced, so that
+    # transitions are never sampled while partially overwritten
+    #--------------------------------------------------------------------------
+    def add(self, state, action, reward, next_state, done, info):
+        with self.lock:
+            position = self.position
+            self.actions[position] = action
+            self.rewards[position] = reward
+            self.dones[position] = done
+            self.store_states(position, state, next_state, info)
+            self.position = (position + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def store_states(self, position, state, next_state, info):
+        pass
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def get_states(self, indices):
+        pass
+
+    #--------------------------------------------------------------------------
+    @abstractmethod
+    def get_next_states(self, indices):
+        pass
+
+    # discounted rewards of the following n transitions are accumulated for all
+    # sampled transitions at once. Accumulation stops after the first done flag
+    # or at the most recent transition in memory, and the bootstrap state is the
+    # next state of the last accumulated transition
+    #--------------------------------------------------------------------------
+    def get_n_step_returns(self, indices, reward_scaler=None):
+        offsets = np.arange(self.n_steps)
+        sequence = (indices[:, None] + offsets[None, :]) % self.capacity
+        # number of transitions stored from each sampled index up to the head
+        remaining = (self.position - indices - 1) % self.capacity + 1
+        available = offsets[None, :] < remaining[:, None]
+        dones = self.dones[sequence] & available
+        done_before = (np.cumsum(dones, axis=1) - dones) > 0
+        included = available & ~done_before
+
+        rewards = self.rewards[sequence]
+        if reward_scaler is not None:
+            rewards = reward_scaler(rewards)
+        discounts = self.gamma ** offsets
+        returns = np.sum(np.where(included, rewards * discounts[None, :], 0), axis=1)
+
+        num_steps = included.sum(axis=1)
+        last_indices = sequence[np.arange(indices.shape[0]), num_steps - 1]
+
+        return (returns.astype(np.float32), last_indices,
+                self.dones[last_indices].astype(np.int32),
+                (self.gamma ** num_steps).astype(np.float32))
+
+    # transitions are sampled uniformly without replacement, using the memory
+    # own random generator so that sampling does not depend on global seeds.
+    # Returns are the n-step discounted rewards, and bootstrap discounts are
+    # the discount factors to apply to the Q-values of the next states
+    #--------------------------------------------------------------------------
+    def sample(self, batch_size, reward_scaler=None):
+        with self.lock:
+            indices = self.generator.choice(self.size, size=batch_size, replace=False)
+            returns, last_indices, dones, discounts = self.get_n_step_returns(indices, reward_scaler)
+            states = self.get_states(indices)
+            next_states = self.get_next_states(last_indices)
+            actions = self.actions[indices].astype(np.int32)
+
+        return states, actions, returns, next_states, dones, discounts
+
+    #--------------------------------------------------------------------------
+    def get_memory_usage(self):
+        return sum(getattr(self, name).nbytes for name in self.buffers)
+
+    # only the filled part of each buffer is saved, from the oldest to the most
+    # recent transition, with each buffer written in bulk as a .npy file
+    #--------------------------------------------------------------------------
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        order = (self.position - self.size + np.arange(self.size)) % self.capacity
+        for name in self.buffers:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name)[order])
+        metadata = {'size' : int(self.size),
+                    'generator_state' : self.generator.bit_generator.state}
+        with open(os.path.join(path, 'replay_memory.json'), 'w') as file:
+            json.dump(metadata, file)
+
+    # saved buffers are memory-mapped and copied into the preallocated arrays,
+    # keeping the most recent transitions if the capacity has been reduced
+    #--------------------------------------------------------------------------
+    def load(self, path):
+        with open(os.path.join(path, 'replay_memory.json'), 'r') as file:
+            metadata = json.load(file)
+        size = min(metadata['size'], self.capacity)
+        for name in self.buffers:
+            saved_buffer = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            getattr(self, name)[:size] = saved_buffer[saved_buffer.shape[0] - size:]
+        self.size = size
+        self.position = size % self.capacity
+        self.generator.bit_generator.state = metadata['generator_state']
+        logger.info(f'Replay memory has been restored with {size} transitions')
+
+
+# [WINDOW REPLAY MEMORY]
+###############################################################################
+# Stores both perceptive fields of each transition, as values within [-1, 36]
+# fit into a single byte
+###############################################################################
+class WindowReplayMemory(ReplayMemory):
+
+    def __init__(self, configuration):
+        super(WindowReplayMemory, self).__init__(configuration)
+        self.states = np.zeros((self.capacity, self.state_size), dtype=np.int8)
+        self.next_states = np.zeros((self.capacity, self.state_size), dtype=np.int8)
+        self.buffers.extend(['states', 'next_states'])
+
+    #--------------------------------------------------------------------------
+    def store_states(self, position, state, next_state, info):
+        self.states[position] = np.reshape(state, -1)
+        self.next_states[position] = np.reshape(next_state, -1)
+
+    #--------------------------------------------------------------------------
+    def get_states(self, indices):
+        return self.states[indices].astype(np.int32)
+
+    #--------------------------------------------------------------------------
+    def get_next_states(self, indices):
+        return self.next_states[indices].astype(np.int32)
+
+
+# [INDEXED REPLAY MEMORY]
+###############################################################################
+# Stores only the index of the extraction revealed by each transition and the
+# index at which the episode started, since both perceptive fields are windows
+# of the same series. States are rebuilt at sampling time with a single gather,
+# with -1 padding for positions preceding the episode start
+###############################################################################
+class IndexedReplayMemory(ReplayMemory):
+
+    def __init__(self, configuration, timeseries : np.array):
+        super(IndexedReplayMemory, self).__init__(configuration)
+        self.timeseries = np.asarray(timeseries, dtype=np.uint8)
+        self.extraction_indices = np.zeros(self.capacity, dtype=np.int32)
+        self.episode_starts = np.zeros(self.capacity, dtype=np.int32)
+        self.buffers.extend(['extraction_indices', 'episode_starts'])
+        self.offsets = np.arange(-self.state_size, 0, dtype=np.int32)
+
+    #--------------------------------------------------------------------------
+    def store_states(self, position, state, next_state, info):
+        self.extraction_indices[position] = info['extraction_index']
+        self.episode_starts[position] = info['episode_start']
+
+    # the state preceding the extraction at index i holds the previous spins of
+    # the episode, while the next state also includes the extraction itself
+    #--------------------------------------------------------------------------
+    def gather_windows(self, last_indices, episode_starts):
+        indices = last_indices[:, None] + self.offsets[None, :]
+        windows = self.timeseries[np.maximum(indices, 0)].astype(np.int32)
+        windows[indices < episode_starts[:, None]] = -1
+
+        return windows
+
+    #--------------------------------------------------------------------------
+    def get_states(self, indices):
+        return self.gather_windows(self.extraction_indices[indices], self.episode_starts[indices])
+
+    #--------------------------------------------------------------------------
+    def get_next_states(self, indices):
+        return self.gather_windows(self.extraction_indices[indices] + 1, self.episode_starts[indices])
+
+
+# [REPLAY PREFETCHER]
+###############################################################################
+# Prepares the next minibatches in a background thread while the learner is
+# busy with the training step. Each minibatch is sampled from the replay memory
+# and its states are converted into contiguous tensors (pinned when training on
+# GPU), so that the learner only has to dequeue ready batches. Batches can lag
+# behind the memory by a few transitions, which is harmless for off-policy replay
+# but makes the sampled transitions depend on thread timing, hence training runs
+# are only reproducible for a fixed SEED without prefetching
+###############################################################################
+class ReplayPrefetcher:
+
+    def __init__(self, memory : ReplayMemory, configuration):
+        self.memory = memory
+        self.num_batches = configuration['training'].get('PREFETCH_BATCHES', 0)
+        self.pin_memory = (configuration['device']['DEVICE'] == 'GPU' and torch.cuda.is_available())
+        self.queue = queue.Queue(maxsize=max(self.num_batches, 1))
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stall_times = deque(maxlen=1000)
+        self.queue_depths = deque(maxlen=1000)
+        self.total_stall_time = 0.0
+
+    #--------------------------------------------------------------------------
+    def prepare_batch(self, batch_size, reward_scaler):
+        states, actions, returns, next_states, dones, discounts = self.memory.sample(
+            batch_size, reward_scaler)
+        states = torch.from_numpy(np.ascontiguousarray(states))
+        next_states = torch.from_numpy(np.ascontiguousarray(next_states))
+        if self.pin_memory:
+            states, next_states = states.pin_memory(), next_states.pin_memory()
+
+        return states, actions, returns, next_states, dones, discounts
+
+    #--------------------------------------------------------------------------
+    def _prefetch_loop(self, batch_size, reward_scaler):
+        while not self.stop_event.is_set():
+            batch = self.prepare_batch(batch_size, reward_scaler)
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    #--------------------------------------------------------------------------
+    def start(self, batch_size, reward_scaler=None):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._prefetch_loop, args=(batch_size, reward_scaler),
+                                       daemon=True)
+        self.thread.start()
+
+    # stall time is the time the learner waits for a batch to be ready
+    #--------------------------------------------------------------------------
+    def get_batch(self):
+        self.queue_depths.append(self.queue.qsize())
+        start_time = time.perf_counter()
+        batch = self.queue.get()
+        stall_time = time.perf_counter() - start_time
+        self.stall_times.append(stall_time)
+        self.total_stall_time += stall_time
+
+        return batch
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    #--------------------------------------------------------------------------
+    def get_stats(self):
+        return {'queue_depth' : float(np.mean(self.queue_depths)) if self.queue_depths else 0.0,
+                'stall_ms' : float(np.mean(self.stall_times) * 1000) if self.stall_times else 0.0,
+                'total_stall_s' : self.total_stall_time}
+
+
+#------------------------------------------------------------------------------
+def build_replay_memory(configuration, timeseries : np.array):
+    storage = configuration['agent'].get('REPLAY_STORAGE', 'window')
+    if storage == 'indexed':
+        memory = IndexedReplayMemory(configuration, timeseries)
+    else:
+        memory = WindowReplayMemory(configuration)
+    logger.info(f'Replay memory ({storage}) allocated with {memory.get_memory_usage()/1024**2:.1f} MB')
+
+    return memory
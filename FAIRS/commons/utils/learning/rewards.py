@@ -0,0 +1,52 @@
+import numpy as np
+
+from FAIRS.commons.utils.process.mapping import RouletteMapper
+from FAIRS.commons.constants import CONFIG, STATES, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# [PAYOUT MATRIX]
+###############################################################################
+# Rewards of all actions (rows) against all possible outcomes (columns), where
+# actions 0-36 are straight-up bets, 37 and 38 are bets on red and black and 39
+# is the stop action. Rewards of any action and outcome vectors are obtained
+# with a single gather, without branching over the type of bet
+###############################################################################
+class RoulettePayouts:
+
+    def __init__(self, configuration):
+        self.bet_amount = configuration["environment"]["BET_AMOUNT"]
+        mapper = RouletteMapper()
+        self.red_action = NUMBERS
+        self.black_action = NUMBERS + 1
+        self.stop_action = NUMBERS + 2
+
+        # losing bets are the default outcome for any action except stopping
+        self.payouts = np.full((STATES, NUMBERS), fill_value=-self.bet_amount, dtype=np.float32)
+        numbers = np.arange(NUMBERS)
+        self.payouts[numbers, numbers] = 35 * self.bet_amount
+        self.payouts[self.red_action, mapper.color_map['red']] = self.bet_amount
+        self.payouts[self.black_action, mapper.color_map['black']] = self.bet_amount
+        self.payouts[self.stop_action, :] = 0
+        self.scaled_payouts = self.scale_rewards(self.payouts)
+
+    # Scale negative rewards to [-1, 0] and scale positive rewards to [0, 1]
+    #--------------------------------------------------------------------------
+    def scale_rewards(self, rewards):
+        rewards = np.asarray(rewards, dtype=np.float32)
+        scale = np.where(rewards < 0, self.bet_amount, 35 * self.bet_amount)
+
+        return rewards/scale
+
+    #--------------------------------------------------------------------------
+    def get_rewards(self, actions, outcomes, scaled=False):
+        payouts = self.scaled_payouts if scaled else self.payouts
+
+        return payouts[actions, outcomes]
+
+    # rewards of every action at each spin of the series, with shape (spins, actions)
+    #--------------------------------------------------------------------------
+    def get_counterfactual_rewards(self, outcomes, scaled=False):
+        payouts = self.scaled_payouts if scaled else self.payouts
+
+        return payouts.T[outcomes]
@@ -0,0 +1,209 @@
+import json
+import time
+import asyncio
+import functools
+import numpy as np
+from collections import deque
+
+from FAIRS.commons.constants import CONFIG, NUMBERS
+from FAIRS.commons.logger import logger
+
+
+# [TABLES STATE]
+###############################################################################
+# Rolling perceptive fields of all followed tables, stored as rows of a single
+# array so that the states of a micro-batch can be gathered at once
+###############################################################################
+class TablesState:
+
+    def __init__(self, perceptive_size, initial_tables=64):
+        self.perceptive_size = perceptive_size
+        self.states = np.full((initial_tables, perceptive_size), fill_value=-1, dtype=np.int32)
+        self.table_index = {}
+
+    #--------------------------------------------------------------------------
+    def get_row(self, table):
+        row = self.table_index.get(table)
+        if row is None:
+            row = len(self.table_index)
+            # grow the states array by doubling its size when all rows are taken
+            if row >= self.states.shape[0]:
+                padding = np.full_like(self.states, fill_value=-1)
+                self.states = np.concatenate([self.states, padding], axis=0)
+            self.table_index[table] = row
+
+        return row
+
+    #--------------------------------------------------------------------------
+    def update(self, table, number):
+        row = self.get_row(table)
+        if number is not None:
+            self.states[row, :-1] = self.states[row, 1:]
+            self.states[row, -1] = number
+
+        return row
+
+
+# [MICRO-BATCHING PREDICTION SERVER]
+###############################################################################
+class PredictionServer:
+
+    def __init__(self, model, configuration):
+        self.model = model
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.host = CONFIG['server']['HOST']
+        self.port = CONFIG['server']['PORT']
+        self.max_batch_size = CONFIG['server']['MAX_BATCH_SIZE']
+        self.batch_deadline = CONFIG['server']['BATCH_DEADLINE_MS']/1000
+
+        self.action_descriptions = {i: f"Bet on number {i}" for i in range(37)}
+        self.action_descriptions[37] = "Bet on red"
+        self.action_descriptions[38] = "Bet on black"
+        self.action_descriptions[39] = "stop playing"
+
+        self.tables = TablesState(self.perceptive_size)
+        self.queue = None
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.max_queue_depth = 0
+
+    # collect requests until either the batch is full or the deadline since the
+    # first request has expired, then answer all of them with one forward pass.
+    # Futures of handlers that have been cancelled in the meantime are skipped,
+    # and any failure is reported to the pending requests so that the loop
+    # keeps serving the following ones
+    #--------------------------------------------------------------------------
+    async def batching_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                deadline = loop.time() + self.batch_deadline
+                while len(batch) < self.max_batch_size:
+                    if not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                        continue
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                # spins are applied in arrival order, so that multiple spins of the
+                # same table within a batch yield consecutive states
+                states = np.empty((len(batch), self.perceptive_size), dtype=np.int32)
+                for i, (table, number, _, _) in enumerate(batch):
+                    row = self.tables.update(table, number)
+                    states[i] = self.tables.states[row]
+
+                predict = functools.partial(self.model.predict, verbose=0)
+                q_values = await loop.run_in_executor(None, predict, states)
+                actions = np.argmax(q_values, axis=1)
+                finish_time = time.perf_counter()
+                self.batch_sizes.append(len(batch))
+                for (table, _, future, start_time), action in zip(batch, actions):
+                    self.latencies.append((finish_time - start_time) * 1000)
+                    if not future.done():
+                        future.set_result(int(action))
+            except Exception as e:
+                logger.error(f'Failed to serve a batch of {len(batch)} requests: {e}')
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    #--------------------------------------------------------------------------
+    async def submit_spin(self, table, number):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((table, number, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        action = await future
+
+        return {'table' : table,
+                'action' : action,
+                'description' : self.action_descriptions[action]}
+
+    #--------------------------------------------------------------------------
+    def get_stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+        return {'tables' : len(self.tables.table_index),
+                'queue_depth' : self.queue.qsize(),
+                'max_queue_depth' : self.max_queue_depth,
+                'mean_batch_size' : float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+                'latency_ms' : {'p50' : float(p50), 'p95' : float(p95), 'p99' : float(p99)}}
+
+    # spins are posted as {"table": <table id>, "number": <0-36 or null>}, where
+    # a null number only asks for the action suggested for the current state
+    #--------------------------------------------------------------------------
+    async def route_request(self, method, path, body):
+        if method == 'GET' and path == '/stats':
+            return 200, self.get_stats()
+        if method == 'POST' and path == '/spin':
+            try:
+                payload = json.loads(body)
+                table = str(payload['table'])
+                number = payload.get('number')
+                # booleans are rejected, as JSON true and false are parsed as ints
+                if number is not None and (isinstance(number, bool) or not isinstance(number, int) 
+                                           or not 0 <= number < NUMBERS):
+                    raise ValueError(f'Invalid roulette number: {number}')
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {'error' : str(e)}
+            return 200, await self.submit_spin(table, number)
+
+        return 404, {'error' : f'Unknown endpoint {method} {path}'}
+
+    # minimal HTTP/1.1 handler supporting keep-alive connections
+    #--------------------------------------------------------------------------
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                content_length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(content_length) if content_length else b''
+                status, response = await self.route_request(method, path, body)
+                content = json.dumps(response).encode('utf-8')
+                reason = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found'}[status]
+                writer.write(f'HTTP/1.1 {status} {reason}\r\n'
+                             f'Content-Type: application/json\r\n'
+                             f'Content-Length: {len(content)}\r\n\r\n'.encode('latin-1') + content)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    #--------------------------------------------------------------------------
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        batching_task = asyncio.create_task(self.batching_loop())
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info(f'Prediction server listening on http://{self.host}:{self.port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching_task.cancel()
+
+    #--------------------------------------------------------------------------
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info(f'Prediction server has been stopped: {self.get_stats()}')
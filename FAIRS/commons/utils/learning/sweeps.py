@@ -0,0 +1,219 @@
+import os
+import copy
+import json
+import time
+import itertools
+import numpy as np
+import pandas as pd
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from threadpoolctl import threadpool_limits
+
+from FAIRS.commons.constants import CONFIG, CHECKPOINT_PATH, SWEEPS_PATH
+from FAIRS.commons.logger import logger
+
+
+# [EARLY STOPPING]
+###############################################################################
+# Median stopping rule shared across the trials of a sweep. Episode rewards of
+# all trials are collected in a managed dictionary, and a trial is stopped if
+# its mean episode reward is below the median of the other trials at the same
+# episode, once the grace period is over and enough trials can be compared
+###############################################################################
+class MedianEpisodeStopping:
+
+    def __init__(self, trial_id, shared_rewards, grace_episodes, min_trials=2):
+        self.trial_id = trial_id
+        self.shared_rewards = shared_rewards
+        self.grace_episodes = grace_episodes
+        self.min_trials = min_trials
+        self.shared_rewards[trial_id] = []
+
+    #--------------------------------------------------------------------------
+    def should_stop(self, episode, total_reward):
+        # managed lists must be reassigned to propagate changes
+        rewards = self.shared_rewards[self.trial_id] + [float(total_reward)]
+        self.shared_rewards[self.trial_id] = rewards
+        num_episodes = len(rewards)
+        if num_episodes < self.grace_episodes:
+            return False
+
+        other_means = [np.mean(v[:num_episodes]) for k, v in self.shared_rewards.items()
+                       if k != self.trial_id and len(v) >= num_episodes]
+        if len(other_means) < self.min_trials:
+            return False
+
+        return np.mean(rewards) < np.median(other_means)
+
+
+# each trial limits the threads used by torch and BLAS libraries, so that
+# concurrent trials do not oversubscribe the CPU cores. numpy has already loaded
+# its BLAS library when the module is imported by the spawned worker, hence its
+# pool is resized with threadpoolctl, while the environment variables still
+# apply to libraries loaded afterwards. Each running trial holds one of the core
+# slots, which selects the cores it is pinned to when PIN_CORES is enabled
+#------------------------------------------------------------------------------
+def run_sweep_trial(trial_id, overrides, configuration, data_path, checkpoint_path,
+                    threads, shared_rewards, grace_episodes, core_slots):
+
+    for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[variable] = str(threads)
+    threadpool_limits(limits=threads)
+    import torch
+    torch.set_num_threads(threads)
+    core_slot = core_slots.get()
+    try:
+        return train_sweep_trial(trial_id, overrides, configuration, data_path, checkpoint_path,
+                                 shared_rewards, grace_episodes, core_slot)
+    finally:
+        core_slots.put(core_slot)
+
+
+#------------------------------------------------------------------------------
+def train_sweep_trial(trial_id, overrides, configuration, data_path, checkpoint_path,
+                      shared_rewards, grace_episodes, core_slot):
+
+    from FAIRS.commons.utils.dataloader.serializer import DataSerializer
+    from FAIRS.commons.utils.learning.models import FAIRSnet
+    from FAIRS.commons.utils.learning.training import DQNTraining
+
+    start_time = time.perf_counter()
+    # the preprocessed dataset is memory-mapped and shared by all trials, while
+    # a copy is saved in the checkpoint to allow resuming training later on
+    data = np.load(data_path, mmap_mode='r')
+    os.makedirs(os.path.join(checkpoint_path, 'data'), exist_ok=True)
+    DataSerializer(configuration).save_preprocessed_data(np.asarray(data), checkpoint_path)
+
+    trainer = DQNTraining(configuration)
+    trainer.cpu_policy.core_slot = core_slot
+    trainer.set_device()
+    trainer.early_stopping = MedianEpisodeStopping(trial_id, shared_rewards, grace_episodes)
+    learner = FAIRSnet(configuration)
+    Q_model = learner.get_model(model_summary=False)
+    target_model = learner.get_model(model_summary=False)
+    trainer.train_model(Q_model, target_model, data, checkpoint_path)
+
+    rewards = list(shared_rewards[trial_id])
+    result = {'trial' : trial_id,
+              'checkpoint' : os.path.basename(checkpoint_path),
+              **overrides,
+              'episodes' : len(rewards),
+              'mean_reward' : float(np.mean(rewards[-grace_episodes:])) if rewards else 0.0,
+              'best_reward' : float(np.max(rewards)) if rewards else 0.0,
+              'early_stopped' : trainer.stopped_early,
+              'duration_s' : time.perf_counter() - start_time}
+
+    return result
+
+
+# [HYPERPARAMETER SWEEPS]
+###############################################################################
+# Parameters of the sweep are given as "section.KEY" entries, with either a list
+# of values or a range {"MIN", "MAX", "LOG"}. Grid search runs all combinations
+# of listed values, random search samples NUM_TRIALS configurations
+###############################################################################
+class HyperparameterSweep:
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.method = CONFIG['sweep']['METHOD']
+        self.num_trials = CONFIG['sweep']['NUM_TRIALS']
+        self.num_workers = CONFIG['sweep']['NUM_WORKERS']
+        self.threads_per_trial = CONFIG['sweep']['THREADS_PER_TRIAL']
+        self.grace_episodes = CONFIG['sweep']['GRACE_EPISODES']
+        self.parameters = CONFIG['sweep']['PARAMETERS']
+        self.generator = np.random.default_rng(configuration['SEED'])
+        self.sweep_name = f'sweep_{datetime.now().strftime("%Y%m%dT%H%M%S")}'
+        self.sweep_path = os.path.join(SWEEPS_PATH, self.sweep_name)
+
+    #--------------------------------------------------------------------------
+    def sample_value(self, values):
+        if isinstance(values, list):
+            return values[self.generator.integers(len(values))]
+
+        low, high = values['MIN'], values['MAX']
+        if values.get('LOG', False):
+            return float(np.exp(self.generator.uniform(np.log(low), np.log(high))))
+        if isinstance(low, int) and isinstance(high, int):
+            return int(self.generator.integers(low, high + 1))
+
+        return float(self.generator.uniform(low, high))
+
+    #--------------------------------------------------------------------------
+    def expand_trials(self):
+        keys = list(self.parameters.keys())
+        if self.method == 'grid':
+            if not all(isinstance(v, list) for v in self.parameters.values()):
+                raise ValueError('Grid search requires a list of values for each parameter')
+            combinations = itertools.product(*[self.parameters[k] for k in keys])
+            return [dict(zip(keys, values)) for values in combinations]
+
+        return [{k : self.sample_value(self.parameters[k]) for k in keys}
+                for _ in range(self.num_trials)]
+
+    # trials never use data-parallel training, as they already run in parallel,
+    # and their CPU execution policy is limited to the threads of each trial
+    #--------------------------------------------------------------------------
+    def build_configuration(self, overrides):
+        configuration = copy.deepcopy(self.configuration)
+        for key, value in overrides.items():
+            section, parameter = key.split('.')
+            configuration[section][parameter] = value
+        configuration['device']['DATA_PARALLEL'] = 1
+        configuration['device']['NUM_PROCESSORS'] = self.threads_per_trial
+        configuration['training']['USE_TENSORBOARD'] = False
+
+        return configuration
+
+    #--------------------------------------------------------------------------
+    def run_sweep(self, data : np.array):
+        trials = self.expand_trials()
+        os.makedirs(self.sweep_path, exist_ok=True)
+        data_path = os.path.join(self.sweep_path, 'train_data.npy')
+        np.save(data_path, data)
+        with open(os.path.join(self.sweep_path, 'sweep_trials.json'), 'w') as file:
+            json.dump(trials, file, indent=4)
+        logger.info(f'Running {len(trials)} trials with {self.num_workers} workers '
+                    f'and {self.threads_per_trial} threads per trial')
+
+        results = []
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager:
+            shared_rewards = manager.dict()
+            core_slots = manager.Queue()
+            for slot in range(self.num_workers):
+                core_slots.put(slot)
+            with ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context) as executor:
+                futures = {}
+                for i, overrides in enumerate(trials):
+                    checkpoint_path = os.path.join(CHECKPOINT_PATH, f'FAIRS_{self.sweep_name}_trial{i:03d}')
+                    futures[executor.submit(run_sweep_trial, i, overrides, self.build_configuration(overrides),
+                                            data_path, checkpoint_path, self.threads_per_trial,
+                                            shared_rewards, self.grace_episodes, core_slots)] = i
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f'Trial {futures[future]} has failed: {e}')
+                        continue
+                    logger.info(f'Trial {result["trial"]} completed {result["episodes"]} episodes '
+                                f'with mean reward {result["mean_reward"]:.2f}')
+                    results.append(result)
+
+        return self.save_results_table(results)
+
+    # checkpoints are ranked by the mean reward of their last episodes, with
+    # early stopped trials ranked after the completed ones
+    #--------------------------------------------------------------------------
+    def save_results_table(self, results):
+        results = pd.DataFrame(results)
+        if not results.empty:
+            results = results.sort_values(['early_stopped', 'mean_reward'], 
+                                          ascending=[True, False]).reset_index(drop=True)
+            results.insert(0, 'rank', np.arange(1, len(results) + 1))
+        results_path = os.path.join(self.sweep_path, 'sweep_results.csv')
+        results.to_csv(results_path, index=False)
+        logger.info(f'Sweep results have been saved in {results_path}')
+
+        return results
@@ -1,16 +1,101 @@
+import os
+import json
+import shutil
 import numpy as np
 import keras
 import torch
+import torch.multiprocessing as mp
 
 from FAIRS.commons.utils.learning.callbacks import CallbacksWrapper
 from FAIRS.commons.utils.learning.environment import RouletteEnvironment
 from FAIRS.commons.utils.learning.agents import DQNAgent
 from FAIRS.commons.utils.learning.callbacks import RealTimeHistory
+from FAIRS.commons.utils.learning.distributed import DistributedLearner, get_free_port
+from FAIRS.commons.utils.learning.execution import CPUExecutionPolicy
+from FAIRS.commons.utils.learning.compilation import CompiledFAIRSnet, enable_compile_cache
 from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
 from FAIRS.commons.constants import CONFIG, NUMBERS, COLORS
 from FAIRS.commons.logger import logger
 
 
+# [TARGET NETWORK UPDATES]
+###############################################################################
+class TargetModelUpdater:
+
+    def __init__(self, configuration):
+        self.update_mode = configuration['training']['TARGET_UPDATE']
+        self.update_frequency = configuration['training']['UPDATE_FREQUENCY']
+        self.tau = configuration['training']['TAU']
+        self.model_weights = []
+        self.target_weights = []
+
+    # keras variables wrap the torch tensors holding the parameters, which are
+    # always updated in place. References to these tensors are collected once
+    # so that each update is a device-side copy without host round-trips. The
+    # target model starts as a copy of the Q model, unless its weights have been
+    # restored from a checkpoint to resume training
+    #--------------------------------------------------------------------------
+    @torch.no_grad()
+    def bind_models(self, model : keras.Model, target_model : keras.Model, synchronize=True):
+        self.model_weights = [w.value for w in model.weights]
+        self.target_weights = [w.value for w in target_model.weights]
+        if synchronize:
+            torch._foreach_copy_(self.target_weights, self.model_weights)
+
+    # hard update copies the Q model weights into the target model every N gradient
+    # steps, while soft update performs Polyak averaging with rate tau at each step
+    #--------------------------------------------------------------------------
+    @torch.no_grad()
+    def update_target_model(self, gradient_step):
+        if self.update_mode == 'soft':
+            torch._foreach_lerp_(self.target_weights, self.model_weights, self.tau)
+        elif gradient_step % self.update_frequency == 0:
+            torch._foreach_copy_(self.target_weights, self.model_weights)
+
+
+# [LEARNER SCHEDULING]
+###############################################################################
+# Decouples data collection from learning. Once the replay memory holds more
+# than REPLAY_BUFFER transitions and WARMUP_STEPS environment steps have been
+# collected, an update of GRADIENT_STEPS replay steps is performed every
+# STEPS_PER_UPDATE environment steps, while the exploration rate decays every
+# ER_DECAY_STEPS environment steps regardless of the number of updates
+###############################################################################
+class LearnerScheduler:
+
+    def __init__(self, configuration):
+        self.replay_size = configuration['agent']['REPLAY_BUFFER']
+        self.decay_steps = configuration['agent'].get('ER_DECAY_STEPS', 1)
+        self.steps_per_update = configuration['training'].get('STEPS_PER_UPDATE', 1)
+        self.gradient_steps = configuration['training'].get('GRADIENT_STEPS', 1)
+        self.warmup_steps = configuration['training'].get('WARMUP_STEPS', 0)
+        self.updates = 0
+
+    # the environment steps counter of the agent is saved with checkpoints, 
+    # hence warm-up is not repeated when resuming training
+    #--------------------------------------------------------------------------
+    def is_learning(self, agent : DQNAgent):
+        return len(agent.memory) > self.replay_size and agent.steps >= self.warmup_steps
+
+    #--------------------------------------------------------------------------
+    def is_update_step(self, agent : DQNAgent):
+        return self.is_learning(agent) and agent.steps % self.steps_per_update == 0
+
+    #--------------------------------------------------------------------------
+    def is_decay_step(self, agent : DQNAgent):
+        return self.is_learning(agent) and agent.steps % self.decay_steps == 0
+
+    # the updates counter times the hard target updates, hence it is saved with
+    # the agent state so that resumed sessions keep the same update schedule
+    #--------------------------------------------------------------------------
+    def get_state(self):
+        return {'updates' : int(self.updates)}
+
+    #--------------------------------------------------------------------------
+    def set_state(self, state):
+        self.updates = state['updates']
+
+
 # [TOOLS FOR TRAINING MACHINE LEARNING MODELS]
 ###############################################################################
 class DQNTraining:
@@ -27,10 +112,18 @@ class DQNTraining:
         self.selected_device = configuration["device"]["DEVICE"]
         self.device_id = configuration["device"]["DEVICE_ID"]
         self.mixed_precision = self.configuration["device"]["MIXED_PRECISION"]  
+        self.num_processes = self.configuration["device"].get("DATA_PARALLEL", 1)
+        self.jit_compile = configuration["model"]["JIT_COMPILE"]
+        self.learner = None
+        self.early_stopping = None
+        self.stopped_early = False
+        self.cpu_policy = CPUExecutionPolicy(configuration)
 
         # initialize variables
         self.session = []
-        self.callback_wrapper = CallbacksWrapper(configuration)               
+        self.callback_wrapper = CallbacksWrapper(configuration)
+        self.target_updater = TargetModelUpdater(configuration)
+        self.scheduler = LearnerScheduler(configuration)
                     
 
     # set device
@@ -54,29 +147,65 @@ class DQNTraining:
             self.device = torch.device('cpu')
             logger.info('CPU is set as active device') 
 
+        # size the CPU thread pools used for acting and learning
+        self.cpu_policy.apply()
+
     # set device
     #--------------------------------------------------------------------------
-    def update_session_stats(self, scores, episode, time_step, reward, total_reward):
+    def update_session_stats(self, scores, episode, time_step, reward, total_reward, replay_stats=None):
         loss = scores.get('loss', None)
         metric = scores.get('root_mean_squared_error', None)                   
         self.session.append({'episode': episode,
                             'time_step': time_step,
-                            'loss': loss.item() if not None else 0,
-                            'metrics': metric.item() if not None else 0,
-                            'reward': reward,
-                            'total_reward': total_reward})        
+                            'loss': float(loss) if loss is not None else 0,
+                            'metrics': float(metric) if metric is not None else 0,
+                            'reward': float(reward),
+                            'total_reward': float(total_reward),
+                            **(replay_stats or {})})        
+
+    # compiled counterparts of the Q model and target model are used for acting
+    # and replay, sharing their weights with the keras models. All graphs are
+    # compiled during the warm-up, whose timings are saved with the checkpoint
+    #--------------------------------------------------------------------------
+    def compile_models(self, model : keras.Model, target_model : keras.Model, checkpoint_path):
+        enable_compile_cache()
+        batch_size = min(self.batch_size, self.replay_size)
+        Q_network = CompiledFAIRSnet(model, self.configuration, batch_size)
+        target_network = CompiledFAIRSnet(target_model, self.configuration, batch_size)
+        logger.info('Compiling the Q model and target model before the first episode')
+        # the data-parallel learner computes gradients with the keras model
+        with self.cpu_policy.profile('learning'):
+            report = {'Q_model' : Q_network.warmup(train=self.learner is None),
+                      'target_model' : target_network.warmup(train=False)}
+        # the acting graph is compiled separately if its precision differs
+        if self.cpu_policy.bfloat16['acting'] != self.cpu_policy.bfloat16['learning']:
+            with self.cpu_policy.profile('acting'):
+                Q_network.warmup(train=False)
+        if self.learner is None or self.learner.rank == 0:
+            with open(os.path.join(checkpoint_path, 'compile_report.json'), 'w') as file:
+                json.dump(report, file, indent=4)
+
+        return Q_network, target_network
 
     #--------------------------------------------------------------------------
     def reinforcement_learning_pipeline(self, model : keras.Model, target_model : keras.Model,
                                        agent : DQNAgent, environment : RouletteEnvironment, 
-                                       start_episode, episodes, state_size, checkpoint_path):
+                                       start_episode, episodes, state_size, checkpoint_path,
+                                       from_checkpoint=False):
 
         # if tensorboard is selected, an instance of the tb callback is built
         # the dashboard is set on the Q model and tensorboard is launched automatically
         tensorboard = None
         if self.configuration["training"]["USE_TENSORBOARD"]:
-            tensorboard = self.callback_wrapper.tensorboard_callback(checkpoint_path, model)            
-               
+            tensorboard = self.callback_wrapper.tensorboard_callback(checkpoint_path, model)
+
+        # collect the weight tensors of both models once, so that the target model
+        # can be updated with in-place copies throughout the training session
+        self.target_updater.bind_models(model, target_model, synchronize=not from_checkpoint)
+        Q_network, target_network = model, target_model
+        if self.jit_compile:
+            Q_network, target_network = self.compile_models(model, target_model, checkpoint_path)
+
         # Training loop for each episode 
         scores = None       
         for episode in range(start_episode, episodes):                    
@@ -84,8 +213,10 @@ class DQNTraining:
             state = np.reshape(state, newshape=(1, state_size))
             total_reward = 0
             for time_step in range(environment.max_steps):                 
-                # action is always performed using the Q model
-                action = agent.act(model, state)
+                # action is always performed using the Q model, with the CPU
+                # threads profile tuned for single-sample latency
+                with self.cpu_policy.profile('acting'):
+                    action = agent.act(Q_network, state)
                 next_state, reward, done, info, extraction = environment.step(action)
                 total_reward += reward
                 next_state = np.reshape(next_state, [1, state_size])
@@ -95,15 +226,28 @@ class DQNTraining:
                     environment.render(episode, time_step, action, extraction)
 
                 # Remember experience
-                agent.remember(state, action, reward, next_state, done)
+                agent.remember(state, action, reward, next_state, done, info)
                 state = next_state
 
-                # Perform replay if the memory size is sufficient
-                # use both the Q model and the target model
-                if len(agent.memory) > self.replay_size:
-                    scores = agent.replay(model, target_model, environment, self.batch_size)                   
-                    self.update_session_stats(scores, episode, time_step, reward, total_reward)
-                    if time_step % 10 == 0:
+                # decay the exploration rate based on the environment steps
+                if self.scheduler.is_decay_step(agent):
+                    agent.decay_exploration_rate()
+
+                # Perform replay if the memory size is sufficient and the warm-up
+                # is over, using both the Q model and the target model. Multiple 
+                # gradient steps can be performed for each update
+                if self.scheduler.is_update_step(agent):
+                    for _ in range(self.scheduler.gradient_steps):
+                        with self.cpu_policy.profile('learning'):
+                            scores = agent.replay(Q_network, target_network, environment, self.batch_size)
+                        self.scheduler.updates += 1
+                        # Update target network periodically (hard update) or at each
+                        # gradient step using Polyak averaging (soft update)
+                        self.target_updater.update_target_model(self.scheduler.updates)
+
+                    self.update_session_stats(scores, episode, time_step, reward, total_reward,
+                                              agent.get_replay_stats())
+                    if self.scheduler.updates % (10 * self.scheduler.gradient_steps) == 0:
                         logger.info(f'Loss: {scores["loss"]} | RMSE: {scores["root_mean_squared_error"]}') 
                         logger.info(f'Episode {episode+1}/{episodes} - Time steps: {time_step} - Capital: {info["capital"]} - Total Reward: {total_reward}')                             
 
@@ -111,20 +255,44 @@ class DQNTraining:
                 if tensorboard is not None and scores is not None:                    
                     tensorboard.on_epoch_end(epoch=episode, logs=scores)                
 
-                # Update target network periodically
-                if time_step % self.update_frequency == 0:
-                    target_model.set_weights(model.get_weights())
-
                 if done:
                     break
+
+            # stop the training session early if the episode rewards are poor
+            if self.early_stopping is not None and self.early_stopping.should_stop(episode, total_reward):
+                logger.info(f'Training has been stopped early at episode {episode+1}')
+                self.stopped_early = True
+                break
                      
         return agent
  
+    # the models are saved to disk and loaded by each process, which trains 
+    # them with the data-parallel learner. The trained weights are saved by
+    # the first process and then loaded back into the models
+    #--------------------------------------------------------------------------
+    def train_data_parallel(self, model, target_model, data, checkpoint_path, from_checkpoint=False):
+        initial_path = os.path.join(checkpoint_path, 'data_parallel')
+        os.makedirs(initial_path, exist_ok=True)
+        model.save(os.path.join(initial_path, 'saved_model.keras'))
+        target_model.save_weights(os.path.join(initial_path, 'target_model.weights.h5'))
+
+        logger.info(f'Starting data-parallel training with {self.num_processes} processes')
+        mp.spawn(data_parallel_worker, nprocs=self.num_processes, join=True,
+                 args=(self.num_processes, get_free_port(), self.configuration, data,
+                       checkpoint_path, initial_path, from_checkpoint))
+        shutil.rmtree(initial_path)
+
+        self.serializer.raw_weights.load_weights(model, checkpoint_path)
+        target_model.load_weights(os.path.join(checkpoint_path, 'target_model.weights.h5'))
+
     #--------------------------------------------------------------------------
     def train_model(self, model, target_model, data, checkpoint_path, from_checkpoint=False):
 
+        if self.num_processes > 1 and self.learner is None:
+            return self.train_data_parallel(model, target_model, data, checkpoint_path, from_checkpoint)
+
         environment = RouletteEnvironment(data, self.configuration)   
-        agent = DQNAgent(self.configuration)
+        agent = DQNAgent(self.configuration, environment.timeseries)
 
         # perform different initialization duties based on state of session:
         # training from scratch vs resumed training
@@ -133,20 +301,77 @@ class DQNTraining:
             episodes = self.configuration['training']['EPISODES']
             from_episode = 0
             start_episode = 0
-            history = None
         else:
             _, history = self.serializer.load_session_configuration(checkpoint_path)                     
             episodes = history['total_epochs'] + CONFIG['training']['ADDITIONAL_EPISODES'] 
             from_episode = history['total_epochs']
-            start_episode = from_episode                    
+            start_episode = from_episode  
+            # restore replay memory, exploration rate, episode and update schedules
+            # and random generators so that the agent resumes learning right away
+            agent.load_agent_state(checkpoint_path, environment.scheduler, self.scheduler)                  
+
+        if self.learner is not None:
+            self.learner.bind_agent(agent)
 
         # determine state size as the observation space size       
         state_size = environment.observation_space.shape[0]         
         agent = self.reinforcement_learning_pipeline(model, target_model, agent, environment, 
-                                                              start_episode, episodes, state_size, checkpoint_path)
+                                                     start_episode, episodes, state_size, checkpoint_path,
+                                                     from_checkpoint)
+        # stop the background sampler before saving the agent state
+        agent.stop_prefetching()
+        replay_stats = agent.get_replay_stats()
+        if replay_stats:
+            logger.info(f'Replay prefetching: mean queue depth {replay_stats["queue_depth"]:.2f}, '
+                        f'total stall time {replay_stats["total_stall_s"]:.2f} s')
+
+        # with data-parallel training the models are identical on all processes,
+        # hence only the first process saves the checkpoint
+        if self.learner is not None and self.learner.rank != 0:
+            return
 
-        # Save the final model at the end of training
+        # Save the final model at the end of training, together with the target
+        # model weights and the agent state required to resume training
+        history = {'history' : self.session,
+                   'total_epochs' : episodes}
         self.serializer.save_pretrained_model(model, checkpoint_path)        
+        self.serializer.save_target_model(target_model, checkpoint_path)
+        agent.save_agent_state(checkpoint_path, environment.scheduler, self.scheduler)
         self.serializer.save_session_configuration(checkpoint_path, history, self.configuration)
 
 
+# each process runs the same training session on a share of the CPU threads,
+# with a minibatch of BATCH_SIZE split across processes
+#------------------------------------------------------------------------------
+def data_parallel_worker(rank, world_size, port, configuration, data, checkpoint_path,
+                         initial_path, from_checkpoint):
+
+    # each process gets an equal share of the CPU threads. Minibatches are
+    # sampled in lock-step with the collected transitions, without prefetching,
+    # so that the shards sampled by each process are the same for a fixed seed
+    num_processors = max(1, configuration['device']['NUM_PROCESSORS'] // world_size)
+    if configuration['training'].get('PREFETCH_BATCHES', 0) > 0 and rank == 0:
+        logger.warning('Replay prefetching is disabled with data-parallel training')
+    configuration = {**configuration, 
+                     'device' : {**configuration['device'], 'NUM_PROCESSORS' : num_processors},
+                     'training' : {**configuration['training'], 'PREFETCH_BATCHES' : 0}}
+    learner = DistributedLearner(rank, world_size, configuration)
+    learner.init_process_group(port)
+    try:
+        trainer = DQNTraining(configuration)
+        # ranks are pinned to separate cores when PIN_CORES is enabled
+        trainer.cpu_policy.core_slot = rank
+        trainer.set_device()
+        trainer.learner = learner
+        trainer.batch_size = max(1, trainer.batch_size // world_size)
+        if rank != 0:
+            trainer.configuration = {**configuration, 
+                                     'training' : {**configuration['training'], 'USE_TENSORBOARD' : False}}
+
+        serializer = ModelSerializer()
+        model = serializer.load_checkpoint(initial_path)
+        target_model = serializer.load_checkpoint(initial_path)
+        target_model.load_weights(os.path.join(initial_path, 'target_model.weights.h5'))
+        trainer.train_model(model, target_model, data, checkpoint_path, from_checkpoint)
+    finally:
+        learner.destroy_process_group()
@@ -1,9 +1,8 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import OrdinalEncoder
 
-from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.constants import CONFIG, NUMBERS
 from FAIRS.commons.logger import logger
 
 
@@ -43,14 +42,26 @@ class RouletteMapper:
         dataframe = self.map_roulette_positions(dataframe)
         dataframe = self.map_roulette_colors(dataframe)
 
-        encoder = OrdinalEncoder(categories=self.categories, 
-                                 handle_unknown='use_encoded_value', 
-                                 unknown_value=-1)
-        color_mapped_values = dataframe['color'].values.reshape(-1, 1)
-        encoded_data = encoder.fit_transform(color_mapped_values)
+        # ordinal encoding of colors following the categories order, with unknown
+        # values encoded as -1. A plain mapping avoids importing scikit-learn, 
+        # which would otherwise dominate the startup time of inference scripts
+        encoder = {color : i for i, color in enumerate(self.categories[0])}
+        encoded_data = dataframe['color'].map(encoder).fillna(-1)
         dataframe['encoded color'] = encoded_data.astype(int)                                             
 
         return dataframe, encoder
+
+    # encoded rows of all roulette numbers, indexed by number and with the same
+    # columns of the encoded dataset (timeseries, position, encoded color), so
+    # that streamed extractions are encoded with a single array lookup
+    #--------------------------------------------------------------------------
+    def get_encoding_table(self):
+
+        numbers = pd.DataFrame({'timeseries' : np.arange(NUMBERS)})
+        encoded_numbers, _ = self.encode_roulette_extractions(numbers)
+        encoded_numbers = encoded_numbers.drop(columns=['color'])
+
+        return encoded_numbers.to_numpy(dtype=np.int32)
         
     
     
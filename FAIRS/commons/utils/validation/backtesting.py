@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+
+from FAIRS.commons.utils.learning.rewards import RoulettePayouts
+from FAIRS.commons.constants import CONFIG, VALIDATION_PATH
+from FAIRS.commons.logger import logger
+
+
+# [MONTE CARLO BACKTESTING]
+###############################################################################
+# Policies are evaluated by computing their actions over the whole series once,
+# and then simulating thousands of episodes with random start offsets and lengths
+# using array operations. Each episode starts with the initial capital and ends
+# when the stop action is selected, the capital is depleted or the length is reached
+###############################################################################
+class MonteCarloBacktester:
+
+    def __init__(self, configuration):
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.initial_capital = configuration["environment"]["INITIAL_CAPITAL"]
+        self.num_episodes = CONFIG["backtest"]["NUM_EPISODES"]
+        self.min_length = CONFIG["backtest"]["MIN_LENGTH"]
+        self.max_length = CONFIG["backtest"]["MAX_LENGTH"]
+        self.batch_size = CONFIG["backtest"]["BATCH_SIZE"]
+        self.payouts = RoulettePayouts(configuration)
+        self.generator = np.random.default_rng(configuration["SEED"])
+        self.DPI = 400
+
+    # the state used to predict the outcome at index t holds the previous spins,
+    # padded with -1 at the beginning of the series as in the environment
+    #--------------------------------------------------------------------------
+    def get_perceptive_fields(self, series : np.array):
+        padded = np.concatenate([np.full(self.perceptive_size, -1, dtype=np.int32),
+                                 series.astype(np.int32)])
+        windows = np.lib.stride_tricks.sliding_window_view(padded, self.perceptive_size)
+
+        return windows[:series.shape[0]]
+
+    #--------------------------------------------------------------------------
+    def get_model_actions(self, model, series : np.array):
+        windows = self.get_perceptive_fields(series)
+        actions = np.empty(series.shape[0], dtype=np.int32)
+        for i in range(0, series.shape[0], self.batch_size):
+            q_values = model.predict(windows[i:i + self.batch_size], verbose=0)
+            actions[i:i + self.batch_size] = np.argmax(q_values, axis=1)
+
+        return actions
+
+    # baseline policies select the action of each spin from the previous ones,
+    # hence the action following the last spin is dropped
+    #--------------------------------------------------------------------------
+    def get_baseline_actions(self, policy, series : np.array):
+        return policy.play_series(series)[:-1]
+
+    # fixed strategies are either 'red', 'black' or a number to always bet on
+    #--------------------------------------------------------------------------
+    def get_fixed_actions(self, strategy, series : np.array):
+        strategy_actions = {'red' : self.payouts.red_action,
+                            'black' : self.payouts.black_action}
+        action = strategy_actions.get(strategy, strategy)
+
+        return np.full(series.shape[0], fill_value=int(action), dtype=np.int32)
+
+    #--------------------------------------------------------------------------
+    def _simulate_batch(self, rewards, stops, starts, lengths):
+        steps = np.arange(lengths.max())
+        valid = steps[None, :] < lengths[:, None]
+        indices = np.minimum(starts[:, None] + steps[None, :], rewards.shape[0] - 1)
+        episode_rewards = np.where(valid, rewards[indices], 0)
+        episode_stops = stops[indices] & valid
+
+        # an episode is active up to and including the first terminating step
+        capital = self.initial_capital + np.cumsum(episode_rewards, axis=1)
+        terminal = episode_stops | (capital <= 0)
+        terminated_before = (np.cumsum(terminal, axis=1) - terminal) > 0
+        active = valid & ~terminated_before
+        active_rewards = np.where(active, episode_rewards, 0)
+
+        final_capital = self.initial_capital + active_rewards.sum(axis=1)
+        ruined = np.any((capital <= 0) & active, axis=1)
+        num_bets = np.sum(active & ~episode_stops, axis=1)
+
+        # drawdown is measured from the running peak of capital, starting from
+        # the initial capital and holding the final capital after termination
+        capital = np.where(active, capital, final_capital[:, None])
+        peaks = np.maximum.accumulate(np.maximum(capital, self.initial_capital), axis=1)
+        max_drawdown = np.max(peaks - capital, axis=1)
+
+        return final_capital, ruined, max_drawdown, num_bets
+
+    #--------------------------------------------------------------------------
+    def simulate(self, actions : np.array, series : np.array):
+        rewards = self.payouts.get_rewards(actions, series)
+        stops = actions == self.payouts.stop_action
+        max_length = min(self.max_length, series.shape[0])
+        min_length = min(self.min_length, max_length)
+        lengths = self.generator.integers(min_length, max_length + 1, size=self.num_episodes)
+        starts = self.generator.integers(0, series.shape[0] - lengths + 1)
+
+        # episodes are simulated in chunks to keep the (episodes, steps) arrays bounded
+        chunk_size = max(1, 2**22 // max_length)
+        results = [self._simulate_batch(rewards, stops, starts[i:i + chunk_size], lengths[i:i + chunk_size])
+                   for i in range(0, self.num_episodes, chunk_size)]
+        final_capital, ruined, max_drawdown, num_bets = [np.concatenate(x) for x in zip(*results)]
+
+        total_bets = max(int(num_bets.sum()), 1)
+        profits = final_capital - self.initial_capital
+        summary = {'episodes' : int(self.num_episodes),
+                   'mean_final_capital' : float(final_capital.mean()),
+                   'final_capital_percentiles' : {str(q) : float(v) for q, v in
+                       zip([5, 25, 50, 75, 95], np.percentile(final_capital, [5, 25, 50, 75, 95]))},
+                   'ruin_probability' : float(ruined.mean()),
+                   'mean_max_drawdown' : float(max_drawdown.mean()),
+                   'max_drawdown_p95' : float(np.percentile(max_drawdown, 95)),
+                   'expected_value_per_bet' : float(profits.sum()/total_bets)}
+        distributions = {'final_capital' : final_capital,
+                         'max_drawdown' : max_drawdown,
+                         'ruined' : ruined,
+                         'num_bets' : num_bets}
+
+        logger.info(f'Mean final capital: {summary["mean_final_capital"]:.2f} (initial {self.initial_capital})')
+        logger.info(f'Ruin probability: {summary["ruin_probability"]:.2%}')
+        logger.info(f'Expected value per bet: {summary["expected_value_per_bet"]:.4f}')
+
+        return summary, distributions
+
+    #--------------------------------------------------------------------------
+    def plot_distributions(self, distributions : dict, name, path=VALIDATION_PATH):
+        fig, axes = plt.subplots(1, 2, figsize=(16, 7))
+        axes[0].hist(distributions['final_capital'], bins=100, color='steelblue')
+        axes[0].axvline(self.initial_capital, color='red', linestyle='--', label='Initial capital')
+        axes[0].set_title('Final capital', fontsize=14)
+        axes[0].legend()
+        axes[1].hist(distributions['max_drawdown'], bins=100, color='darkorange')
+        axes[1].set_title('Maximum drawdown', fontsize=14)
+        plt.tight_layout()
+        plot_loc = os.path.join(path, f'{name}.jpeg')
+        plt.savefig(plot_loc, bbox_inches='tight', format='jpeg', dpi=self.DPI)
+        plt.close()
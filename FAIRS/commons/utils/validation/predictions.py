@@ -1,36 +1,221 @@
 import os
+import numpy as np
 import keras
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import confusion_matrix
 
-from FAIRS.commons.constants import CONFIG
-from FAIRS.commons.logger import logger    
+from FAIRS.commons.utils.learning.rewards import RoulettePayouts
+from FAIRS.commons.constants import CONFIG, STATES, NUMBERS, VALIDATION_PATH
+from FAIRS.commons.logger import logger
 
 
+# [EVALUATION ACCUMULATOR]
+###############################################################################
+# Evaluation statistics accumulated over batches of actions and outcomes, so
+# that memory does not depend on the length of the evaluated series. Actions
+# and outcomes are counted in a confusion matrix (actions as rows, extracted
+# numbers as columns), from which hit rates and rewards of each bet type are
+# derived. Rewards and Q-values of the selected actions are also summed over
+# windows of WINDOW spins, to follow the cumulative reward and the calibration
+# of Q-values against the realized (scaled) rewards along the series. Windows
+# are indexed by the absolute position of spins, hence accumulators of
+# separate batches or processes are merged by summing their counts
+###############################################################################
+class EvaluationAccumulator:
+
+    def __init__(self, configuration):
+        self.window = CONFIG['evaluation']['WINDOW']
+        self.payouts = RoulettePayouts(configuration)
+        self.reset()
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self.confusion = np.zeros((STATES, NUMBERS), dtype=np.int64)
+        # spins, rewards, scaled rewards, Q-values, squared Q-value errors and
+        # spins with available Q-values, for each window
+        self.windows = {}
+        self.num_spins = 0
+
+    # spins start at the given offset within the series, or right after the
+    # spins observed so far. Q-values have shape (spins, actions) if provided
+    #--------------------------------------------------------------------------
+    def update(self, actions : np.array, outcomes : np.array, q_values=None, offset=None):
+        actions = np.asarray(actions, dtype=np.int64)
+        outcomes = np.asarray(outcomes, dtype=np.int64)
+        offset = self.num_spins if offset is None else offset
+        if actions.shape[0] == 0:
+            return
+
+        counts = np.bincount(actions * NUMBERS + outcomes, minlength=STATES * NUMBERS)
+        self.confusion += counts.reshape(STATES, NUMBERS)
+
+        rewards = self.payouts.get_rewards(actions, outcomes).astype(np.float64)
+        scaled_rewards = self.payouts.get_rewards(actions, outcomes, scaled=True).astype(np.float64)
+        if q_values is not None:
+            chosen = np.asarray(q_values, dtype=np.float64)[np.arange(actions.shape[0]), actions]
+            errors = (chosen - scaled_rewards)**2
+            available = np.ones(actions.shape[0])
+        else:
+            chosen = errors = available = np.zeros(actions.shape[0])
+
+        # sums of each window are computed with bincount over window indices
+        indices = (offset + np.arange(actions.shape[0]))//self.window
+        first = indices[0]
+        sums = [np.bincount(indices - first, weights=w) for w in
+                [np.ones(actions.shape[0]), rewards, scaled_rewards, chosen, errors, available]]
+        for i, window_sums in enumerate(np.stack(sums, axis=1)):
+            window = int(first + i)
+            self.windows[window] = self.windows.get(window, 0) + window_sums
+
+        self.num_spins = max(self.num_spins, offset + actions.shape[0])
+
+    #--------------------------------------------------------------------------
+    def merge(self, other):
+        self.confusion += other.confusion
+        for window, window_sums in other.windows.items():
+            self.windows[window] = self.windows.get(window, 0) + window_sums
+        self.num_spins = max(self.num_spins, other.num_spins)
+
+        return self
+
+    #--------------------------------------------------------------------------
+    def get_hit_rates(self):
+        red_numbers = self.payouts.payouts[self.payouts.red_action] > 0
+        black_numbers = self.payouts.payouts[self.payouts.black_action] > 0
+        straight_bets = self.confusion[:NUMBERS]
+        bet_types = {'straight_up' : (straight_bets.sum(), np.trace(straight_bets), 1/NUMBERS),
+                     'red' : (self.confusion[self.payouts.red_action].sum(),
+                              self.confusion[self.payouts.red_action, red_numbers].sum(),
+                              red_numbers.sum()/NUMBERS),
+                     'black' : (self.confusion[self.payouts.black_action].sum(),
+                                self.confusion[self.payouts.black_action, black_numbers].sum(),
+                                black_numbers.sum()/NUMBERS)}
+        hit_rates = {}
+        for bet_type, (bets, hits, fair_rate) in bet_types.items():
+            hit_rates[bet_type] = {'bets' : int(bets),
+                                   'hits' : int(hits),
+                                   'hit_rate' : float(hits/bets) if bets > 0 else None,
+                                   'fair_hit_rate' : float(fair_rate)}
+
+        return hit_rates
+
+    # aggregated counts of bet types (rows) against the color of the extracted
+    # numbers (columns), used to plot the confusion matrix
+    #--------------------------------------------------------------------------
+    def get_color_confusion(self):
+        colors = self.payouts.payouts[[self.payouts.black_action, self.payouts.red_action]] > 0
+        colors = np.vstack([~colors.any(axis=0), colors]).astype(np.int64)
+        bet_types = [self.confusion[:NUMBERS].sum(axis=0),
+                     self.confusion[self.payouts.red_action],
+                     self.confusion[self.payouts.black_action],
+                     self.confusion[self.payouts.stop_action]]
+
+        return np.stack(bet_types) @ colors.T
+
+    #--------------------------------------------------------------------------
+    def get_report(self):
+        if not self.windows:
+            raise ValueError('No predictions have been evaluated')
+        starts = np.array(sorted(self.windows.keys()))
+        spins, rewards, scaled_rewards, q_values, errors, available = np.stack(
+            [self.windows[window] for window in starts], axis=1)
+        total_spins = int(self.confusion.sum())
+        stops = int(self.confusion[self.payouts.stop_action].sum())
+        num_bets = total_spins - stops
+        total_reward = float((self.confusion * self.payouts.payouts).sum())
+        hit_rates = self.get_hit_rates()
+        hits = sum(v['hits'] for v in hit_rates.values())
+
+        report = {'spins' : total_spins,
+                  'bets' : num_bets,
+                  'stops' : stops,
+                  'accuracy' : float(hits/num_bets) if num_bets > 0 else None,
+                  'hit_rates' : hit_rates,
+                  'total_reward' : total_reward,
+                  'reward_per_bet' : total_reward/num_bets if num_bets > 0 else None,
+                  'windows' : {'start' : (starts * self.window).tolist(),
+                               'spins' : spins.astype(np.int64).tolist(),
+                               'reward' : rewards.tolist(),
+                               'cumulative_reward' : np.cumsum(rewards).tolist()}}
+
+        # Q-values are compared with the scaled rewards they are trained on
+        if available.sum() > 0:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_q = np.where(available > 0, q_values/available, np.nan)
+                mean_reward = np.where(available > 0, scaled_rewards/spins, np.nan)
+                rmse = np.where(available > 0, np.sqrt(errors/available), np.nan)
+            report['calibration'] = {'mean_q_value' : float(q_values.sum()/available.sum()),
+                                     'mean_scaled_reward' : float(scaled_rewards.sum()/spins.sum()),
+                                     'rmse' : float(np.sqrt(errors.sum()/available.sum()))}
+            report['windows'].update({'mean_q_value' : mean_q.tolist(),
+                                      'mean_scaled_reward' : mean_reward.tolist(),
+                                      'calibration_rmse' : rmse.tolist()})
+
+        logger.info(f'Evaluated {total_spins} spins with {num_bets} bets and {stops} stops')
+        for bet_type, rates in hit_rates.items():
+            if rates['hit_rate'] is not None:
+                logger.info(f'{bet_type} hit rate: {rates["hit_rate"]:.4f} over {rates["bets"]} bets '
+                            f'(fair wheel {rates["fair_hit_rate"]:.4f})')
+        logger.info(f'Total reward: {total_reward:.2f}')
+        if 'calibration' in report:
+            logger.info(f'Mean Q-value {report["calibration"]["mean_q_value"]:.4f} against mean scaled '
+                        f'reward {report["calibration"]["mean_scaled_reward"]:.4f}')
+
+        return report
+
 
 # [VALIDATION OF PRETRAINED MODELS]
 ###############################################################################
 class BetsAccuracy:
 
-    def __init__(self, model : keras.Model):
+    def __init__(self, model : keras.Model, configuration=CONFIG):
         self.DPI = 400
-        self.file_type = 'jpeg'        
-        self.model = model   
+        self.file_type = 'jpeg'
+        self.model = model
+        self.configuration = configuration
+        self.perceptive_size = configuration["model"]["PERCEPTIVE_FIELD"]
+        self.batch_size = CONFIG["evaluation"]["BATCH_SIZE"]
+
+    # the perceptive fields of a batch are views of the series, padded with -1
+    # at the beginning of the series as in the environment
+    #--------------------------------------------------------------------------
+    def get_perceptive_fields(self, series : np.array, start, stop):
+        first = max(start - self.perceptive_size, 0)
+        segment = np.asarray(series[first:stop], dtype=np.int32)
+        padding = self.perceptive_size - (start - first)
+        if padding > 0:
+            segment = np.concatenate([np.full(padding, -1, dtype=np.int32), segment])
+        windows = np.lib.stride_tricks.sliding_window_view(segment, self.perceptive_size)
+
+        return windows[:stop - start]
+
+    # the outcome at index t is predicted from the previous spins. A range of
+    # the series can be evaluated, so that accumulators of separate processes
+    # can be merged afterwards
+    #--------------------------------------------------------------------------
+    def evaluate_series(self, series : np.array, start=0, stop=None, accumulator=None):
+        stop = series.shape[0] if stop is None else min(stop, series.shape[0])
+        accumulator = EvaluationAccumulator(self.configuration) if accumulator is None else accumulator
+        for i in range(start, stop, self.batch_size):
+            j = min(i + self.batch_size, stop)
+            q_values = self.model.predict(self.get_perceptive_fields(series, i, j), verbose=0)
+            actions = np.argmax(q_values, axis=1)
+            accumulator.update(actions, series[i:j], q_values, offset=i)
 
+        return accumulator
 
-    # comparison of data distribution using statistical methods 
-    #--------------------------------------------------------------------------     
+    # comparison of data distribution using statistical methods
+    #--------------------------------------------------------------------------
     def plot_timeseries_prediction(self, values, name, path, dpi=400):
-        
+
 
         train_data = values['train']
         test_data = values['test']
 
         plt.figure(figsize=(12, 10))
-        
+
         plt.scatter(train_data[0], train_data[1], label='True train', color='blue')
-        plt.scatter(test_data[0], test_data[1], label='True test', color='cyan')        
+        plt.scatter(test_data[0], test_data[1], label='True test', color='cyan')
         plt.scatter(train_data[0], train_data[2], label='Predicted train', color='orange')
         plt.scatter(test_data[0], test_data[2], label='Predicted test', color='magenta')
         plt.xlabel('Extraction N.', fontsize=14)
@@ -43,29 +228,54 @@ class BetsAccuracy:
         plot_loc = os.path.join(path, f'{name}.jpeg')
         plt.savefig(plot_loc, bbox_inches='tight', format='jpeg', dpi=dpi)
         plt.show(block=False)
-    
-    # comparison of data distribution using statistical methods 
-    #--------------------------------------------------------------------------     
-    def plot_confusion_matrix(self, Y_real, predictions, name, path, dpi=400): 
-        class_names = ['green', 'black', 'red']        
-        cm = confusion_matrix(Y_real, predictions)    
-        plt.figure(figsize=(14, 14))        
-        sns.heatmap(cm, annot=True, fmt='d', cmap=plt.cm.Blues, cbar=False)        
-        plt.xlabel('Predicted labels', fontsize=14)
-        plt.ylabel('True labels', fontsize=14)
+
+    # counts of bet types against the color of the extracted numbers, taken
+    # from the final counts of the accumulator
+    #--------------------------------------------------------------------------
+    def plot_confusion_matrix(self, accumulator : EvaluationAccumulator, name, path=VALIDATION_PATH, dpi=400):
+        class_names = ['green', 'black', 'red']
+        bet_names = ['straight-up', 'red', 'black', 'stop']
+        cm = accumulator.get_color_confusion()
+        plt.figure(figsize=(14, 14))
+        sns.heatmap(cm, annot=True, fmt='d', cmap=plt.cm.Blues, cbar=False)
+        plt.xlabel('Extracted color', fontsize=14)
+        plt.ylabel('Bet type', fontsize=14)
         plt.title('Confusion Matrix', fontsize=14)
         plt.xticks(np.arange(len(class_names)) + 0.5, class_names, rotation=45, fontsize=12, ha="right")
-        plt.yticks(np.arange(len(class_names)) + 0.5, class_names, rotation=0, fontsize=12, va="center")          
+        plt.yticks(np.arange(len(bet_names)) + 0.5, bet_names, rotation=0, fontsize=12, va="center")
         plt.tight_layout()
         plot_loc = os.path.join(path, f'{name}.jpeg')
         plt.savefig(plot_loc, bbox_inches='tight', format='jpeg', dpi = dpi)
-        plt.show(block=False)
+        plt.close()
 
-    
-        
+    #--------------------------------------------------------------------------
+    def plot_evaluation(self, report : dict, name, path=VALIDATION_PATH):
+        fig, axes = plt.subplots(1, 3, figsize=(24, 7))
+        bet_types = [k for k, v in report['hit_rates'].items() if v['hit_rate'] is not None]
+        positions = np.arange(len(bet_types))
+        axes[0].bar(positions - 0.2, [report['hit_rates'][k]['hit_rate'] for k in bet_types],
+                    width=0.4, color='steelblue', label='Observed')
+        axes[0].bar(positions + 0.2, [report['hit_rates'][k]['fair_hit_rate'] for k in bet_types],
+                    width=0.4, color='lightgray', label='Fair wheel')
+        axes[0].set_xticks(positions, bet_types)
+        axes[0].set_title('Hit rate by bet type', fontsize=14)
+        axes[0].legend()
 
-              
-        
-        
-            
-        
+        windows = report['windows']
+        window_ends = np.array(windows['start']) + np.array(windows['spins'])
+        axes[1].plot(window_ends, windows['cumulative_reward'], color='darkorange', marker='o')
+        axes[1].axhline(0, color='black', linewidth=0.8)
+        axes[1].set_xlabel('Spin', fontsize=12)
+        axes[1].set_title('Cumulative reward', fontsize=14)
+
+        if 'calibration' in report:
+            axes[2].plot(windows['start'], windows['mean_q_value'], marker='o', label='Mean Q-value')
+            axes[2].plot(windows['start'], windows['mean_scaled_reward'], marker='o', label='Mean scaled reward')
+            axes[2].legend()
+        axes[2].set_xlabel('Window start', fontsize=12)
+        axes[2].set_title('Q-value calibration by window', fontsize=14)
+
+        plt.tight_layout()
+        plot_loc = os.path.join(path, f'{name}.{self.file_type}')
+        plt.savefig(plot_loc, bbox_inches='tight', format=self.file_type, dpi=self.DPI)
+        plt.close()
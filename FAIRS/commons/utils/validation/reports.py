@@ -1,21 +1,28 @@
+import os
+import json
+import numpy as np
 import keras
 
-from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.utils.validation.predictions import BetsAccuracy
+from FAIRS.commons.constants import CONFIG, VALIDATION_PATH
 from FAIRS.commons.logger import logger
 
 
 
+# predictions are evaluated in batches over the series, whose statistics are
+# accumulated in constant memory, and plots are produced from the final counts
 ###############################################################################
-def evaluation_report(model : keras.Model, train_dataset, validation_dataset):
-    
-    train_eval = model.evaluate(train_dataset, verbose=1)
-    validation_eval = model.evaluate(validation_dataset, verbose=1)
-    logger.info('Train dataset:')
-    logger.info(f'Loss: {train_eval[0]}')    
-    logger.info(f'Metric: {train_eval[1]}')  
-    logger.info('Test dataset:')
-    logger.info(f'Loss: {validation_eval[0]}')    
-    logger.info(f'Metric: {validation_eval[1]}')
+def evaluation_report(model : keras.Model, configuration : dict, series : np.array, name='evaluation'):
+
+    evaluator = BetsAccuracy(model, configuration)
+    accumulator = evaluator.evaluate_series(series)
+    report = accumulator.get_report()
+    evaluator.plot_confusion_matrix(accumulator, f'{name}_confusion_matrix')
+    evaluator.plot_evaluation(report, name)
+    with open(os.path.join(VALIDATION_PATH, f'{name}.json'), 'w') as file:
+        json.dump(report, file, indent=4)
+
+    return report
 
 ###############################################################################
 def log_training_report(train_data, config : dict):
@@ -1,22 +1,510 @@
 import os
+import json
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+from scipy import stats
 
 from FAIRS.commons.utils.dataloader.serializer import DataSerializer
-from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.utils.process.mapping import RouletteMapper
+from FAIRS.commons.constants import CONFIG, NUMBERS, VALIDATION_PATH
 from FAIRS.commons.logger import logger
 
 
+# [MERGEABLE ACCUMULATORS]
+###############################################################################
+# Each accumulator summarizes a contiguous part of the series with fixed-size
+# statistics. Accumulators of consecutive parts are merged in order, taking
+# into account the pairs and runs crossing their boundary, hence a series can
+# be processed in chunks (or in parallel) with the same results of processing
+# it at once. Each chunk is summarized by a new accumulator which is then
+# merged into the running one
+###############################################################################
+class FrequencyAccumulator:
+
+    def __init__(self):
+        self.counts = np.zeros(NUMBERS, dtype=np.int64)
+
+    #--------------------------------------------------------------------------
+    def update(self, chunk : np.array):
+        self.counts += np.bincount(chunk, minlength=NUMBERS)
+
+    #--------------------------------------------------------------------------
+    def merge(self, other):
+        self.counts += other.counts
+
+
+# red and black runs of the series without green numbers. Runs touching the
+# edges of the summarized part are kept open, as they may continue in the
+# adjacent parts, and are closed when merging or finalizing
+###############################################################################
+class ColorRunsAccumulator:
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.color_counts = np.zeros(2, dtype=np.int64)
+        self.lengths = np.zeros((2, max_length + 1), dtype=np.int64)
+        self.first_run = None
+        self.last_run = None
+        self.single_run = False
+
+    #--------------------------------------------------------------------------
+    def close_run(self, run):
+        color, length = run
+        self.lengths[color, min(length, self.max_length)] += 1
+
+    # colors are 1 for red and 0 for black
+    #--------------------------------------------------------------------------
+    def update(self, colors : np.array):
+        if colors.shape[0] == 0:
+            return
+        chunk = ColorRunsAccumulator(self.max_length)
+        chunk.color_counts += np.bincount(colors, minlength=2)
+        starts = np.flatnonzero(np.r_[True, colors[1:] != colors[:-1]])
+        lengths = np.diff(np.r_[starts, colors.shape[0]])
+        chunk.first_run = (int(colors[0]), int(lengths[0]))
+        chunk.last_run = (int(colors[-1]), int(lengths[-1]))
+        # runs in between are closed on both sides
+        inner_colors, inner_lengths = colors[starts[1:-1]], np.minimum(lengths[1:-1], self.max_length)
+        np.add.at(chunk.lengths, (inner_colors, inner_lengths), 1)
+        chunk.single_run = starts.shape[0] == 1
+        self.merge(chunk)
+
+    #--------------------------------------------------------------------------
+    def merge(self, other):
+        if other.first_run is None:
+            return
+        self.color_counts += other.color_counts
+        self.lengths += other.lengths
+        if self.first_run is None:
+            self.first_run, self.last_run = other.first_run, other.last_run
+            self.single_run = other.single_run
+            return
+
+        if self.last_run[0] == other.first_run[0]:
+            joined = (self.last_run[0], self.last_run[1] + other.first_run[1])
+            if self.single_run and other.single_run:
+                self.first_run = self.last_run = joined
+            elif self.single_run:
+                self.first_run, self.last_run = joined, other.last_run
+            elif other.single_run:
+                self.last_run = joined
+            else:
+                self.close_run(joined)
+                self.last_run = other.last_run
+            self.single_run = self.single_run and other.single_run
+            return
+
+        if not self.single_run:
+            self.close_run(self.last_run)
+        if not other.single_run:
+            self.close_run(other.first_run)
+        self.last_run = other.last_run
+        self.single_run = False
+
+    # open runs are closed on a copy, so that accumulation can continue
+    #--------------------------------------------------------------------------
+    def get_run_lengths(self):
+        lengths = self.lengths.copy()
+        if self.first_run is not None:
+            open_runs = [self.first_run] if self.single_run else [self.first_run, self.last_run]
+            for color, length in open_runs:
+                lengths[color, min(length, self.max_length)] += 1
+
+        return lengths
+
+
+# sums of products of values at several lags, together with the first and last
+# values of the summarized part to add the products crossing its boundaries
+###############################################################################
+class AutocorrelationAccumulator:
+
+    def __init__(self, lags):
+        self.lags = list(lags)
+        self.max_lag = max(self.lags)
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.products = {lag : 0 for lag in self.lags}
+        self.pairs = {lag : 0 for lag in self.lags}
+        self.head = np.zeros(0, dtype=np.int64)
+        self.tail = np.zeros(0, dtype=np.int64)
+
+    # products of integers below 2^53 are exact in float64, hence dot products
+    # can be computed with BLAS and then accumulated as python integers
+    #--------------------------------------------------------------------------
+    def update(self, chunk : np.array):
+        if chunk.shape[0] == 0:
+            return
+        accumulator = AutocorrelationAccumulator(self.lags)
+        values = chunk.astype(np.float64)
+        accumulator.count = chunk.shape[0]
+        accumulator.total = int(chunk.sum(dtype=np.int64))
+        accumulator.squares = int(round(np.dot(values, values)))
+        for lag in self.lags:
+            if chunk.shape[0] > lag:
+                accumulator.products[lag] = int(round(np.dot(values[:-lag], values[lag:])))
+                accumulator.pairs[lag] = chunk.shape[0] - lag
+        accumulator.head = chunk[:self.max_lag].astype(np.int64)
+        accumulator.tail = chunk[-self.max_lag:].astype(np.int64)
+        self.merge(accumulator)
+
+    #--------------------------------------------------------------------------
+    def merge(self, other):
+        if other.count == 0:
+            return
+        # pairs crossing the boundary are made of the last values of this part
+        # and the first values of the other one
+        boundary = np.concatenate([self.tail, other.head])
+        for lag in self.lags:
+            start = max(0, self.tail.shape[0] - lag)
+            stop = min(self.tail.shape[0], boundary.shape[0] - lag)
+            if stop > start:
+                self.products[lag] += int(np.dot(boundary[start:stop], boundary[start + lag:stop + lag]))
+                self.pairs[lag] += stop - start
+            self.products[lag] += other.products[lag]
+            self.pairs[lag] += other.pairs[lag]
+
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        self.head = np.concatenate([self.head, other.head])[:self.max_lag]
+        self.tail = np.concatenate([self.tail, other.tail])[-self.max_lag:]
+
+    #--------------------------------------------------------------------------
+    def get_autocorrelation(self):
+        mean = self.total/max(self.count, 1)
+        variance = self.squares/max(self.count, 1) - mean**2
+
+        return {lag : (self.products[lag]/self.pairs[lag] - mean**2)/variance
+                if self.pairs[lag] > 0 and variance > 0 else 0.0 for lag in self.lags}
+
+
+# counts of transitions between consecutive numbers
+###############################################################################
+class TransitionAccumulator:
+
+    def __init__(self):
+        self.transitions = np.zeros((NUMBERS, NUMBERS), dtype=np.int64)
+        self.first_number = None
+        self.last_number = None
+
+    #--------------------------------------------------------------------------
+    def update(self, chunk : np.array):
+        if chunk.shape[0] == 0:
+            return
+        accumulator = TransitionAccumulator()
+        pairs = chunk[:-1].astype(np.int64) * NUMBERS + chunk[1:]
+        accumulator.transitions += np.bincount(pairs, minlength=NUMBERS**2).reshape(NUMBERS, NUMBERS)
+        accumulator.first_number, accumulator.last_number = int(chunk[0]), int(chunk[-1])
+        self.merge(accumulator)
+
+    #--------------------------------------------------------------------------
+    def merge(self, other):
+        if other.first_number is None:
+            return
+        self.transitions += other.transitions
+        if self.last_number is not None:
+            self.transitions[self.last_number, other.first_number] += 1
+        else:
+            self.first_number = other.first_number
+        self.last_number = other.last_number
+
+
 # [VALIDATION OF DATA]
 ###############################################################################
+# Streaming diagnostics of the randomness of a roulette series, used to tell
+# whether a wheel shows any deviation worth modeling before training on it.
+# The series is processed in chunks of fixed size, hence memory is bounded for
+# any length of the series, and the following tests are run at the end:
+# - chi-square of number and wheel sector frequencies against uniform
+# - Wald-Wolfowitz runs test of red and black, and chi-square of color run
+#   lengths against the geometric distribution
+# - serial autocorrelation at several lags
+# - chi-square of the transition matrix against independent spins
+# - drift, as the share of fixed windows whose number frequencies are not
+#   uniform, compared with the significance level
+# Plots are only produced once the whole series has been processed
+###############################################################################
 class RouletteSeriesValidation:
 
-    def __init__(self, train_data, validation_data):
+    def __init__(self, configuration):
         self.DPI = 400
         self.file_type = 'jpeg'
-        self.train_data = train_data
-        self.validation_data = validation_data
-        self.serializer = DataSerializer()
-        
+        self.configuration = configuration
+        self.serializer = DataSerializer(configuration)
+        self.chunk_size = CONFIG['series_validation']['CHUNK_SIZE']
+        self.num_sectors = CONFIG['series_validation']['SECTORS']
+        self.drift_window = CONFIG['series_validation']['DRIFT_WINDOW']
+        self.significance = CONFIG['series_validation']['SIGNIFICANCE']
+
+        mapper = RouletteMapper()
+        encoding_table = mapper.get_encoding_table()
+        self.sectors = encoding_table[:, 1] * self.num_sectors // NUMBERS
+        # colors of red and black numbers (1 and 0), with green numbers removed
+        self.red_numbers = np.isin(np.arange(NUMBERS), mapper.color_map['red'])
+        self.green_numbers = np.isin(np.arange(NUMBERS), mapper.color_map['green'])
+        self.reset()
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self.frequencies = FrequencyAccumulator()
+        self.color_runs = ColorRunsAccumulator(CONFIG['series_validation']['MAX_RUN_LENGTH'])
+        self.autocorrelation = AutocorrelationAccumulator(CONFIG['series_validation']['LAGS'])
+        self.transitions = TransitionAccumulator()
+        self.window_counts = np.zeros(NUMBERS, dtype=np.int64)
+        self.window_start = 0
+        self.windows = []
+        self.num_spins = 0
+
+    # number frequencies are also accumulated over fixed windows of the series,
+    # independently of the chunk boundaries
+    #--------------------------------------------------------------------------
+    def update_drift(self, chunk : np.array):
+        start = 0
+        while start < chunk.shape[0]:
+            window_spins = int(self.window_counts.sum())
+            stop = min(chunk.shape[0], start + self.drift_window - window_spins)
+            self.window_counts += np.bincount(chunk[start:stop], minlength=NUMBERS)
+            if window_spins + stop - start == self.drift_window:
+                self.close_window()
+            start = stop
+
+    #--------------------------------------------------------------------------
+    def get_window_record(self):
+        spins = int(self.window_counts.sum())
+        chi_square, p_value = stats.chisquare(self.window_counts)
+
+        return {'start' : self.window_start,
+                'spins' : spins,
+                'chi_square' : float(chi_square),
+                'p_value' : float(p_value),
+                'red_share' : float(self.window_counts[self.red_numbers].sum()/spins),
+                'zero_share' : float(self.window_counts[0]/spins)}
+
+    #--------------------------------------------------------------------------
+    def close_window(self):
+        self.windows.append(self.get_window_record())
+        self.window_start += self.drift_window
+        self.window_counts[:] = 0
+
+    #--------------------------------------------------------------------------
+    def update(self, chunk : np.array):
+        chunk = np.asarray(chunk, dtype=np.int64)
+        if chunk.shape[0] == 0:
+            return
+        if chunk.min() < 0 or chunk.max() >= NUMBERS:
+            raise ValueError(f'Roulette extractions must be between 0 and {NUMBERS - 1}')
+        self.frequencies.update(chunk)
+        self.color_runs.update(self.red_numbers[chunk[~self.green_numbers[chunk]]].astype(np.int64))
+        self.autocorrelation.update(chunk)
+        self.transitions.update(chunk)
+        self.num_spins += chunk.shape[0]
+        self.update_drift(chunk)
+
+    # extractions are read in chunks from the .csv dataset or memory-mapped from
+    # a .npy file (such as the preprocessed data of a checkpoint)
+    #--------------------------------------------------------------------------
+    def iterate_chunks(self, path):
+        if path.endswith('.npy'):
+            data = np.load(path, mmap_mode='r')
+            data = data[:, 0] if data.ndim > 1 else data
+            for start in range(0, data.shape[0], self.chunk_size):
+                yield np.asarray(data[start:start + self.chunk_size])
+        else:
+            for chunk in pd.read_csv(path, encoding='utf-8', sep=';', usecols=['timeseries'],
+                                     chunksize=self.chunk_size):
+                yield chunk['timeseries'].to_numpy()
+
+    #--------------------------------------------------------------------------
+    def validate_series(self, series : np.array):
+        self.reset()
+        for start in range(0, series.shape[0], self.chunk_size):
+            self.update(series[start:start + self.chunk_size])
+
+        return self.get_report()
+
+    #--------------------------------------------------------------------------
+    def validate_file(self, path):
+        self.reset()
+        for chunk in self.iterate_chunks(path):
+            self.update(chunk)
+            logger.debug(f'{self.num_spins} extractions processed')
+
+        return self.get_report()
+
+    # bins of run lengths are pooled from the tail until each expected count is
+    # at least 5, as required by the chi-square approximation
+    #--------------------------------------------------------------------------
+    def run_lengths_test(self, lengths : np.array):
+        chi_square, degrees = 0.0, 0
+        for color in [0, 1]:
+            observed = lengths[color, 1:].astype(np.float64)
+            num_runs = observed.sum()
+            if num_runs == 0:
+                continue
+            # continuation probability of a run, estimated from the color share
+            share = self.color_runs.color_counts[color]/self.color_runs.color_counts.sum()
+            expected = num_runs * (1 - share) * share**np.arange(observed.shape[0])
+            expected[-1] = num_runs * share**(observed.shape[0] - 1)
+            last_bin = max(1, int(np.sum(expected >= 5)))
+            observed = np.r_[observed[:last_bin - 1], observed[last_bin - 1:].sum()]
+            expected = np.r_[expected[:last_bin - 1], expected[last_bin - 1:].sum()]
+            chi_square += float(np.sum((observed - expected)**2/expected))
+            degrees += observed.shape[0] - 2
+
+        p_value = float(stats.chi2.sf(chi_square, degrees)) if degrees > 0 else 1.0
+
+        return {'chi_square' : chi_square, 'dof' : degrees, 'p_value' : p_value}
+
+    #--------------------------------------------------------------------------
+    def runs_test(self, lengths : np.array):
+        # counts are cast to float, as their products overflow 64-bit integers
+        num_black, num_red = (float(x) for x in self.color_runs.color_counts)
+        total = num_black + num_red
+        num_runs = int(lengths.sum())
+        if num_black == 0 or num_red == 0 or total < 2:
+            return {'runs' : num_runs, 'z_score' : 0.0, 'p_value' : 1.0}
+        expected = 2 * num_black * num_red/total + 1
+        variance = 2 * num_black * num_red * (2 * num_black * num_red - total)/(total**2 * (total - 1))
+        z_score = (num_runs - expected)/np.sqrt(variance)
+
+        return {'runs' : num_runs, 'expected_runs' : float(expected), 'z_score' : float(z_score),
+                'p_value' : float(2 * stats.norm.sf(abs(z_score)))}
+
+    #--------------------------------------------------------------------------
+    def get_report(self):
+        if self.num_spins == 0:
+            raise ValueError('No roulette extractions have been processed')
+        counts = self.frequencies.counts
+        number_chi_square, number_p_value = stats.chisquare(counts)
+        sector_counts = np.bincount(self.sectors, weights=counts, minlength=self.num_sectors)
+        sector_sizes = np.bincount(self.sectors, minlength=self.num_sectors)
+        sector_chi_square, sector_p_value = stats.chisquare(
+            sector_counts, self.num_spins * sector_sizes/NUMBERS)
+
+        lengths = self.color_runs.get_run_lengths()
+        autocorrelation = self.autocorrelation.get_autocorrelation()
+        autocorrelation = {lag : {'value' : float(value),
+                                  'z_score' : float(value * np.sqrt(self.autocorrelation.pairs[lag])),
+                                  'p_value' : float(2 * stats.norm.sf(abs(value) *
+                                                    np.sqrt(self.autocorrelation.pairs[lag])))}
+                           for lag, value in autocorrelation.items()}
+
+        # expected transitions follow the frequencies of the previous and next
+        # numbers, hence biased numbers alone do not make the test significant
+        transitions = self.transitions.transitions.astype(np.float64)
+        expected = np.outer(transitions.sum(axis=1), transitions.sum(axis=0))/max(transitions.sum(), 1)
+        valid = expected > 0
+        transition_chi_square = float(np.sum((transitions[valid] - expected[valid])**2/expected[valid]))
+        transition_dof = ((int(np.sum(transitions.sum(axis=1) > 0)) - 1) *
+                          (int(np.sum(transitions.sum(axis=0) > 0)) - 1))
+
+        # the last window is included only if at least half full
+        windows = list(self.windows)
+        if self.window_counts.sum() >= max(self.drift_window//2, 1):
+            windows.append(self.get_window_record())
+        significant_windows = sum(w['p_value'] < self.significance for w in windows)
+        drift_p_value = float(stats.binomtest(significant_windows, len(windows), self.significance,
+                                              alternative='greater').pvalue) if windows else 1.0
+
+        tests = {'number_frequency' : {'chi_square' : float(number_chi_square), 'dof' : NUMBERS - 1,
+                                       'p_value' : float(number_p_value)},
+                 'sector_frequency' : {'chi_square' : float(sector_chi_square), 'dof' : self.num_sectors - 1,
+                                       'p_value' : float(sector_p_value)},
+                 'color_runs' : self.runs_test(lengths),
+                 'color_run_lengths' : self.run_lengths_test(lengths),
+                 'transitions' : {'chi_square' : transition_chi_square, 'dof' : transition_dof,
+                                  'p_value' : float(stats.chi2.sf(transition_chi_square, transition_dof))
+                                  if transition_dof > 0 else 1.0},
+                 'drift' : {'windows' : len(windows), 'significant_windows' : significant_windows,
+                            'p_value' : drift_p_value}}
+        for lag, values in autocorrelation.items():
+            tests[f'autocorrelation_lag_{lag}'] = values
+
+        # Bonferroni correction over all tests
+        threshold = self.significance/len(tests)
+        rejected = [name for name, test in tests.items() if test['p_value'] < threshold]
+        report = {'spins' : self.num_spins,
+                  'significance' : self.significance,
+                  'corrected_significance' : threshold,
+                  'tests' : tests,
+                  'rejected_tests' : rejected,
+                  'worth_modeling' : len(rejected) > 0,
+                  'drift_windows' : windows}
+
+        for name, test in tests.items():
+            logger.info(f'{name}: p-value {test["p_value"]:.4g}')
+        if rejected:
+            logger.info(f'Deviations from a fair wheel found in {rejected}, the series may be worth modeling')
+        else:
+            logger.info(f'No deviation from a fair wheel over {self.num_spins} extractions, '
+                        'the series is unlikely to be worth modeling')
+
+        return report
+
+    #--------------------------------------------------------------------------
+    def save_report(self, report, name='series_validation', path=VALIDATION_PATH):
+        report_path = os.path.join(path, f'{name}.json')
+        with open(report_path, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    # all plots are produced from the accumulators once the series is processed
+    #--------------------------------------------------------------------------
+    def plot_diagnostics(self, report, name='series_validation', path=VALIDATION_PATH):
+        fig, axes = plt.subplots(2, 3, figsize=(24, 13))
+        counts = self.frequencies.counts
+        expected = self.num_spins/NUMBERS
+        axes[0, 0].bar(np.arange(NUMBERS), (counts - expected)/np.sqrt(expected), color='steelblue')
+        axes[0, 0].axhline(0, color='black', linewidth=0.8)
+        axes[0, 0].set_title('Number frequency (standardized residuals)', fontsize=14)
+
+        transitions = self.transitions.transitions.astype(np.float64)
+        expected = np.outer(transitions.sum(axis=1), transitions.sum(axis=0))/max(transitions.sum(), 1)
+        residuals = np.divide(transitions - expected, np.sqrt(expected),
+                              out=np.zeros_like(expected), where=expected > 0)
+        image = axes[0, 1].imshow(residuals, cmap='coolwarm', vmin=-4, vmax=4)
+        fig.colorbar(image, ax=axes[0, 1])
+        axes[0, 1].set_xlabel('Next number')
+        axes[0, 1].set_ylabel('Previous number')
+        axes[0, 1].set_title('Transitions (standardized residuals)', fontsize=14)
+
+        lags = self.autocorrelation.lags
+        values = [report['tests'][f'autocorrelation_lag_{lag}']['value'] for lag in lags]
+        bound = 1.96/np.sqrt(self.num_spins)
+        axes[0, 2].bar([str(lag) for lag in lags], values, color='darkorange')
+        axes[0, 2].axhline(bound, color='red', linestyle='--')
+        axes[0, 2].axhline(-bound, color='red', linestyle='--')
+        axes[0, 2].set_title('Serial autocorrelation by lag', fontsize=14)
+
+        lengths = self.color_runs.get_run_lengths()
+        run_lengths = np.arange(1, lengths.shape[1])
+        for color, label in [(1, 'red'), (0, 'black')]:
+            share = self.color_runs.color_counts[color]/max(self.color_runs.color_counts.sum(), 1)
+            axes[1, 0].plot(run_lengths, lengths[color, 1:], 'o', color=label, label=f'{label} observed')
+            axes[1, 0].plot(run_lengths, lengths[color, 1:].sum() * (1 - share) * share**(run_lengths - 1),
+                            '-', color=label, alpha=0.5, label=f'{label} expected')
+        axes[1, 0].set_yscale('log')
+        axes[1, 0].set_xlabel('Run length (last bin includes longer runs)')
+        axes[1, 0].legend()
+        axes[1, 0].set_title('Color run lengths', fontsize=14)
+
+        windows = report['drift_windows']
+        starts = [w['start'] for w in windows]
+        axes[1, 1].plot(starts, [w['p_value'] for w in windows], 'o-', color='steelblue')
+        axes[1, 1].axhline(self.significance, color='red', linestyle='--')
+        axes[1, 1].set_yscale('log')
+        axes[1, 1].set_xlabel('Window start')
+        axes[1, 1].set_title('Number frequency p-value by window', fontsize=14)
+        axes[1, 2].plot(starts, [w['red_share'] for w in windows], 'o-', color='red', label='red')
+        axes[1, 2].plot(starts, [w['zero_share'] for w in windows], 'o-', color='green', label='zero')
+        axes[1, 2].axhline(18/NUMBERS, color='red', linestyle='--', alpha=0.5)
+        axes[1, 2].axhline(1/NUMBERS, color='green', linestyle='--', alpha=0.5)
+        axes[1, 2].set_xlabel('Window start')
+        axes[1, 2].legend()
+        axes[1, 2].set_title('Red and zero shares by window', fontsize=14)
 
-    
\ No newline at end of file
+        plt.tight_layout()
+        plot_loc = os.path.join(path, f'{name}.{self.file_type}')
+        plt.savefig(plot_loc, bbox_inches='tight', format=self.file_type, dpi=self.DPI)
+        plt.close()
@@ -0,0 +1,38 @@
+# [SET KERAS BACKEND]
+import os
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+from FAIRS.commons.utils.dataloader.exported import ExportedModelSerializer
+from FAIRS.commons.utils.learning.compiler import FAIRSnetCompiler
+from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [LOAD MODEL]
+    #--------------------------------------------------------------------------
+    # selected and load the pretrained model using keras
+    modelserializer = ModelSerializer()
+    model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint()
+
+    # 2. [EXPORT MODEL]
+    #--------------------------------------------------------------------------
+    # compile FAIRSnet into lookup tables and verify them against the original
+    # model, then save the tables as memory-mappable numpy arrays that can be
+    # used for inference without importing keras or torch
+    compiler = FAIRSnetCompiler(configuration)
+    lookup_model = compiler.compile(model, verify=False)
+    max_error = compiler.verify_equivalence(model, lookup_model)
+    exporter = ExportedModelSerializer()
+    exporter.save_exported_model(lookup_model, checkpoint_path,
+                                 metadata={'source' : 'saved_model.keras',
+                                           'max_error' : float(max_error)})
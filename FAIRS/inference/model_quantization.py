@@ -0,0 +1,56 @@
+# [SET KERAS BACKEND]
+import os
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+import json
+import numpy as np
+from FAIRS.commons.utils.dataloader.generators import RouletteGenerator
+from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+from FAIRS.commons.utils.learning.inference import RoulettePlayer
+from FAIRS.commons.utils.learning.quantization import FAIRSnetQuantizer
+from FAIRS.commons.constants import CONFIG, PRED_PATH
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [LOAD MODEL]
+    #--------------------------------------------------------------------------
+    # selected and load the pretrained model in full precision
+    modelserializer = ModelSerializer()
+    model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint()
+
+    # 2. [LOAD DATA]
+    #--------------------------------------------------------------------------
+    # load the timeseries used to backtest the quantized model, and generate all
+    # perceptive fields over the roulette series
+    generator = RouletteGenerator(configuration)
+    dataset_path = os.path.join(PRED_PATH, 'FAIRS_predictions.csv')
+    prediction_dataset = generator.prepare_roulette_dataset(dataset_path)
+    player = RoulettePlayer(model, configuration)
+    perceptive_fields = np.stack(player.get_perceptive_fields(prediction_dataset, fraction=1.0))
+
+    # 3. [QUANTIZE MODEL]
+    #--------------------------------------------------------------------------
+    # quantize dense layers to int8 with dynamic activations quantization, then
+    # save the quantized model alongside the keras model in the checkpoint folder
+    logger.info('Quantizing FAIRSnet dense layers to int8')
+    quantizer = FAIRSnetQuantizer(configuration)
+    quantized_model = quantizer.quantize(model)
+    quantizer.save_quantized_model(quantized_model, checkpoint_path)
+
+    # 4. [EVALUATE QUANTIZED MODEL]
+    #--------------------------------------------------------------------------
+    # compare actions, latency and memory of the quantized and float models
+    report = quantizer.evaluate(model, quantized_model, perceptive_fields)
+    report_path = os.path.join(checkpoint_path, 'quantization_report.json')
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    logger.info(f'Quantization report has been saved in {report_path}')
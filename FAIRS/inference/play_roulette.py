@@ -8,8 +8,9 @@ warnings.simplefilter(action='ignore', category=Warning)
 
 # [IMPORT CUSTOM MODULES]
 from FAIRS.commons.utils.dataloader.generators import RouletteGenerator
-from FAIRS.commons.utils.learning.inference import RoulettePlayer, save_predictions_to_csv
-from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+from FAIRS.commons.utils.dataloader.exported import ExportedModelSerializer
+from FAIRS.commons.utils.dataloader.writers import PredictionsWriter
+from FAIRS.commons.utils.learning.inference import RoulettePlayer
 from FAIRS.commons.constants import CONFIG, PRED_PATH
 from FAIRS.commons.logger import logger
 
@@ -20,11 +21,60 @@ if __name__ == '__main__':
 
     # 1. [LOAD MODEL]
     #--------------------------------------------------------------------------  
-    # selected and load the pretrained model, then print the summary 
-    modelserializer = ModelSerializer()         
-    model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint()    
-    model.summary(expand_nested=True)   
-    print()       
+    # a statistical baseline policy is used in place of a checkpoint if selected
+    online_learner = None
+    if CONFIG['inference']['BASELINE'] is not None:
+        from FAIRS.commons.utils.learning.baselines import get_baseline_policy
+        model, configuration = get_baseline_policy(CONFIG['inference']['BASELINE']), CONFIG
+        checkpoint_path = f'baseline_{CONFIG["inference"]["BASELINE"]}'
+
+    # load the exported numpy model if selected, which does not require keras
+    elif CONFIG['inference']['EXPORTED']:
+        exporter = ExportedModelSerializer()
+        model, configuration, checkpoint_path = exporter.select_and_load_exported_model()
+
+    # otherwise select and load the pretrained model, then print the summary.
+    # Keras and torch are imported only here, as they dominate startup time
+    else:
+        from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+        from FAIRS.commons.utils.learning.compiler import FAIRSnetCompiler
+        from FAIRS.commons.utils.learning.execution import CPUExecutionPolicy, BFloat16Model
+        from FAIRS.commons.utils.learning.compilation import CompiledFAIRSnet, enable_compile_cache
+        modelserializer = ModelSerializer()         
+        # the int8 quantized model is loaded in place of the keras model if selected
+        quantized = CONFIG['inference']['QUANTIZED']
+        model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint(
+            quantized, CONFIG['inference']['RAW_WEIGHTS'])    
+        if not quantized:
+            model.summary(expand_nested=True)   
+            print()       
+        # single-sample predictions use the latency-oriented threads profile
+        CPUExecutionPolicy(configuration).apply('acting')
+        # keep training the keras model with the spins observed in real time.
+        # Predictions are then served by the float32 acting copies of the learner,
+        # hence lookup tables, compilation and bfloat16 are not applied
+        if CONFIG['online_learning']['ENABLED'] and CONFIG['inference']['ONLINE'] and not quantized:
+            from FAIRS.commons.utils.learning.online import OnlineLearner
+            online_learner = OnlineLearner(model, configuration, checkpoint_path)
+            if (CONFIG['inference']['LOOKUP_TABLES'] or CONFIG['model']['JIT_COMPILE'] 
+                or CONFIG['inference']['BF16']):
+                logger.warning('Lookup tables, JIT compilation and bfloat16 are not used with online learning')
+        optimized = not quantized and online_learner is None
+
+        # replace the per-position layers of FAIRSnet with precomputed lookup tables
+        # and verify that the compiled model matches the original one
+        if CONFIG['inference']['LOOKUP_TABLES'] and optimized:
+            compiler = FAIRSnetCompiler(configuration)
+            model = compiler.compile(model, verify=True)
+        # otherwise compile the forward pass for single-sample predictions and
+        # for the batches of past extractions
+        elif CONFIG['model']['JIT_COMPILE'] and optimized:
+            enable_compile_cache()
+            model = CompiledFAIRSnet(model, configuration, batch_size=CONFIG['inference']['BATCH_SIZE'])
+            model.warmup(train=False)
+        # run predictions under bfloat16 autocast if selected
+        if CONFIG['inference']['BF16'] and optimized and not CONFIG['inference']['LOOKUP_TABLES']:
+            model = BFloat16Model(model)
    
     # 1. [LOAD DATA]
     #-------------------------------------------------------------------------- 
@@ -36,16 +86,19 @@ if __name__ == '__main__':
  
     # 2. [START PREDICTIONS]
     #--------------------------------------------------------------------------
+    # predictions are saved in the predictions folder as they are produced,
+    # followed by the numbers entered during real time play or streamed
     logger.info('Start predicting most rewarding actions with the selected model')    
-    generator = RoulettePlayer(model, configuration)       
-    roulette_predictions = generator.play_past_roulette_games(prediction_dataset)
-
-    if CONFIG['inference']['ONLINE']:
-        roulette_predictions = generator.play_real_time_roulette()
-
-    # save predictions as .csv file in the predictions folder
-    save_predictions_to_csv(roulette_predictions, os.path.basename(checkpoint_path))
-
-    
+    generator = RoulettePlayer(model, configuration, online_learner)
+    with PredictionsWriter(os.path.basename(checkpoint_path), generator.action_descriptions) as writer:
+        generator.play_past_roulette_games(prediction_dataset, writer)
 
-    
\ No newline at end of file
+        # spins are either streamed from files and local sockets or entered manually
+        if CONFIG['inference']['ONLINE'] and CONFIG['streaming']['ENABLED']:
+            from FAIRS.commons.utils.dataloader.streaming import SpinIngestion, SpinDatasetAppender
+            ingestion = SpinIngestion()
+            if CONFIG['streaming']['APPEND_DATASET']:
+                ingestion.add_sink(SpinDatasetAppender().append_spins)
+            generator.play_streamed_roulette(ingestion, writer)
+        elif CONFIG['inference']['ONLINE']:
+            generator.play_real_time_roulette(writer)
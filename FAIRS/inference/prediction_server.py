@@ -0,0 +1,49 @@
+# [SET KERAS BACKEND]
+import os
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+from FAIRS.commons.utils.dataloader.exported import ExportedModelSerializer
+from FAIRS.commons.utils.learning.server import PredictionServer
+from FAIRS.commons.constants import CONFIG
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [LOAD MODEL]
+    #--------------------------------------------------------------------------
+    # the model is loaded only once, using the exported numpy model if selected
+    if CONFIG['inference']['EXPORTED']:
+        exporter = ExportedModelSerializer()
+        model, configuration, checkpoint_path = exporter.select_and_load_exported_model()
+    else:
+        from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+        from FAIRS.commons.utils.learning.execution import CPUExecutionPolicy, BFloat16Model
+        from FAIRS.commons.utils.learning.compilation import CompiledFAIRSnet, enable_compile_cache
+        modelserializer = ModelSerializer()
+        model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint(
+            CONFIG['inference']['QUANTIZED'], CONFIG['inference']['RAW_WEIGHTS'])
+        CPUExecutionPolicy(configuration).apply('acting')
+        # forward passes are compiled for single requests and full micro-batches
+        if CONFIG['model']['JIT_COMPILE'] and not CONFIG['inference']['QUANTIZED']:
+            enable_compile_cache()
+            model = CompiledFAIRSnet(model, configuration, CONFIG['server']['MAX_BATCH_SIZE'])
+            model.warmup(train=False)
+        if CONFIG['inference']['BF16'] and not CONFIG['inference']['QUANTIZED']:
+            model = BFloat16Model(model)
+
+    # 2. [START SERVER]
+    #--------------------------------------------------------------------------
+    # serve spin events of many tables on localhost, keeping a rolling perceptive
+    # field for each table and answering concurrent requests in micro-batches.
+    # Spins are posted to /spin and serving statistics are available at /stats
+    logger.info(f'Serving predictions of {os.path.basename(checkpoint_path)}')
+    server = PredictionServer(model, configuration)
+    server.run()
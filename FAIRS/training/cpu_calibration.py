@@ -0,0 +1,51 @@
+# [SET KERAS BACKEND]
+import os 
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+import json
+from FAIRS.commons.utils.learning.models import FAIRSnet
+from FAIRS.commons.utils.learning.execution import CPUCalibrator
+from FAIRS.commons.utils.learning.compilation import CompiledFAIRSnet, enable_compile_cache
+from FAIRS.commons.constants import CONFIG, VALIDATION_PATH
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [BUILD MODEL]
+    #--------------------------------------------------------------------------
+    # the model is built from the current configurations, so that calibration
+    # reflects the model size that is going to be trained
+    learner = FAIRSnet(CONFIG)
+    model = learner.get_model(model_summary=False)
+
+    # 2. [CALIBRATE CPU THREADS]
+    #--------------------------------------------------------------------------
+    # measure single-sample forward passes and training steps across thread
+    # counts, then recommend the ACTING_THREADS and LEARNING_THREADS settings
+    logger.info('Measuring forward pass and training step time across CPU thread counts')
+    calibrator = CPUCalibrator(CONFIG)
+    report = calibrator.calibrate(model)
+
+    # 3. [BENCHMARK BFLOAT16]
+    #--------------------------------------------------------------------------
+    # compare float32 with bfloat16 autocast, to evaluate the BF16 settings
+    logger.info('Comparing float32 and bfloat16 autocast throughput')
+    report['bfloat16'] = calibrator.benchmark_precision(model)
+    # the compiled model is benchmarked as well if JIT compilation is selected
+    if CONFIG['model']['JIT_COMPILE']:
+        enable_compile_cache()
+        compiled_model = CompiledFAIRSnet(model, CONFIG)
+        report['bfloat16_compiled'] = calibrator.benchmark_precision(compiled_model)
+
+    report_path = os.path.join(VALIDATION_PATH, 'cpu_calibration.json')
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    logger.info(f'Calibration report has been saved in {report_path}')
@@ -0,0 +1,36 @@
+# [SET KERAS BACKEND]
+import os 
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+from FAIRS.commons.utils.dataloader.generators import RouletteGenerator
+from FAIRS.commons.utils.learning.sweeps import HyperparameterSweep
+from FAIRS.commons.constants import CONFIG, DATA_PATH, DATASET_NAME
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [LOAD DATA]
+    #-------------------------------------------------------------------------- 
+    # the roulette series is processed only once and shared by all trials    
+    logger.info(f'Loading FAIRS dataset from {DATA_PATH}')           
+    generator = RouletteGenerator(CONFIG)    
+    dataset_path = os.path.join(DATA_PATH, DATASET_NAME) 
+    roulette_dataset = generator.prepare_roulette_dataset(dataset_path)    
+
+    # 2. [RUN SWEEP]
+    #--------------------------------------------------------------------------
+    # expand the sweep parameters into trial configurations, which are trained
+    # in a pool of processes. Each trial is saved as a checkpoint and the results
+    # table ranking all checkpoints is saved in resources/sweeps
+    sweep = HyperparameterSweep(CONFIG)
+    results = sweep.run_sweep(roulette_dataset)
+    if not results.empty:
+        logger.info(f'Best checkpoint: {results["checkpoint"].iloc[0]}')
@@ -0,0 +1,68 @@
+# [SET KERAS BACKEND]
+import os
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+import json
+from FAIRS.commons.utils.dataloader.generators import RouletteGenerator
+from FAIRS.commons.utils.validation.backtesting import MonteCarloBacktester
+from FAIRS.commons.utils.learning.baselines import BASELINE_POLICIES, get_baseline_policy
+from FAIRS.commons.constants import CONFIG, DATA_PATH, DATASET_NAME, VALIDATION_PATH
+from FAIRS.commons.logger import logger
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [LOAD POLICY]
+    #--------------------------------------------------------------------------
+    # the policy is either a pretrained checkpoint, a statistical baseline or a
+    # fixed betting strategy
+    policy = CONFIG['backtest']['POLICY']
+    if policy == 'FAIRSnet':
+        if CONFIG['inference']['EXPORTED']:
+            from FAIRS.commons.utils.dataloader.exported import ExportedModelSerializer
+            exporter = ExportedModelSerializer()
+            model, configuration, checkpoint_path = exporter.select_and_load_exported_model()
+        else:
+            from FAIRS.commons.utils.dataloader.serializer import ModelSerializer
+            modelserializer = ModelSerializer()
+            model, configuration, history, checkpoint_path = modelserializer.select_and_load_checkpoint(
+                CONFIG['inference']['QUANTIZED'], CONFIG['inference']['RAW_WEIGHTS'])
+        policy_name = os.path.basename(checkpoint_path)
+    elif policy in BASELINE_POLICIES:
+        model, configuration = get_baseline_policy(policy), CONFIG
+        policy_name = f'baseline_{policy}'
+    else:
+        model, configuration = None, CONFIG
+        policy_name = f'always_{policy}'
+
+    # 2. [LOAD DATA]
+    #--------------------------------------------------------------------------
+    # use the whole historical series of roulette extractions
+    generator = RouletteGenerator(configuration)
+    dataset_path = os.path.join(DATA_PATH, DATASET_NAME)
+    series = generator.prepare_roulette_dataset(dataset_path)[:, 0]
+    logger.info(f'Backtesting {policy_name} over {series.shape[0]} roulette extractions')
+
+    # 3. [SIMULATE BANKROLLS]
+    #--------------------------------------------------------------------------
+    # actions are computed once over the whole series, then the bankroll is
+    # simulated for many episodes with random start offsets and lengths
+    backtester = MonteCarloBacktester(configuration)
+    if policy in BASELINE_POLICIES:
+        actions = backtester.get_baseline_actions(model, series)
+    elif model is not None:
+        actions = backtester.get_model_actions(model, series)
+    else:
+        actions = backtester.get_fixed_actions(policy, series)
+
+    summary, distributions = backtester.simulate(actions, series)
+    backtester.plot_distributions(distributions, f'backtest_{policy_name}')
+    with open(os.path.join(VALIDATION_PATH, f'backtest_{policy_name}.json'), 'w') as file:
+        json.dump(summary, file, indent=4)
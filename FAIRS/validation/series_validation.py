@@ -0,0 +1,29 @@
+# [SET KERAS BACKEND]
+import os
+os.environ["KERAS_BACKEND"] = "torch"
+
+# [SETTING WARNINGS]
+import warnings
+warnings.simplefilter(action='ignore', category=Warning)
+
+# [IMPORT CUSTOM MODULES]
+from FAIRS.commons.utils.validation.timeseries import RouletteSeriesValidation
+from FAIRS.commons.constants import CONFIG, DATA_PATH, DATASET_NAME
+
+
+# [RUN MAIN]
+###############################################################################
+if __name__ == '__main__':
+
+    # 1. [VALIDATE SERIES]
+    #--------------------------------------------------------------------------
+    # the historical series is read in chunks, whose statistics are accumulated
+    # so that the whole series is never held in memory
+    validator = RouletteSeriesValidation(CONFIG)
+    dataset_path = os.path.join(DATA_PATH, DATASET_NAME)
+    report = validator.validate_file(dataset_path)
+
+    # 2. [SAVE REPORT]
+    #--------------------------------------------------------------------------
+    validator.save_report(report)
+    validator.plot_diagnostics(report)
@@ -28,8 +28,8 @@ echo Install python libraries and packages
 call pip install torch==2.5.0+cu124 torchvision==0.20.0+cu124 --extra-index-url https://download.pytorch.org/whl/cu124
 call pip install tensorflow-cpu==2.18.0 keras==3.6.0 
 call pip install -U tensorboard-plugin-profile==2.17.0
-call pip install scikit-learn==1.5.2 matplotlib==3.9.2 
-call pip install numpy==2.1.2 pandas==2.2.3 tqdm==4.66.4 
+call pip install scikit-learn==1.5.2 threadpoolctl==3.5.0 matplotlib==3.9.2 
+call pip install numpy==2.1.2 pandas==2.2.3 pyarrow==17.0.0 tqdm==4.66.4 
 call pip install jupyter==1.1.1
 
 :: [INSTALL TRITON] 